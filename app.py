@@ -1,23 +1,50 @@
+import argparse
 import diskcache
+from flask import jsonify, Response
 from dash import Dash
 import dash_bootstrap_components as dbc
 from dash.long_callback import DiskcacheLongCallbackManager
-from dash_bootstrap_templates import load_figure_template
 
 from src.layout import layout
 from src.callbacks import register_callbacks
+from src.instrumentation import render_metrics
+from src.scheduler import start_background_refresh, get_snapshot_info
 
 
 cache = diskcache.Cache("./cache")
 long_callback_manager = DiskcacheLongCallbackManager(cache)
 
-load_figure_template("darkly")
 dbc_css = "https://cdn.jsdelivr.net/gh/AnnMarieW/dash-bootstrap-templates/dbc.min.css"
 app = Dash(external_stylesheets=[dbc.themes.DARKLY, dbc_css], long_callback_manager=long_callback_manager)
 
 app.layout = layout
 register_callbacks(app)
+server = app.server # WSGI entry point of the multi-process serving mode (see gunicorn.conf.py)
+
+
+@app.server.route("/version")
+def version():
+    """ Return the version of the most recent market data snapshot. """
+    return jsonify(get_snapshot_info())
+
+
+@app.server.route("/metrics")
+def metrics():
+    """ Return the instrumentation of the update pipeline in the Prometheus text format. """
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
-    app.run(debug=False)
+    parser = argparse.ArgumentParser(description="Cryptocurrency dashboard.")
+    parser.add_argument("--streaming", action="store_true", help="stream kline updates from the exchanges")
+    parser.add_argument("--updater", action="store_true", help="only run the updater of the multi-process mode")
+    args = parser.parse_args()
+
+    thread = start_background_refresh()
+    if args.streaming:
+        from src.streaming import start_streaming
+        start_streaming()
+    if args.updater:
+        thread.join()
+    else:
+        app.run(debug=False)
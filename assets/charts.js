@@ -0,0 +1,102 @@
+/*
+Clientside rendering of the candlestick charts.
+
+The server sends the compact data of each chart (see create_chart_data in src/components/figures.py), which covers
+all chart timeframes, whenever the data was updated or another coin or kline timeframe was selected, and the layout and
+styles of the charts once per session (see get_chart_style). Switching between the chart timeframes (1W and 1M) only
+slices the decoded klines in the browser and does not send any request.
+*/
+
+function decodeBase64(text) {
+    // returns the decoded bytes in a new (aligned) buffer
+    const bytes = new Uint8Array(text.length * 3 / 4 - (text.match(/=*$/)[0].length));
+    const binary = atob(text);
+    for (let i = 0; i < bytes.length; i++) {
+        bytes[i] = binary.charCodeAt(i);
+    }
+    return bytes.buffer;
+}
+
+function decodeChartData(chartData) {
+    // returns the timestamps (as UTC date strings) and the prices of each field
+    const n = chartData.num_klines;
+    const levels = new Uint16Array(decodeBase64(chartData.values));
+    const klines = {};
+    chartData.fields.forEach((field, i) => {
+        const values = new Array(n);
+        for (let j = 0; j < n; j++) {
+            const level = levels[i * n + j];
+            values[j] = level === chartData.missing ? null : chartData.min + level * chartData.scale;
+        }
+        klines[field] = values;
+    });
+
+    const offsets = chartData.offsets === null ? null : new Uint32Array(decodeBase64(chartData.offsets));
+    klines.time = new Array(n);
+    for (let j = 0; j < n; j++) {
+        const timestamp = chartData.start + chartData.step * (offsets === null ? j : offsets[j]);
+        klines.time[j] = new Date(timestamp * 1000).toISOString().slice(0, 19);
+    }
+    return klines;
+}
+
+function createCandlestickFigure(chartData, chartTimeframe, chartStyle) {
+    // candlestick chart with EMAs, the price levels of the lowest low and current close and the gain in between
+    const klines = decodeChartData(chartData);
+    const start = chartData.num_klines - chartData.look_backs[chartTimeframe];
+    const x = klines.time.slice(start);
+    const [open, high, low, close] = ["open", "high", "low", "close"].map((field) => klines[field].slice(start));
+
+    const traces = Object.entries(chartStyle.emas).map(([ema, style]) => (
+        {type: "scatter", x: x, y: klines[ema].slice(start), ...style}
+    ));
+    traces.push({type: "candlestick", x: x, open: open, high: high, low: low, close: close});
+
+    // lowest low and current close
+    let lowIndex = 0;
+    for (let i = 1; i < low.length; i++) {
+        if (low[i] !== null && (low[lowIndex] === null || low[i] < low[lowIndex])) {
+            lowIndex = i;
+        }
+    }
+    const lowestLow = low[lowIndex];
+    const currentClose = close[close.length - 1];
+    const gain = (currentClose / lowestLow - 1.) * 100.;
+
+    const layout = JSON.parse(JSON.stringify(chartStyle.layout));
+    layout.title = {...layout.title, text: chartData.title};
+    layout.shapes = [lowestLow, currentClose].map((y) => ({...chartStyle.h_line, y0: y, y1: y}));
+    layout.annotations = [
+        {...chartStyle.arrow, x: x[lowIndex], y: currentClose, ax: x[lowIndex], ay: lowestLow},
+        {...chartStyle.box, x: x[lowIndex], y: 0.5 * (currentClose + lowestLow), text: gain.toFixed(1) + "%"},
+    ];
+    return {data: traces, layout: layout};
+}
+
+function getGraph(figure) {
+    // same component as get_graph in src/components/figures.py
+    return {
+        type: "Graph",
+        namespace: "dash_core_components",
+        props: {figure: figure, config: {displayModeBar: false}},
+    };
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    charts: {
+        render_chart: function(chartData, chartTimeframe, chartStyle) {
+            if (!chartData || !chartStyle) {
+                return window.dash_clientside.no_update;
+            }
+            return getGraph(createCandlestickFigure(chartData, chartTimeframe, chartStyle));
+        },
+        render_altcoin_charts: function(chartData, chartTimeframe, chartStyle) {
+            if (!chartData || !chartStyle) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            return ["usd", "btc"].map((denomination) => (
+                getGraph(createCandlestickFigure(chartData[denomination], chartTimeframe, chartStyle))
+            ));
+        },
+    },
+});
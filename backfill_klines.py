@@ -0,0 +1,179 @@
+"""
+Script to backfill the kline history of all coins in the config file up to a given start date.
+
+The exchanges only return a limited number of klines per request (see MAX_KLINES in src/exchange_data.py), so the
+history of each coin is fetched in pages from the most recent closed kline backwards. Each round requests the next
+page of all coins at once (within the request weight budgets of the exchanges, see src/fetcher.py) and the pages of a
+round are saved into data/history/pages before the checkpoint is updated. An interrupted backfill therefore resumes
+with the first unfinished round when the script is run again with the same arguments. Once all coins reached the start
+date or their first kline, all pages are written into the kline store data/history with a single write (see
+src/kline_store.py) and can be used for backtests (python -m src.backtest --store data/history).
+
+    python backfill_klines.py --start 2021-01-01
+    EXCHANGE_API_URL=http://127.0.0.1:8000 python backfill_klines.py --start 2021-01-01 --names BTC ETH
+
+Huobi only returns its most recent 2000 klines. If the pages of a coin fail MAX_FAILURES times in a row, the klines
+fetched so far are kept as its (shortened) history, e.g. Gate.io rejects requests for klines that are too old. Coins
+without any fetched klines are left out.
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+
+from src.exchange_data import get_kline_pages
+from src.fetcher import EXCHANGE_LIMITS
+from src.kline_store import KLINE_DTYPE, stack_klines, write_stacked_klines
+from src.timeframes import BASE_INTERVAL
+
+
+HISTORY_DIR = os.path.join("data", "history")
+PAGES_DIR = "pages"
+CHECKPOINT_FILE = "checkpoint.json"
+MAX_FAILURES = 3
+
+
+def backfill(info_df: pd.DataFrame, interval: int, start: int, directory: str = HISTORY_DIR) -> None:
+    """
+    Backfill the klines with the given interval (in minutes) of all coins in info_df up to the given start timestamp
+    (in seconds) and write them into the kline store in the given directory.
+    """
+    checkpoint = load_checkpoint(directory)
+    if checkpoint is None:
+        step = interval * 60
+        checkpoint = {"interval": interval, "start": start, "end": int(time.time()) // step * step - step, "round": 0}
+        checkpoint["coins"] = {}
+    elif checkpoint["interval"] != interval or checkpoint["start"] != start:
+        raise ValueError(f"The backfill in {directory} has different arguments, pass --restart to discard it")
+    elif checkpoint["round"] > 0:
+        print(f"Resuming backfill after round {checkpoint['round']}")
+
+    for name in info_df.index:
+        if name not in checkpoint["coins"]:
+            checkpoint["coins"][name] = {"next_end": checkpoint["end"], "num_klines": 0, "failures": 0, "done": False}
+
+    while True:
+        pending = [name for name in info_df.index if not checkpoint["coins"][name]["done"]]
+        if len(pending) == 0:
+            break
+
+        round_start = time.time()
+        ends = {name: checkpoint["coins"][name]["next_end"] for name in pending}
+        kline_dict, _ = get_kline_pages(info_df.loc[pending], interval, ends)
+        pages = {}
+        for name in pending:
+            state = checkpoint["coins"][name]
+            if name not in kline_dict:
+                # repeated failures end the history of the coin (it is left out if no page was fetched at all)
+                state["failures"] += 1
+                state["done"] = state["failures"] >= MAX_FAILURES
+                state["cut_short"] = state["done"] and state["num_klines"] > 0
+                continue
+
+            klines = kline_dict[name]
+            klines = klines[(klines["timestamp"] >= start) & (klines["timestamp"] <= state["next_end"])]
+            if len(klines) > 0:
+                pages[name] = klines.to_records(index=False).astype(KLINE_DTYPE)
+                state["next_end"] = int(klines["timestamp"].iloc[0]) - interval * 60
+                state["num_klines"] += len(klines)
+            state["failures"] = 0
+            state["done"] = len(klines) == 0 or state["next_end"] < start or info_df.loc[name, "exchange"] == "huobi"
+
+        _save_pages(directory, checkpoint["round"], pages)
+        checkpoint["round"] += 1
+        save_checkpoint(directory, checkpoint)
+
+        num_pending = sum(not checkpoint["coins"][name]["done"] for name in info_df.index)
+        print(
+            f"Round {checkpoint['round']}: {sum(len(page) for page in pages.values())} klines of {len(pages)} coins, "
+            f"{num_pending} coins remaining ({time.time() - round_start:.1f} seconds)"
+        )
+
+    failed = [name for name in info_df.index if checkpoint["coins"][name]["num_klines"] == 0]
+    if len(failed) > 0:
+        print(f"Kline retrieval error! Left out: {', '.join(failed)}")
+    cut_short = [name for name in info_df.index if checkpoint["coins"][name].get("cut_short", False)]
+    if len(cut_short) > 0:
+        print(f"Kline retrieval warning! History cut short (pages before it failed): {', '.join(cut_short)}")
+
+    names = [name for name in info_df.index if checkpoint["coins"][name]["num_klines"] > 0]
+    kline_dict = _load_pages(directory, checkpoint["round"], names)
+    num_klines = max([len(klines) for klines in kline_dict.values()], default=0)
+    klines = stack_klines(kline_dict, names, num_klines)
+    write_stacked_klines(directory, info_df.loc[names], klines, interval, incomplete=cut_short)
+    print(f"Saved {num_klines} klines of {len(names)} coins to {directory}")
+
+    # the backfill is complete, the next run starts a new one
+    shutil.rmtree(os.path.join(directory, PAGES_DIR))
+    os.remove(os.path.join(directory, CHECKPOINT_FILE))
+
+
+def load_checkpoint(directory: str) -> Optional[dict]:
+    """ Return the checkpoint of the unfinished backfill in the given directory (None if there is none). """
+    try:
+        with open(os.path.join(directory, CHECKPOINT_FILE), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(directory: str, checkpoint: dict) -> None:
+    """ Atomically replace the checkpoint in the given directory. """
+    path = os.path.join(directory, CHECKPOINT_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def _save_pages(directory: str, round_number: int, pages: Dict[str, np.ndarray]) -> None:
+    """ Save the pages of the given round (one array per coin), the pages of an interrupted round are replaced. """
+    os.makedirs(os.path.join(directory, PAGES_DIR), exist_ok=True)
+    path = os.path.join(directory, PAGES_DIR, f"{round_number:05d}.npz")
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, **pages)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def _load_pages(directory: str, num_rounds: int, names: List[str]) -> Dict[str, pd.DataFrame]:
+    """ Return the klines of the given coins from the pages of all rounds (in chronological order). """
+    chunks = {name: [] for name in names}
+    for round_number in reversed(range(num_rounds)):
+        with np.load(os.path.join(directory, PAGES_DIR, f"{round_number:05d}.npz")) as pages:
+            for name in pages.files:
+                if name in chunks:
+                    chunks[name].append(pages[name])
+    return {name: pd.DataFrame(np.concatenate(chunks[name])) for name in names}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill the kline history of all coins in the config file.")
+    parser.add_argument("--start", required=True, help="start date (YYYY-MM-DD, UTC)")
+    parser.add_argument("--interval", type=int, default=BASE_INTERVAL, help="kline interval in minutes")
+    parser.add_argument("--names", nargs="+", help="only backfill the given coins")
+    parser.add_argument("--output", default=HISTORY_DIR, help="directory of the kline store")
+    parser.add_argument("--weight-share", type=float, default=1., help="share of the request weight budgets to use")
+    parser.add_argument("--restart", action="store_true", help="discard an unfinished backfill")
+    args = parser.parse_args()
+
+    # leave some request weight for a dashboard that is running at the same time
+    for limits in EXCHANGE_LIMITS.values():
+        limits["weight_per_minute"] = max(1, int(limits["weight_per_minute"] * args.weight_share))
+
+    if args.restart:
+        shutil.rmtree(os.path.join(args.output, PAGES_DIR), ignore_errors=True)
+        if os.path.exists(os.path.join(args.output, CHECKPOINT_FILE)):
+            os.remove(os.path.join(args.output, CHECKPOINT_FILE))
+
+    df = pd.read_csv(os.path.join("data", "config.csv"), index_col="name")
+    if args.names:
+        df = df.loc[args.names]
+    start = int(pd.Timestamp(args.start, tz="UTC").timestamp())
+    backfill(df, args.interval, start, args.output)
@@ -0,0 +1,58 @@
+"""
+Benchmark of the backtest (see src/backtest.py) on synthetic klines.
+
+The deterministic klines of the stub exchange (see src/stub_exchange.py) of N synthetic coins (Bitcoin is the first
+coin) are backtested repeatedly and the run times are reported together with the report of the last run. The default
+of 6570 klines covers 3 years of 4h klines. Run from the root directory of the project:
+
+    python -m benchmarks.bench_backtest --num-coins 500
+    python -m benchmarks.bench_backtest --num-coins 500 --num-klines 6570 --timeframe 4h --repeat 3
+"""
+import time
+import argparse
+import statistics
+import numpy as np
+import pandas as pd
+from typing import List, Tuple
+
+from src.backtest import run_backtest
+from src.kline_store import KLINE_DTYPE, stack_klines
+from src.stub_exchange import get_klines
+from src.timeframes import TIMEFRAMES, DEFAULT_TIMEFRAME
+
+
+def get_synthetic_klines(num_coins: int, interval: int, num_klines: int) -> Tuple[np.ndarray, List[str]]:
+    """ Return deterministic klines of the stub exchange for num_coins synthetic coins (BTC is the first coin). """
+    names = ["BTC"] + [f"COIN{i}" for i in range(1, num_coins)]
+    kline_dict = {
+        name: pd.DataFrame(
+            get_klines(f"{name}USDT", interval * 60, int(time.time()), num_klines), columns=list(KLINE_DTYPE.names),
+        )
+        for name in names
+    }
+    return stack_klines(kline_dict, names, num_klines), names
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the backtest on synthetic klines.")
+    parser.add_argument("--num-coins", type=int, default=500)
+    parser.add_argument("--num-klines", type=int, default=6570, help="number of synthetic klines per coin")
+    parser.add_argument("--timeframe", default=DEFAULT_TIMEFRAME, choices=list(TIMEFRAMES))
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs")
+    args = parser.parse_args()
+
+    interval = TIMEFRAMES[args.timeframe]
+    klines, names = get_synthetic_klines(args.num_coins, interval, args.num_klines)
+
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        report, timestamps, _ = run_backtest(klines, names, interval, interval)
+        times.append(time.perf_counter() - start)
+
+    print(
+        f"Backtested {len(names)} coins and {len(timestamps)} klines in {statistics.median(times):.2f} seconds "
+        f"(median of {args.repeat} runs, min {min(times):.2f} seconds)"
+    )
+    with pd.option_context("display.float_format", "{:.4f}".format, "display.max_columns", None, "display.width", 120):
+        print(report)
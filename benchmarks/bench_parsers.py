@@ -0,0 +1,187 @@
+"""
+Micro-benchmark of the kline parsers in src/exchange_data.py using recorded response fixtures.
+
+The current parsers are compared against the previous list comprehension based parsers (kept below as reference
+implementations), both in terms of speed and results. The reference parsers are timed with the standard json decoder
+(as before) and with the decoder of the current parsers (orjson if it is installed), such that the speedup of the
+decoder and the speedup of the parsing itself are reported separately. The parsers are timed in turns over several
+rounds and the fastest round of each parser is reported, such that load fluctuations of the machine do not favour
+one of them. Run from the root directory of the project:
+
+    python -m benchmarks.bench_parsers
+    python -m benchmarks.bench_parsers --record  # re-record the fixtures (uses EXCHANGE_API_URL if set)
+    python -m benchmarks.bench_parsers --record --num-klines 1000  # full pages of most exchanges
+"""
+import os
+import json
+import timeit
+import argparse
+import pandas as pd
+from requests.models import Response
+from typing import Callable, List
+
+from src import exchange_data
+from src.fetcher import fetch_all
+
+
+FIXTURES_DIR = os.path.join("benchmarks", "fixtures")
+
+# coins whose klines are recorded for each exchange
+FIXTURE_COINS = {
+    "binance": "BTCUSDT",
+    "bybit": "BTCUSDT",
+    "gateio": "BTC_USDT",
+    "huobi": "btcusdt",
+    "kucoin": "BTC-USDT",
+}
+
+
+def reference_binance_klines(response: Response, loads: Callable = json.loads) -> pd.DataFrame:
+    data = loads(response.content)
+    n = len(data)
+    return pd.DataFrame(data={
+        "timestamp": [data[i][0] // 1000 for i in range(n)],
+        "open": [float(data[i][1]) for i in range(n)],
+        "high": [float(data[i][2]) for i in range(n)],
+        "low": [float(data[i][3]) for i in range(n)],
+        "close": [float(data[i][4]) for i in range(n)],
+    })
+
+
+def reference_bybit_klines(response: Response, loads: Callable = json.loads) -> pd.DataFrame:
+    data = loads(response.content)["result"]["list"]
+    n = len(data)
+    return pd.DataFrame(data={
+        "timestamp": [int(data[i][0]) // 1000 for i in reversed(range(n))],
+        "open": [float(data[i][1]) for i in reversed(range(n))],
+        "high": [float(data[i][2]) for i in reversed(range(n))],
+        "low": [float(data[i][3]) for i in reversed(range(n))],
+        "close": [float(data[i][4]) for i in reversed(range(n))],
+    })
+
+
+def reference_gateio_klines(response: Response, loads: Callable = json.loads) -> pd.DataFrame:
+    data = loads(response.content)
+    n = len(data)
+    return pd.DataFrame(data={
+        "timestamp": [int(data[i][0]) for i in range(n)],
+        "open": [float(data[i][5]) for i in range(n)],
+        "high": [float(data[i][3]) for i in range(n)],
+        "low": [float(data[i][4]) for i in range(n)],
+        "close": [float(data[i][2]) for i in range(n)],
+    })
+
+
+def reference_huobi_klines(response: Response, loads: Callable = json.loads) -> pd.DataFrame:
+    data = loads(response.content)["data"]
+    n = len(data)
+    return pd.DataFrame(data={
+        "timestamp": [int(data[i]["id"]) for i in reversed(range(n))],
+        "open": [float(data[i]["open"]) for i in reversed(range(n))],
+        "high": [float(data[i]["high"]) for i in reversed(range(n))],
+        "low": [float(data[i]["low"]) for i in reversed(range(n))],
+        "close": [float(data[i]["close"]) for i in reversed(range(n))],
+    })
+
+
+def reference_kucoin_klines(response: Response, loads: Callable = json.loads) -> pd.DataFrame:
+    data = loads(response.content)["data"]
+    n = len(data)
+    return pd.DataFrame(data={
+        "timestamp": [int(data[i][0]) for i in reversed(range(n))],
+        "open": [float(data[i][1]) for i in reversed(range(n))],
+        "high": [float(data[i][3]) for i in reversed(range(n))],
+        "low": [float(data[i][4]) for i in reversed(range(n))],
+        "close": [float(data[i][2]) for i in reversed(range(n))],
+    })
+
+
+PARSERS = {
+    "binance": (reference_binance_klines, exchange_data._get_binance_klines),
+    "bybit": (reference_bybit_klines, exchange_data._get_bybit_klines),
+    "gateio": (reference_gateio_klines, exchange_data._get_gateio_klines),
+    "huobi": (reference_huobi_klines, exchange_data._get_huobi_klines),
+    "kucoin": (reference_kucoin_klines, exchange_data._get_kucoin_klines),
+}
+
+
+def record_fixtures(num_klines: int) -> None:
+    """ Fetch 4h klines for one coin of each exchange and save the raw response bodies as fixtures. """
+    info_df = pd.DataFrame(
+        index=list(FIXTURE_COINS.keys()),
+        data={"exchange": list(FIXTURE_COINS.keys()), "symbol": list(FIXTURE_COINS.values())},
+    )
+    kline_requests = [
+        exchange_data._get_request(name, info_df, 240, num_klines)
+        for name in info_df.index
+    ]
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for exchange, result in zip(info_df.index, fetch_all(kline_requests)):
+        if result.response is None or result.response.status_code != 200:
+            print(f"Could not record fixture for {exchange}")
+            continue
+        with open(os.path.join(FIXTURES_DIR, f"{exchange}.json"), "wb") as f:
+            f.write(result.response.content)
+
+
+def load_fixture(exchange: str) -> Response:
+    """ Return a response object containing the recorded response body of the given exchange. """
+    response = Response()
+    response.status_code = 200
+    with open(os.path.join(FIXTURES_DIR, f"{exchange}.json"), "rb") as f:
+        response._content = f.read()
+    return response
+
+
+def time_in_turns(functions: List[Callable], number: int, repeat: int) -> List[float]:
+    """
+    Return the run time (in microseconds) of each function, i.e. the fastest of repeat rounds in which each function
+    is run number times in turns.
+    """
+    times = [[] for _ in functions]
+    for _ in range(repeat):
+        for function, function_times in zip(functions, times):
+            function_times.append(timeit.timeit(function, number=number) / number * 1e6)
+    return [min(function_times) for function_times in times]
+
+
+def run_benchmark(number: int, repeat: int) -> None:
+    """
+    Compare results and runtimes of the reference and current parsers for all exchanges. The speedups are split into
+    the speedup of the decoder (reference parser with both decoders) and of the parsing (both parsers with the same
+    decoder).
+    """
+    decoder = exchange_data._loads
+    print(f"JSON decoder of the current parsers: {decoder.__module__}")
+    print(
+        f"{'exchange':<10}{'klines':>8}{'reference (us)':>16}{'+ decoder (us)':>16}{'current (us)':>14}"
+        f"{'decoder':>9}{'parsing':>9}{'total':>9}"
+    )
+    for exchange, (reference_parser, parser) in PARSERS.items():
+        response = load_fixture(exchange)
+        pd.testing.assert_frame_equal(reference_parser(response), parser(response))
+        pd.testing.assert_frame_equal(reference_parser(response, decoder), parser(response))
+
+        reference_time, decoder_time, current_time = time_in_turns(
+            [lambda: reference_parser(response), lambda: reference_parser(response, decoder), lambda: parser(response)],
+            number, repeat,
+        )
+        num_klines = len(parser(response))
+        print(
+            f"{exchange:<10}{num_klines:>8}{reference_time:>16.1f}{decoder_time:>16.1f}{current_time:>14.1f}"
+            f"{reference_time / decoder_time:>8.2f}x{decoder_time / current_time:>8.2f}x"
+            f"{reference_time / current_time:>8.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the kline parsers.")
+    parser.add_argument("--record", action="store_true", help="re-record the response fixtures")
+    parser.add_argument("--num-klines", type=int, default=200, help="number of klines per recorded fixture")
+    parser.add_argument("--number", type=int, default=50, help="number of runs per parser and round")
+    parser.add_argument("--repeat", type=int, default=20, help="number of rounds")
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixtures(args.num_klines)
+    run_benchmark(args.number, args.repeat)
@@ -0,0 +1,326 @@
+"""
+Offline benchmark suite of the refresh pipeline and the callbacks.
+
+The benchmark creates a temporary working directory with a config file of N synthetic coins, which are spread evenly
+across all five exchanges (Bitcoin is listed on Binance), and starts the stub exchange server (see
+src/stub_exchange.py) in a separate process. The stub server returns synthetic klines or replays the recorded
+responses in benchmarks/fixtures (--fixtures) with optional latency and error injection. The following scenarios are
+run repeatedly and timed:
+
+    - full_refresh_cold: refresh without stored klines (all klines of all coins are fetched)
+    - full_refresh_incremental: refresh with stored klines (only the most recent klines are fetched)
+    - parse_only: parsing of the responses of all coins
+    - metrics_only: market data of all timeframes from the stacked base klines
+    - snapshot_write: saving and publishing a generation of the klines and market data
+    - callback_table, callback_bar, callback_candlestick: rendering of the uptrend screener page, the bar chart of the
+      overview and the (uncached) chart data of an altcoin through the Dash endpoint
+
+The results (and the stage timings of the last refresh, see src/instrumentation.py) are saved as JSON into
+benchmarks/results. Passing a previous result with --compare reports regressions of the median run times. Run from the
+root directory of the project:
+
+    python -m benchmarks.bench_pipeline --num-coins 350
+    python -m benchmarks.bench_pipeline --num-coins 2000 --latency 0.05 --error-rate 0.01 --fixtures
+    python -m benchmarks.bench_pipeline --num-coins 2000 --compare benchmarks/results/BASELINE.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import statistics
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, List, Optional, Union
+
+
+RESULTS_DIR = os.path.join("benchmarks", "results")
+FIXTURES_DIR = os.path.join("benchmarks", "fixtures")
+EXCHANGES = ["binance", "bybit", "gateio", "huobi", "kucoin"]
+SYMBOL_FORMATS = {
+    "binance": "{}USDT",
+    "bybit": "{}USDT",
+    "gateio": "{}_USDT",
+    "huobi": "{}usdt",
+    "kucoin": "{}-USDT",
+}
+REGRESSION_TOLERANCE = 0.2 # relative increase of the median run time that counts as regression
+
+
+def create_config(num_coins: int) -> pd.DataFrame:
+    """ Return a config of Bitcoin and num_coins - 1 synthetic coins that are spread across all exchanges. """
+    names = ["BTC"] + [f"COIN{i}" for i in range(1, num_coins)]
+    exchanges = ["binance"] + [EXCHANGES[i % len(EXCHANGES)] for i in range(1, num_coins)]
+    symbols = [
+        SYMBOL_FORMATS[exchange].format(name.lower() if exchange == "huobi" else name)
+        for name, exchange in zip(names, exchanges)
+    ]
+    return pd.DataFrame(
+        index=pd.Index(names, name="name"),
+        data={
+            "symbol": symbols,
+            "tier": [1] + [1 + i % 4 for i in range(1, num_coins)],
+            "watchlist": [i % 10 == 0 for i in range(num_coins)],
+            "exchange": exchanges,
+            "chart_usd": "", "chart_btc": "", "spot_usd": "", "spot_btc": "", "perps": "",
+        },
+    ).astype({"watchlist": int})
+
+
+def start_stub_server(latency: float, error_rate: float, fixtures: Optional[str]) -> subprocess.Popen:
+    """ Start the stub exchange server on a free port, point all requests to it and return its process. """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    command = [
+        sys.executable, "-m", "src.stub_exchange", "--port", str(port), "--latency", str(latency),
+        "--error-rate", str(error_rate),
+    ]
+    if fixtures is not None:
+        command += ["--fixtures", fixtures]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    # wait until the server accepts connections
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    os.environ["EXCHANGE_API_URL"] = f"http://127.0.0.1:{port}"
+    return process
+
+
+def measure(function: Callable[[], None], repeat: int, setup: Optional[Callable[[], None]] = None) -> List[float]:
+    """ Return the run times (in seconds) of the given function, the setup function is called before each run. """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_scenarios(config_df: pd.DataFrame, repeat: int, rate_limits: bool = False) -> Dict[str, List[float]]:
+    """
+    Run all scenarios in the current working directory and return the run times of each scenario. The request weight
+    budgets of the exchanges are lifted unless rate_limits is True, since the repeated refreshes would exhaust them.
+    """
+    # the modules resolve their data and cache paths relative to the working directory
+    from app import app
+    from src import figure_cache
+    from src.exchange_data import _get_request, _parse_klines
+    from src.fetcher import EXCHANGE_LIMITS, fetch_all
+    from src.kline_store import load_klines, stack_klines, save_klines
+    from src.market_data import compute_market_data, save_market_data
+    from src.scheduler import refresh_market_data, publish_update
+    from src.snapshot_store import SNAPSHOTS_DIR, POINTER_PATH
+    from src.timeframes import BASE_INTERVAL, NUM_BASE_KLINES, DEFAULT_TIMEFRAME
+
+    if not rate_limits:
+        for limits in EXCHANGE_LIMITS.values():
+            limits["weight_per_minute"] = 10**9
+
+    def reset_store():
+        shutil.rmtree(SNAPSHOTS_DIR, ignore_errors=True)
+        if os.path.exists(POINTER_PATH):
+            os.remove(POINTER_PATH)
+
+    times = {}
+    times["full_refresh_cold"] = measure(refresh_market_data, repeat, setup=reset_store)
+    times["full_refresh_incremental"] = measure(refresh_market_data, repeat)
+
+    responses = [
+        result.response for result in fetch_all([
+            _get_request(name, config_df, BASE_INTERVAL, NUM_BASE_KLINES) for name in config_df.index
+        ])
+    ]
+    times["parse_only"] = measure(lambda: [
+        _parse_klines(exchange, response) for exchange, response in zip(config_df["exchange"], responses)
+    ], repeat)
+
+    kline_dict, _ = load_klines(config_df, BASE_INTERVAL)
+    info_df = config_df.loc[list(kline_dict)]
+    base_klines = stack_klines(kline_dict, list(info_df.index), NUM_BASE_KLINES)
+    times["metrics_only"] = measure(lambda: compute_market_data(info_df, base_klines), repeat)
+
+    market_data = compute_market_data(info_df, base_klines)
+    def write(version: int):
+        save_klines(info_df, kline_dict, BASE_INTERVAL, version)
+        save_market_data(market_data, None, version)
+    times["snapshot_write"] = measure(lambda: publish_update(write, kind="benchmark"), repeat)
+
+    # the first request of each callback loads the snapshot and its index
+    version = refresh_market_data()
+    client = app.server.test_client()
+    coin = info_df.index[1]
+    callbacks = {
+        "callback_table": get_callback_body(
+            ["trend_table.data", "trend_table.page_count", "trend_table.page_current"],
+            {
+                "timestamp.data": version, "radio_timeframe.value": DEFAULT_TIMEFRAME, "radio_trend.value": "All",
+                "trend_table.page_current": 0,
+                "trend_table.sort_by": [{"column_id": "trend_strength", "direction": "desc"}],
+            },
+            state={"trend_table.page_size": 30},
+        ),
+        "callback_bar": get_callback_body(["bar_chart.children"], {
+            "timestamp.data": version, "radio_timeframe.value": DEFAULT_TIMEFRAME,
+            "radio_overview_filter.value": "All", "radio_overview_timeframe.value": "1W",
+        }),
+        "callback_candlestick": get_callback_body(["altcoin_chart_data.data"], {
+            "timestamp.data": version, "altcoin.data": coin, "radio_timeframe.value": DEFAULT_TIMEFRAME,
+        }, triggered="altcoin.data"),
+    }
+    for name, body in callbacks.items():
+        def post():
+            response = client.post("/_dash-update-component", json=body)
+            if response.status_code != 200:
+                raise RuntimeError(f"Callback {name} failed with status {response.status_code}")
+        post()
+        times[name] = measure(post, repeat, setup=figure_cache.clear)
+    return times
+
+
+def get_callback_body(
+    outputs: List[str],
+    inputs: Dict[str, object],
+    state: Dict[str, object] = {},
+    triggered: Union[str, List[str]] = "timestamp.data",
+    ) -> dict:
+    """
+    Return the body of a request to the Dash callback endpoint /_dash-update-component given the outputs, inputs and
+    states as "id.property" strings (in the order of the callback definition) and the triggering input (or inputs).
+    """
+    def split(prop_id: str) -> dict:
+        id, property = prop_id.rsplit(".", 1)
+        return {"id": id, "property": property}
+
+    return {
+        "output": outputs[0] if len(outputs) == 1 else ".." + "...".join(outputs) + "..",
+        "outputs": split(outputs[0]) if len(outputs) == 1 else [split(output) for output in outputs],
+        "inputs": [{**split(prop_id), "value": value} for prop_id, value in inputs.items()],
+        "state": [{**split(prop_id), "value": value} for prop_id, value in state.items()],
+        "changedPropIds": [triggered] if isinstance(triggered, str) else triggered,
+    }
+
+
+def summarize(times: Dict[str, List[float]]) -> Dict[str, dict]:
+    """ Return the statistics of the run times (in seconds) of each scenario. """
+    return {
+        name: {
+            "median": statistics.median(runs), "mean": statistics.mean(runs), "min": min(runs), "max": max(runs),
+            "runs": runs,
+        }
+        for name, runs in times.items()
+    }
+
+
+def compare(baseline: dict, result: dict, tolerance: float = REGRESSION_TOLERANCE) -> List[str]:
+    """ Print the median run times of both results and return the scenarios that regressed. """
+    for key in ["num_coins", "latency", "error_rate", "fixtures", "rate_limits"]:
+        if baseline["meta"].get(key) != result["meta"].get(key):
+            print(f"Warning: different {key} ({baseline['meta'].get(key)} vs. {result['meta'].get(key)})")
+
+    regressions = []
+    print(f"{'scenario':<28}{'baseline (ms)':>15}{'current (ms)':>15}{'ratio':>8}")
+    for name, stats in result["scenarios"].items():
+        if name not in baseline["scenarios"]:
+            continue
+        baseline_median = baseline["scenarios"][name]["median"]
+        ratio = stats["median"] / baseline_median
+        is_regression = ratio > 1. + tolerance
+        if is_regression:
+            regressions.append(name)
+        print(
+            f"{name:<28}{baseline_median * 1e3:>15.1f}{stats['median'] * 1e3:>15.1f}{ratio:>7.2f}x"
+            f"{'  REGRESSION' if is_regression else ''}"
+        )
+    return regressions
+
+
+def _get_commit() -> Optional[str]:
+    """ Return the current git commit of the project (None if it is unknown). """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark suite of the refresh pipeline and the callbacks.")
+    parser.add_argument("--num-coins", type=int, default=350)
+    parser.add_argument("--repeat", type=int, default=5, help="number of runs per scenario")
+    parser.add_argument("--latency", type=float, default=0., help="artificial delay per response in seconds")
+    parser.add_argument("--error-rate", type=float, default=0., help="fraction of requests answered with HTTP 429")
+    parser.add_argument("--fixtures", action="store_true", help="replay the recorded responses of the exchanges")
+    parser.add_argument("--rate-limits", action="store_true", help="keep the request weight budgets of the exchanges")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/{time}-{num_coins}.json)")
+    parser.add_argument("--compare", help="previous result file to compare with")
+    args = parser.parse_args()
+
+    project_dir = os.getcwd()
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{args.num_coins}.json",
+    )
+    fixtures = os.path.join(project_dir, FIXTURES_DIR) if args.fixtures else None
+
+    workspace = tempfile.mkdtemp(prefix="dashboard-benchmark-")
+    config_df = create_config(args.num_coins)
+    os.makedirs(os.path.join(workspace, "data"))
+    config_df.to_csv(os.path.join(workspace, "data", "config.csv"), index_label="name")
+
+    server = start_stub_server(args.latency, args.error_rate, fixtures)
+    sys.path.insert(0, project_dir)
+    os.chdir(workspace)
+    try:
+        times = run_scenarios(config_df, args.repeat, args.rate_limits)
+        from src.instrumentation import load_metrics
+        refresh_stages = load_metrics()["last_update"]["stages"]
+    finally:
+        os.chdir(project_dir)
+        server.terminate()
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    result = {
+        "meta": {
+            "time": time.time(),
+            "commit": _get_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "num_coins": args.num_coins,
+            "repeat": args.repeat,
+            "latency": args.latency,
+            "error_rate": args.error_rate,
+            "fixtures": args.fixtures,
+            "rate_limits": args.rate_limits,
+        },
+        "scenarios": summarize(times),
+        "refresh_stages": refresh_stages,
+    }
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"{'scenario':<28}{'median (ms)':>13}{'min (ms)':>11}{'max (ms)':>11}")
+    for name, stats in result["scenarios"].items():
+        print(f"{name:<28}{stats['median'] * 1e3:>13.1f}{stats['min'] * 1e3:>11.1f}{stats['max'] * 1e3:>11.1f}")
+    print(f"Saved the results to {output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            regressions = compare(json.load(f), result)
+        if len(regressions) > 0:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
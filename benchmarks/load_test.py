@@ -0,0 +1,408 @@
+"""
+Load test of the Dash callbacks with concurrent dashboard users.
+
+Each simulated user holds the client state of one browser tab (selected timeframes, filters, table pages, sorting and
+altcoin) and drives the callback endpoint /_dash-update-component of a running dashboard instance with the same
+requests the browser sends: the initial page load and then randomly chosen actions with exponentially distributed
+think times in between:
+
+    - filter: select another filter of the uptrend screener, the pump screener or the overview
+    - select_row: click on a row of one of the screeners (the altcoin charts and links are loaded afterwards)
+    - page: go to another page of one of the screeners or change its sorting
+    - timeframe: select another kline timeframe (all tables and charts are reloaded)
+    - chart_timeframe: toggle between 1W and 1M in the Bitcoin or the altcoin chart (rendered in the browser, so this
+      action does not send any request, see assets/charts.js)
+
+The requests of one action are sent one after another (browsers send independent callbacks in parallel, so more users
+approximate a higher load per tab). The latency percentiles (p50/p95/p99), throughput and errors of each callback are
+printed at the end and can be saved as JSON. Start the dashboard (python app.py or gunicorn, see gunicorn.conf.py)
+and run from the root directory of the project:
+
+    python -m benchmarks.load_test --users 20 --duration 60
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --users 50 --think-time 0.5 --output load.json
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import numpy as np
+import requests
+from typing import Dict, List, Optional, Union
+
+from benchmarks.bench_pipeline import get_callback_body
+
+
+DEFAULT_URL = "http://127.0.0.1:8050"
+PAGE_SIZE = 30 # see src/components/table_cards.py
+ACTIONS = {
+    "filter": 0.3,
+    "select_row": 0.3,
+    "page": 0.15,
+    "timeframe": 0.1,
+    "chart_timeframe": 0.15,
+} # relative frequencies of the user actions
+TRENDS_SORT_COLUMNS = ["trend_strength", "gain_1d", "gain_1w", "gain_1m", "trend_strength_btc", "gain_btc_1w"]
+PUMPS_SORT_COLUMNS = ["pump_strength", "gain_1d", "gain_1w", "gain_1m"]
+DEFAULT_STYLE = [{"if": {"row_index": "odd"}, "backgroundColor": "rgb(32, 32, 32)"}, {}]
+
+
+class VirtualUser:
+    """ Client state and click sequences of one simulated dashboard user. """
+
+    def __init__(self, url: str, radio_items: Dict[str, dict], rng: random.Random, records: list, lock: threading.Lock):
+        self.url = url
+        self.options = {name: radio["options"] for name, radio in radio_items.items()}
+        self.rng = rng
+        self.records = records
+        self.lock = lock
+        self.session = requests.Session()
+
+        self.timestamp = None
+        self.altcoin = None
+        self.values = {name: radio["value"] for name, radio in radio_items.items()}
+        self.tables = {
+            "trend_table": {"data": [], "page_count": 1, "page_current": 0, "sort_column": "trend_strength",
+                            "style": DEFAULT_STYLE},
+            "pump_table": {"data": [], "page_count": 1, "page_current": 0, "sort_column": "pump_strength",
+                           "style": DEFAULT_STYLE},
+        }
+
+    def run(self, end: float, think_time: float) -> None:
+        """ Load the dashboard and perform random actions until the given time. """
+        self.load()
+        actions, weights = list(ACTIONS), list(ACTIONS.values())
+        while time.time() < end:
+            time.sleep(min(self.rng.expovariate(1. / think_time), max(0., end - time.time())) if think_time > 0 else 0)
+            if time.time() >= end:
+                break
+            getattr(self, self.rng.choices(actions, weights)[0])()
+
+    def load(self) -> None:
+        """ Initial page load: all callbacks that are triggered by the timestamp of the most recent snapshot. """
+        response = self.session.get(f"{self.url}/version", timeout=30)
+        self.timestamp = response.json()["version"]
+        self.post("set_last_update_text", ["last_update_text.children"], {"timestamp.data": self.timestamp})
+        self.update_table("trend_table", "timestamp.data")
+        self.update_table("pump_table", "timestamp.data")
+        self.update_overview("timestamp.data")
+        self.post("load_chart_style", ["chart_style.data"], {"timestamp.data": self.timestamp}, state={
+            "chart_style.data": None,
+        })
+        self.update_bitcoin_chart("timestamp.data")
+        self.post("update_bitcoin_links", ["bitcoin_tradingview.children", "bitcoin_exchanges.children"], {
+            "timestamp.data": self.timestamp,
+        })
+        self.select_altcoin(None, None, ["trend_table.data", "pump_table.data"])
+
+    def filter(self) -> None:
+        """ Select another filter of one of the screeners or the overview. """
+        name = self.rng.choice(["radio_trend", "radio_pump", "radio_overview_filter"])
+        self.values[name] = self.rng.choice(self.options[name])
+        if name == "radio_overview_filter":
+            self.update_overview(f"{name}.value")
+        else:
+            table_id = "trend_table" if name == "radio_trend" else "pump_table"
+            self.update_table(table_id, f"{name}.value")
+            self.select_altcoin(None, None, [f"{name}.value", f"{table_id}.data"])
+
+    def select_row(self) -> None:
+        """ Click on a random row of one of the screeners and load the charts and links of its altcoin. """
+        tables = [table_id for table_id, table in self.tables.items() if len(table["data"]) > 0]
+        if len(tables) == 0:
+            return self.filter()
+        table_id = self.rng.choice(tables)
+        row = self.rng.randrange(len(self.tables[table_id]["data"]))
+        altcoin = self.tables[table_id]["data"][row]["id"]
+        self.select_altcoin(table_id, {"row": row, "column": 0, "column_id": "id", "row_id": altcoin})
+        self.altcoin = altcoin
+        self.update_altcoin_charts("altcoin.data")
+        self.post("update_altcoin_links", ["altcoin_tradingview.children", "altcoin_exchanges.children"], {
+            "altcoin.data": self.altcoin,
+        }, state={"timestamp.data": self.timestamp}, triggered="altcoin.data")
+
+    def page(self) -> None:
+        """ Go to another page of one of the screeners or sort it by another column. """
+        table_id = self.rng.choice(list(self.tables))
+        table = self.tables[table_id]
+        if table["page_count"] > 1 and self.rng.random() < 0.7:
+            table["page_current"] = self.rng.randrange(table["page_count"])
+            self.update_table(table_id, f"{table_id}.page_current")
+            self.select_altcoin(None, None, [f"{table_id}.data"])
+        else:
+            columns = TRENDS_SORT_COLUMNS if table_id == "trend_table" else PUMPS_SORT_COLUMNS
+            table["sort_column"] = self.rng.choice(columns)
+            self.update_table(table_id, f"{table_id}.sort_by")
+            self.select_altcoin(None, None, [f"{table_id}.sort_by", f"{table_id}.data"])
+
+    def timeframe(self) -> None:
+        """ Select another kline timeframe, which reloads all tables and charts. """
+        self.values["radio_timeframe"] = self.rng.choice(self.options["radio_timeframe"])
+        self.update_table("trend_table", "radio_timeframe.value")
+        self.update_table("pump_table", "radio_timeframe.value")
+        self.update_overview("radio_timeframe.value")
+        self.update_bitcoin_chart("radio_timeframe.value")
+        if self.altcoin is not None:
+            self.update_altcoin_charts("radio_timeframe.value")
+        self.select_altcoin(None, None, ["radio_timeframe.value", "trend_table.data", "pump_table.data"])
+
+    def chart_timeframe(self) -> None:
+        """ Toggle the timeframe of the Bitcoin chart or the altcoin charts, which only changes the client state. """
+        name = self.rng.choice(["radio_btc_chart", "radio_altcoin_chart"] if self.altcoin else ["radio_btc_chart"])
+        self.values[name] = "1M" if self.values[name] == "1W" else "1W"
+
+    def update_table(self, table_id: str, triggered: str) -> None:
+        """ Request the visible page of the given screener table. """
+        table = self.tables[table_id]
+        filter_id = "radio_trend" if table_id == "trend_table" else "radio_pump"
+        if triggered not in ["timestamp.data", f"{table_id}.page_current"]:
+            table["page_current"] = 0
+        response = self.post(
+            "update_trend_table" if table_id == "trend_table" else "update_pump_table",
+            [f"{table_id}.data", f"{table_id}.page_count", f"{table_id}.page_current"],
+            {
+                "timestamp.data": self.timestamp,
+                "radio_timeframe.value": self.values["radio_timeframe"],
+                f"{filter_id}.value": self.values[filter_id],
+                f"{table_id}.page_current": table["page_current"],
+                f"{table_id}.sort_by": [{"column_id": table["sort_column"], "direction": "desc"}],
+            },
+            state={f"{table_id}.page_size": PAGE_SIZE},
+            triggered=triggered,
+        )
+        if response is not None:
+            table["data"] = response[table_id]["data"]
+            table["page_count"] = response[table_id]["page_count"]
+            table["page_current"] = response[table_id]["page_current"]
+
+    def select_altcoin(
+        self,
+        table_id: Optional[str],
+        active_cell: Optional[dict],
+        triggered: Optional[List[str]] = None,
+        ) -> None:
+        """
+        Highlight the clicked row of the given table or, if no row was clicked, update the highlighting after the
+        given properties (e.g. the table data) changed.
+        """
+        trend, pump = self.tables["trend_table"], self.tables["pump_table"]
+        response = self.post(
+            "select_altcoin",
+            [
+                "altcoin.data",
+                "trend_table.active_cell", "trend_table.selected_cells", "trend_table.style_data_conditional",
+                "pump_table.active_cell", "pump_table.selected_cells", "pump_table.style_data_conditional",
+            ],
+            {
+                "trend_table.active_cell": active_cell if table_id == "trend_table" else None,
+                "pump_table.active_cell": active_cell if table_id == "pump_table" else None,
+                "trend_table.data": trend["data"],
+                "pump_table.data": pump["data"],
+                "radio_timeframe.value": self.values["radio_timeframe"],
+                "radio_trend.value": self.values["radio_trend"],
+                "radio_pump.value": self.values["radio_pump"],
+                "trend_table.sort_by": [{"column_id": trend["sort_column"], "direction": "desc"}],
+                "pump_table.sort_by": [{"column_id": pump["sort_column"], "direction": "desc"}],
+            },
+            state={
+                "altcoin.data": self.altcoin,
+                "trend_table.style_data_conditional": trend["style"],
+                "pump_table.style_data_conditional": pump["style"],
+            },
+            triggered=[f"{table_id}.active_cell"] if table_id else triggered,
+        )
+        if response is not None:
+            for key, table in self.tables.items():
+                table["style"] = response.get(key, {}).get("style_data_conditional", table["style"])
+
+    def update_overview(self, triggered: str) -> None:
+        """ Request the bar chart of the overview. """
+        self.post("update_overview_card", ["bar_chart.children"], {
+            "timestamp.data": self.timestamp,
+            "radio_timeframe.value": self.values["radio_timeframe"],
+            "radio_overview_filter.value": self.values["radio_overview_filter"],
+            "radio_overview_timeframe.value": self.values["radio_overview_timeframe"],
+        }, triggered=triggered)
+
+    def update_bitcoin_chart(self, triggered: str) -> None:
+        """ Request the chart data of Bitcoin. """
+        self.post("update_bitcoin_chart", ["bitcoin_chart_data.data"], {
+            "timestamp.data": self.timestamp,
+            "radio_timeframe.value": self.values["radio_timeframe"],
+        }, triggered=triggered)
+
+    def update_altcoin_charts(self, triggered: str) -> None:
+        """ Request the chart data of the selected altcoin. """
+        self.post("update_altcoin_charts", ["altcoin_chart_data.data"], {
+            "timestamp.data": self.timestamp,
+            "altcoin.data": self.altcoin,
+            "radio_timeframe.value": self.values["radio_timeframe"],
+        }, triggered=triggered)
+
+    def post(
+        self,
+        callback: str,
+        outputs: List[str],
+        inputs: Dict[str, object],
+        state: Dict[str, object] = {},
+        triggered: Union[str, List[str]] = "timestamp.data",
+        ) -> Optional[dict]:
+        """
+        Send a callback request and record its latency. Return the updated properties of each component (None if the
+        request failed or the callback did not update anything).
+        """
+        body = get_callback_body(outputs, inputs, state, triggered)
+        start = time.perf_counter()
+        try:
+            response = self.session.post(f"{self.url}/_dash-update-component", json=body, timeout=60)
+            latency = time.perf_counter() - start
+            status = response.status_code
+            result = response.json()["response"] if status == 200 else None
+        except (requests.RequestException, ValueError, KeyError):
+            latency = time.perf_counter() - start
+            status, result = None, None
+
+        # 204 means that the callback raised PreventUpdate, which is not an error
+        with self.lock:
+            self.records.append((callback, time.time(), latency, status in [200, 204]))
+        return result
+
+
+def get_radio_items(url: str) -> Dict[str, dict]:
+    """ Return the (enabled) options and initial values of all radio items in the layout of the dashboard. """
+    layout = requests.get(f"{url}/_dash-layout", timeout=30).json()
+    radio_items = {}
+
+    def walk(component) -> None:
+        if isinstance(component, list):
+            for child in component:
+                walk(child)
+        elif isinstance(component, dict) and "props" in component:
+            props = component["props"]
+            if str(props.get("id", "")).startswith("radio_") and "options" in props:
+                radio_items[props["id"]] = {
+                    "options": [
+                        option["value"] if isinstance(option, dict) else option for option in props["options"]
+                        if not (isinstance(option, dict) and option.get("disabled"))
+                    ],
+                    "value": props["value"],
+                }
+            walk(props.get("children"))
+
+    walk(layout)
+    return radio_items
+
+
+def run_load_test(
+    url: str,
+    num_users: int,
+    duration: float,
+    think_time: float,
+    ramp_up: float,
+    seed: Optional[int] = None,
+    ) -> List[tuple]:
+    """
+    Simulate the given number of concurrent users for the given duration (in seconds, the users are started evenly
+    within the ramp-up period) and return the records (callback, time, latency, success) of all requests.
+    """
+    radio_items = get_radio_items(url)
+    rng = random.Random(seed)
+    records, lock = [], threading.Lock()
+    end = time.time() + duration
+
+    def simulate(user: VirtualUser, delay: float) -> None:
+        time.sleep(delay)
+        try:
+            user.run(end, think_time)
+        except Exception as e:
+            print(f"User error! {e}")
+
+    threads = [
+        threading.Thread(
+            target=simulate,
+            args=(VirtualUser(url, radio_items, random.Random(rng.random()), records, lock), ramp_up * i / num_users),
+            daemon=True,
+        )
+        for i in range(num_users)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records
+
+
+def summarize(records: List[tuple], duration: float) -> Dict[str, dict]:
+    """ Return the number of requests and errors, throughput and latency percentiles (in seconds) of each callback. """
+    groups = {}
+    for callback, _, latency, success in records:
+        groups.setdefault(callback, []).append((latency, success))
+    groups = dict(sorted(groups.items()))
+    groups["all"] = [(latency, success) for _, _, latency, success in records]
+
+    summary = {}
+    for callback, samples in groups.items():
+        latencies = np.array([latency for latency, _ in samples])
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) > 0 else (np.nan,) * 3
+        summary[callback] = {
+            "requests": len(samples),
+            "errors": sum(not success for _, success in samples),
+            "throughput": len(samples) / duration,
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+            "max": float(latencies.max()) if len(latencies) > 0 else np.nan,
+        }
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of the Dash callbacks with concurrent dashboard users.")
+    parser.add_argument("--url", default=DEFAULT_URL, help="URL of the running dashboard")
+    parser.add_argument("--users", type=int, default=10, help="number of concurrent users")
+    parser.add_argument("--duration", type=float, default=60., help="duration of the load test in seconds")
+    parser.add_argument("--think-time", type=float, default=2., help="mean time between two actions in seconds")
+    parser.add_argument("--ramp-up", type=float, default=5., help="period in which the users are started in seconds")
+    parser.add_argument("--seed", type=int, help="seed of the random user actions")
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+
+    url = args.url.rstrip("/")
+    try:
+        snapshot = requests.get(f"{url}/version", timeout=30).json()
+    except (requests.RequestException, ValueError) as e:
+        print(f"Dashboard error! {e}")
+        sys.exit(1)
+    if snapshot is None:
+        print("Dashboard error! No market data snapshot available yet, wait for the first update to finish.")
+        sys.exit(1)
+
+    start = time.time()
+    records = run_load_test(url, args.users, args.duration, args.think_time, args.ramp_up, args.seed)
+    summary = summarize(records, time.time() - start)
+
+    print(f"{'callback':<24}{'requests':>10}{'errors':>8}{'req/s':>8}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}")
+    for callback, stats in summary.items():
+        print(
+            f"{callback:<24}{stats['requests']:>10}{stats['errors']:>8}{stats['throughput']:>8.1f}"
+            f"{stats['p50'] * 1e3:>10.1f}{stats['p95'] * 1e3:>10.1f}{stats['p99'] * 1e3:>10.1f}"
+        )
+
+    if args.output:
+        result = {
+            "meta": {
+                "time": start,
+                "url": url,
+                "version": snapshot["version"],
+                "users": args.users,
+                "duration": args.duration,
+                "think_time": args.think_time,
+                "ramp_up": args.ramp_up,
+                "seed": args.seed,
+            },
+            "callbacks": summary,
+        }
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved the results to {args.output}")
@@ -0,0 +1,92 @@
+"""
+Startup profile of the dashboard.
+
+Each run starts a fresh Python process (python -X importtime) that imports app.py and requests the index page and the
+layout with the Flask test client, i.e. it measures the cold start of a web worker until it serves the dashboard. The
+report shows the median time of each startup phase and the packages and project modules with the largest import times
+(self time of all their modules, aggregated per top-level package). Run from the root directory of the project:
+
+    python -m benchmarks.startup_profile
+    python -m benchmarks.startup_profile --repeat 5 --top 20 --output startup.json
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List, Tuple
+
+
+# executed in the profiled process, prints the duration of each startup phase (in seconds) as JSON
+PROBE = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.server.test_client()
+client.get("/")
+index = time.perf_counter()
+client.get("/_dash-layout")
+client.get("/_dash-dependencies")
+layout = time.perf_counter()
+print(json.dumps({"import": imported - start, "index": index - imported, "layout": layout - index}))
+"""
+
+
+def profile_startup() -> Tuple[Dict[str, float], Dict[str, float]]:
+    """ Return the duration of each startup phase and the import self time of each module (in seconds). """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"Startup failed:\n{process.stderr[-2000:]}")
+
+    phases = json.loads(process.stdout.strip().splitlines()[-1])
+    modules = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, _, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = modules.get(name.strip(), 0.) + int(self_time) * 1e-6
+    return phases, modules
+
+
+def aggregate_modules(modules: Dict[str, float]) -> Dict[str, float]:
+    """ Return the import time per top-level package, modules of the project are listed individually. """
+    packages = {}
+    for name, seconds in modules.items():
+        key = name if name.split(".")[0] in ["src", "app"] else name.split(".")[0]
+        packages[key] = packages.get(key, 0.) + seconds
+    return dict(sorted(packages.items(), key=lambda item: -item[1]))
+
+
+def get_report(runs: List[Tuple[Dict[str, float], Dict[str, float]]], top: int) -> dict:
+    """ Return the median durations of the startup phases and the median import times of the slowest packages. """
+    phases = {name: statistics.median(run[0][name] for run in runs) for name in runs[0][0]}
+    phases["total"] = statistics.median(sum(run[0].values()) for run in runs)
+
+    packages = [aggregate_modules(run[1]) for run in runs]
+    names = set().union(*packages)
+    medians = {name: statistics.median(package.get(name, 0.) for package in packages) for name in names}
+    slowest = dict(sorted(medians.items(), key=lambda item: -item[1])[:top])
+    return {"phases": phases, "packages": slowest, "num_modules": statistics.median(len(run[1]) for run in runs)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Startup profile of the dashboard.")
+    parser.add_argument("--repeat", type=int, default=3, help="number of cold starts")
+    parser.add_argument("--top", type=int, default=15, help="number of packages to show")
+    parser.add_argument("--output", help="JSON file for the report")
+    args = parser.parse_args()
+
+    report = get_report([profile_startup() for _ in range(args.repeat)], args.top)
+
+    print(f"{'phase':<32}{'median (ms)':>13}")
+    for name, seconds in report["phases"].items():
+        print(f"{name:<32}{seconds * 1e3:>13.1f}")
+    print(f"\n{'package / module':<32}{'import (ms)':>13}   ({report['num_modules']:.0f} modules imported)")
+    for name, seconds in report["packages"].items():
+        print(f"{name:<32}{seconds * 1e3:>13.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved the report to {args.output}")
@@ -0,0 +1,19 @@
+import multiprocessing
+
+
+"""
+Gunicorn configuration of the multi-process serving mode.
+
+All workers read the shared market data snapshot (see src/shared_snapshot.py) and hand their refresh requests to one
+designated updater process, which has to be started separately:
+
+    python app.py --updater [--streaming]
+    gunicorn
+
+Both commands have to be run from the root directory of the project.
+"""
+
+wsgi_app = "app:server"
+bind = "0.0.0.0:8050"
+workers = min(2 * multiprocessing.cpu_count() + 1, 8)
+raw_env = ["DASHBOARD_ROLE=worker"]
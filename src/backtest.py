@@ -0,0 +1,264 @@
+import os
+import time
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Tuple
+from numpy.lib.stride_tricks import sliding_window_view
+
+from src.indicators import EMA_LENGTHS, PUMP_LOOK_BACK
+from src.kline_store import FIELDS, KLINES_FILE, INDEX_FILE
+from src.market_data import GAIN_PERIODS
+from src.snapshot_store import get_generation_dir
+from src.timeframes import TIMEFRAMES, DEFAULT_TIMEFRAME, get_look_back, resample_klines
+
+
+"""
+Backtesting of the screener metrics.
+
+The metrics of the screeners (gains, trend and pump strengths) are computed at every historical kline of all coins at
+once. The klines are aligned to a common time grid of shape (coin, time) and all metrics are computed with recursions
+over the time axis or with rolling windows, vectorized across all coins. The value at each kline only depends on the
+klines up to and including it, i.e. it is the value the dashboard would have shown right after the kline closed (see
+src/metrics.py, the results agree up to floating point rounding).
+
+At each kline, the altcoins are ranked by their trend strength and the forward returns (from the close of the kline
+to the close horizon klines later) of the top-ranked altcoins are compared with the mean forward return of all
+altcoins. Pump signals are evaluated in the same way, both with the threshold of the pump screener (pump strength
+above PUMP_SCREENER_THRESHOLD) and with any pump strength above 0 (maximum range above the mean plus num_std standard
+deviations of the ranges). The EMA lengths and num_std can be varied to evaluate the scoring:
+
+    python -m src.backtest --timeframe 4h --top 10 --horizons 1 6 42
+    python -m src.backtest --store data/history --ema-lengths 9 21 55 --num-std 2.5 --output history.npz
+
+By default, the klines of the most recent generation of the store (see src/snapshot_store.py) are used. --store
+accepts any directory with the same layout (klines.npy and index.csv), e.g. the history fetched by
+backfill_klines.py. See benchmarks/bench_backtest.py for a benchmark on synthetic klines.
+"""
+
+PUMP_SCREENER_THRESHOLD = 2.
+HORIZONS = [1, 6, 42] # in klines
+TOP = 10
+
+PriceArrays = Dict[str, np.ndarray]
+
+
+def align_klines(klines: np.ndarray, interval: int) -> Tuple[np.ndarray, PriceArrays]:
+    """
+    Align right-aligned klines of shape (coin, kline) as returned by stack_klines in src/kline_store.py with the given
+    interval (in minutes) to a common time grid. Returns the timestamps of the grid and the open, high, low and close
+    prices of shape (coin, time) with NaN values for missing klines.
+    """
+    step = interval * 60
+    is_valid = klines["timestamp"] > 0
+    coins = np.nonzero(is_valid)[0]
+    kline_timestamps = klines["timestamp"][is_valid]
+    if len(kline_timestamps) == 0:
+        return np.zeros(0, dtype=np.int64), {field: np.zeros((len(klines), 0)) for field in FIELDS}
+
+    start = kline_timestamps.min() // step * step
+    timestamps = np.arange(start, kline_timestamps.max() + 1, step)
+    columns = (kline_timestamps - start) // step
+    prices = {}
+    for field in FIELDS:
+        prices[field] = np.full((len(klines), len(timestamps)), np.nan)
+        prices[field][coins, columns] = klines[field][is_valid]
+    return timestamps, prices
+
+
+def get_metric_history(
+    prices: PriceArrays,
+    interval: int,
+    ema_lengths: List[int] = EMA_LENGTHS,
+    look_back: int = PUMP_LOOK_BACK,
+    num_std: float = 2.,
+    ) -> Dict[str, np.ndarray]:
+    """
+    Return the gains, trend strengths and pump strengths of shape (coin, time) at every kline given the aligned prices
+    (see align_klines) with the given interval (in minutes). The trend strength compares 3 EMAs with the given lengths.
+    """
+    close = prices["close"]
+    history = {}
+    for name, period in GAIN_PERIODS.items():
+        window = get_look_back(interval, period)
+        lowest = pd.DataFrame(prices["low"].T).rolling(window, min_periods=1).min().to_numpy().T
+        history[name] = close / lowest - 1.
+
+    ema_short, ema_medium, ema_long = get_ema_history(close, ema_lengths)
+    history["trend_strength"] = (ema_short / ema_medium + ema_medium / ema_long) / 2. - 1.
+    history["pump_strength"] = get_pump_history(prices, look_back, num_std)
+    return history
+
+
+def get_ema_history(close: np.ndarray, ema_lengths: List[int]) -> np.ndarray:
+    """
+    Return the EMAs of shape (EMA length, coin, time) of the close prices of shape (coin, time). The EMAs are equal to
+    close.ewm(span=length).mean() in pandas, i.e. missing prices are skipped but still decay the previous prices.
+    """
+    decays = 1. - 2. / (np.array(ema_lengths, dtype=float)[:, None] + 1.)
+    valid = ~np.isnan(close.T)
+    values = np.where(valid, close.T, 0.)
+
+    # one vectorized update of all coins per kline, the arrays are transposed to make the time steps contiguous
+    emas = np.empty((len(ema_lengths),) + values.shape)
+    sums = np.zeros((len(ema_lengths), len(close)))
+    weights = np.zeros((len(ema_lengths), len(close)))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for t in range(values.shape[0]):
+            sums = decays * sums + values[t]
+            weights = decays * weights + valid[t]
+            emas[:, t] = sums / weights
+    return emas.transpose(0, 2, 1)
+
+
+def get_pump_history(prices: PriceArrays, look_back: int = PUMP_LOOK_BACK, num_std: float = 2.) -> np.ndarray:
+    """
+    Return the pump strengths of shape (coin, time), see get_pump_strengths in src/metrics.py. The look-back consists
+    of the look_back klines before each kline and the kline itself. The range statistics exclude the 3 most recent
+    ranges and the oldest range, exactly like the indicator state in src/indicators.py.
+    """
+    ranges = prices["close"] - prices["open"]
+    num_coins, num_klines = ranges.shape
+    padded = np.concatenate([np.full((num_coins, look_back), np.nan), ranges], axis=1)
+
+    # window sums of the absolute ranges, squared ranges and counts of the klines t - look_back + 1 to t - 3
+    sums = []
+    for values in [np.nan_to_num(np.abs(padded)), np.nan_to_num(padded ** 2), (~np.isnan(padded)).astype(float)]:
+        windows = sliding_window_view(values[:, 1:num_klines + look_back - 3], look_back - 3, axis=1)
+        sums.append(windows.sum(axis=-1))
+    range_sum, range_sq_sum, count = sums
+
+    with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        max_range = np.fmax(np.fmax(padded[:, look_back - 2:-2], padded[:, look_back - 1:-1]), ranges)
+        mean = range_sum / count
+        std = np.sqrt(np.maximum(range_sq_sum - range_sum * mean, 0.) / (count - 1))
+        std = np.where(count > 1, std, np.nan)
+        return np.where(max_range > mean + num_std * std, max_range / mean - 1., 0.)
+
+
+def get_forward_returns(close: np.ndarray, horizon: int) -> np.ndarray:
+    """ Return the returns of shape (coin, time) from the close of each kline to the close horizon klines later. """
+    returns = np.full(close.shape, np.nan)
+    returns[:, :-horizon] = close[:, horizon:] / close[:, :-horizon] - 1.
+    return returns
+
+
+def evaluate_ranking(scores: np.ndarray, forward_returns: np.ndarray, top: int) -> dict:
+    """
+    Evaluate the top coins by score (both of shape (coin, time)) at each kline with at least 2 * top valid coins.
+    Returns the number of evaluated klines, the mean forward return of the top coins and of all coins, the mean
+    excess return and the share of klines at which the top coins outperformed.
+    """
+    valid = ~np.isnan(scores) & ~np.isnan(forward_returns)
+    is_evaluated = valid.sum(axis=0) >= 2 * top
+    valid = valid[:, is_evaluated]
+    returns = forward_returns[:, is_evaluated]
+    ranked = np.where(valid, scores[:, is_evaluated], -np.inf)
+
+    top_rows = np.argpartition(-ranked, top - 1, axis=0)[:top]
+    top_returns = np.take_along_axis(returns, top_rows, axis=0).mean(axis=0)
+    universe_returns = np.where(valid, returns, 0.).sum(axis=0) / valid.sum(axis=0)
+    return _summarize(top_returns, universe_returns)
+
+
+def evaluate_signals(signals: np.ndarray, forward_returns: np.ndarray) -> dict:
+    """
+    Evaluate the forward returns of all signals (boolean array of shape (coin, time)). The universe return of a signal
+    is the mean forward return of all coins at the kline of the signal.
+    """
+    valid = ~np.isnan(forward_returns)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        universe_returns = np.where(valid, forward_returns, 0.).sum(axis=0) / valid.sum(axis=0)
+    coins, times = np.nonzero(signals & valid)
+    return _summarize(forward_returns[coins, times], universe_returns[times])
+
+
+def run_backtest(
+    klines: np.ndarray,
+    names: List[str],
+    base_interval: int,
+    interval: int,
+    top: int = TOP,
+    horizons: List[int] = HORIZONS,
+    ema_lengths: List[int] = EMA_LENGTHS,
+    look_back: int = PUMP_LOOK_BACK,
+    num_std: float = 2.,
+    ) -> Tuple[pd.DataFrame, np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Backtest the screeners on right-aligned klines of shape (coin, kline) with the base interval of the given coins
+    (in the same order) at the given interval (both in minutes). Returns the report with one row per strategy and
+    horizon, the timestamps of the time grid and the metric history of shape (coin, time) of all coins.
+    """
+    timestamps, prices = align_klines(resample_klines(klines, base_interval, interval), interval)
+    history = get_metric_history(prices, interval, ema_lengths, look_back, num_std)
+
+    # the screeners only rank altcoins
+    is_altcoin = np.array(names) != "BTC"
+    trend = history["trend_strength"][is_altcoin]
+    pump = history["pump_strength"][is_altcoin]
+    rows = []
+    for horizon in horizons:
+        forward_returns = get_forward_returns(prices["close"][is_altcoin], horizon)
+        strategies = {
+            f"trend top {top}": evaluate_ranking(trend, forward_returns, top),
+            f"pump > {PUMP_SCREENER_THRESHOLD:g}": evaluate_signals(pump > PUMP_SCREENER_THRESHOLD, forward_returns),
+            f"pump > 0 ({num_std:g} std)": evaluate_signals(pump > 0., forward_returns),
+        }
+        rows += [{"strategy": strategy, "horizon": horizon, **result} for strategy, result in strategies.items()]
+    return pd.DataFrame(rows).set_index(["strategy", "horizon"]), timestamps, history
+
+
+def load_store_klines(directory: str) -> Tuple[np.ndarray, List[str], int]:
+    """ Return the klines, names and interval (in minutes) of a kline store directory (see src/kline_store.py). """
+    index_df = pd.read_csv(os.path.join(directory, INDEX_FILE), index_col="name")
+    klines = np.load(os.path.join(directory, KLINES_FILE))
+    intervals = index_df["interval"].unique()
+    if len(intervals) != 1:
+        raise ValueError(f"The klines in {directory} have different intervals: {list(intervals)}")
+    return klines, list(index_df.index), int(intervals[0])
+
+
+def _summarize(returns: np.ndarray, universe_returns: np.ndarray) -> dict:
+    """ Return the summary statistics of the given returns and the universe returns at the same times. """
+    excess_returns = returns - universe_returns
+    return {
+        "count": len(returns),
+        "mean_return": np.mean(returns) if len(returns) > 0 else np.nan,
+        "universe_return": np.mean(universe_returns) if len(returns) > 0 else np.nan,
+        "excess_return": np.mean(excess_returns) if len(returns) > 0 else np.nan,
+        "hit_rate": np.mean(excess_returns > 0.) if len(returns) > 0 else np.nan,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest the screener metrics on historical klines.")
+    parser.add_argument("--store", help="kline store directory (default: most recent generation)")
+    parser.add_argument("--timeframe", default=DEFAULT_TIMEFRAME, choices=list(TIMEFRAMES))
+    parser.add_argument("--top", type=int, default=TOP, help="number of top-ranked coins of the uptrend screener")
+    parser.add_argument("--horizons", type=int, nargs="+", default=HORIZONS, help="forward return horizons in klines")
+    parser.add_argument("--ema-lengths", type=int, nargs=3, default=EMA_LENGTHS)
+    parser.add_argument("--look-back", type=int, default=PUMP_LOOK_BACK, help="look-back of the pump strength")
+    parser.add_argument("--num-std", type=float, default=2., help="pump threshold in standard deviations")
+    parser.add_argument("--output", help="save the metric history as .npz file")
+    args = parser.parse_args()
+
+    interval = TIMEFRAMES[args.timeframe]
+    directory = args.store or get_generation_dir()
+    if directory is None:
+        raise FileNotFoundError("No stored klines, run the dashboard first or pass --store")
+    klines, names, base_interval = load_store_klines(directory)
+
+    start = time.time()
+    report, timestamps, history = run_backtest(
+        klines, names, base_interval, interval, args.top, args.horizons, args.ema_lengths, args.look_back,
+        args.num_std,
+    )
+    print(f"Backtested {len(names)} coins and {len(timestamps)} klines in {time.time() - start:.2f} seconds")
+    with pd.option_context("display.float_format", "{:.4f}".format, "display.max_columns", None, "display.width", 120):
+        print(report)
+
+    if args.output:
+        np.savez_compressed(args.output, timestamps=timestamps, names=np.array(names), **history)
+        print(f"Saved the metric history to {args.output}")
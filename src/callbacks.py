@@ -1,22 +1,24 @@
-import os
-import time
-import pandas as pd
 from datetime import datetime
 
-from dash import Dash, no_update, ctx, Output, Input, State
+from dash import Dash, no_update, ctx, Output, Input, State, ClientsideFunction
 import dash_bootstrap_components as dbc
 from dash.exceptions import PreventUpdate
 
-from src.market_data import update_market_data
+from src.scheduler import refresh_market_data, get_snapshot_version, MAX_SNAPSHOT_AGE
+from src.snapshot_cache import get_market_data, get_config, get_kline_status
 from src.components.table_cards import get_row_highlight_condition
-from src.components.figures import get_candlestick_figure, get_bar_figure
-from src.utils import filter_df, add_emas
+from src.components.figures import get_bar_figure, get_chart_style
+from src.components.info_card import get_debug_tables
+from src.figure_cache import get_chart_data, prewarm
+from src.instrumentation import load_metrics
+from src.snapshot_index import get_snapshot_index
+from src.table_pages import get_page
 
 
 def register_callbacks(app: Dash):
 
     @app.long_callback(
-        Output("timestamp", "data"),
+        Output("refresh_version", "data"),
         Input("update_button", "n_clicks"),
         running=[
             (Output("update_button", "disabled"), True, False),
@@ -25,12 +27,31 @@ def register_callbacks(app: Dash):
     )
     def update_data(n_clicks):
         """ 
-        Update all market data on startup or when the update button was clicked. 
-        Once the data is ready, the timestamp is updated, which triggers other callbacks.
+        Update all market data when the update button was clicked. On page load, the data is only updated if the most
+        recent snapshot is older than MAX_SNAPSHOT_AGE (it is shown right away by sync_timestamp in any case).
+        If another refresh is already in flight, its result is used instead of fetching the data again.
+        """
+        return refresh_market_data(max_age=MAX_SNAPSHOT_AGE if n_clicks is None else None)
+
+
+    @app.callback(
+        Output("timestamp", "data"),
+        Input("refresh_version", "data"),
+        Input("version_interval", "n_intervals"),
+        State("timestamp", "data"),
+    )
+    def sync_timestamp(refresh_version, n_intervals, timestamp):
+        """ 
+        Set the timestamp to the version of the most recent snapshot whenever a refresh finished or a newer 
+        snapshot (e.g. from the background refresh) is available. This triggers all other callbacks and the prewarming
+        of the chart cache. On page load, the most recent snapshot is shown right away instead of waiting for the
+        refresh of update_data.
         """
-        timestamp = int(time.time())
-        update_market_data()
-        return timestamp
+        version = get_snapshot_version()
+        if version is None or version == timestamp:
+            raise PreventUpdate
+        prewarm(version)
+        return version
 
 
     @app.callback(
@@ -39,78 +60,136 @@ def register_callbacks(app: Dash):
         prevent_initial_call=True,
     )
     def set_last_update_text(timestamp):
-        """ Display the time of the last update once the new data is available. """
-        return f"Last update: {datetime.fromtimestamp(timestamp).strftime('%d.%m.%Y, %H:%M')}"
+        """ 
+        Display the time of the last update once the new data is available. 
+        Coins for which the kline retrieval needed retries, fell back to perps or failed are reported as well.
+        """
+        text = f"Last update: {datetime.fromtimestamp(timestamp).strftime('%d.%m.%Y, %H:%M')}"
+
+        status = get_kline_status(timestamp)
+        if status is None:
+            return text
+
+        counts = status.value_counts()
+        details = [
+            f"{counts[key]} {label}" for key, label in [("retried", "retried"), ("perps", "from perps"), ("failed", "failed")]
+            if key in counts
+        ]
+        if len(details) > 0:
+            text += f" ({', '.join(details)})"
+        if "failed" in counts:
+            text += f" | Missing: {', '.join(status.index[status == 'failed'])}"
+        return text
+
 
-    
     @app.callback(
-        Output("trend_table", "data"),
-        Input("timestamp", "data"),
-        Input("radio_trend", "value"),
+        Output("debug_panel", "is_open"),
+        Input("debug_button", "n_clicks"),
+        State("debug_panel", "is_open"),
         prevent_initial_call=True,
     )
-    def update_trend_table(timestamp, filter):
-        """ Update the data table of the uptrend screener whenever the data was updated or another filter was selected. """
-        df = pd.read_csv(os.path.join("data", "market_data.csv"), index_col="name")
-        df = df.drop(["BTC"]) # only keep altcoins
-        df["id"] = df.index
-        df = filter_df(df, filter)
-        df = df[["id", "trend_strength", "gain_1d", "gain_1w", "gain_1m"]]
-
-        return df.to_dict("records")
+    def toggle_debug_panel(n_clicks, is_open):
+        """ Show or hide the debug panel with the instrumentation of the most recent update. """
+        return not is_open
 
 
     @app.callback(
-        Output("pump_table", "data"),
+        Output("debug_panel_content", "children"),
+        Input("debug_panel", "is_open"),
         Input("timestamp", "data"),
-        Input("radio_pump", "value"),
         prevent_initial_call=True,
     )
-    def update_pump_table(timestamp, filter):
-        """ Update the data table of the pump screener whenever the data was updated or another filter was selected. """
-        df = pd.read_csv(os.path.join("data", "market_data.csv"), index_col="name")
-        df = df.drop(["BTC"]) # only keep altcoins
-        df["id"] = df.index
-        df = filter_df(df, filter)
-        df = df.loc[df["pump_strength"] > 2]
-        df = df[["id", "pump_strength", "gain_1d", "gain_1w", "gain_1m"]]   
-        df = df.sort_values(by=["pump_strength"], ascending=False)
+    def update_debug_panel(is_open, timestamp):
+        """ Update the debug panel while it is shown, i.e. when it was opened or the data was updated. """
+        if not is_open:
+            raise PreventUpdate
+        return get_debug_tables(load_metrics())
 
-        return df.to_dict("records")
+    
+    @app.callback(
+        Output("trend_table", "data"),
+        Output("trend_table", "page_count"),
+        Output("trend_table", "page_current"),
+        Input("timestamp", "data"),
+        Input("radio_timeframe", "value"),
+        Input("radio_trend", "value"),
+        Input("trend_table", "page_current"),
+        Input("trend_table", "sort_by"),
+        State("trend_table", "page_size"),
+        prevent_initial_call=True,
+    )
+    def update_trend_table(timestamp, timeframe, filter, page_current, sort_by, page_size):
+        """ 
+        Update the visible page of the data table of the uptrend screener whenever the data was updated, another
+        timeframe, filter or page was selected or the sorting was changed. Another timeframe, filter or sorting goes
+        back to the first page, data updates keep the current page (or the last page if it does not exist anymore).
+        """
+        is_reset = ctx.triggered_prop_ids.keys() & {"radio_timeframe.value", "radio_trend.value", "trend_table.sort_by"}
+        page_current = 0 if is_reset or not page_current else page_current
+        mask = get_snapshot_index(timestamp, timeframe).masks[filter]
+        columns = ["id", "trend_strength", "gain_1d", "gain_1w", "gain_1m", "trend_strength_btc", "gain_btc_1w"]
+        return get_page(timestamp, timeframe, mask, columns, sort_by, page_current, page_size)
 
 
     @app.callback(
-        Output("trend_table", "page_current"),
+        Output("pump_table", "data"),
+        Output("pump_table", "page_count"),
         Output("pump_table", "page_current"),
         Input("timestamp", "data"),
-        Input("trend_table", "sort_by"),
+        Input("radio_timeframe", "value"),
+        Input("radio_pump", "value"),
+        Input("pump_table", "page_current"),
+        Input("pump_table", "sort_by"),
+        State("pump_table", "page_size"),
+        prevent_initial_call=True,
     )
-    def reset_to_first_page(timestamp, sort_by):
+    def update_pump_table(timestamp, timeframe, filter, page_current, sort_by, page_size):
         """ 
-        Go to the first page of both data tables whenever the data was updated. 
-        Go to the first page of the uptrend data table whenever the user changes the sorting.
+        Update the visible page of the data table of the pump screener whenever the data was updated, another
+        timeframe, filter or page was selected or the sorting was changed. Another timeframe, filter or sorting goes
+        back to the first page, data updates keep the current page (or the last page if it does not exist anymore).
         """
-        if ctx.triggered_id == "timestamp":
-            return 0, 0
-        return 0, no_update
+        is_reset = ctx.triggered_prop_ids.keys() & {"radio_timeframe.value", "radio_pump.value", "pump_table.sort_by"}
+        page_current = 0 if is_reset or not page_current else page_current
+        df = get_market_data(timestamp, timeframe)
+        mask = get_snapshot_index(timestamp, timeframe).masks[filter] & (df["pump_strength"] > 2).to_numpy()
+        columns = ["id", "pump_strength", "gain_1d", "gain_1w", "gain_1m"]
+        return get_page(timestamp, timeframe, mask, columns, sort_by, page_current, page_size)
 
 
     @app.callback(
         Output("altcoin", "data"),
         Output("trend_table", "active_cell"), Output("trend_table", "selected_cells"), Output("trend_table", "style_data_conditional"),
         Output("pump_table", "active_cell"), Output("pump_table", "selected_cells"), Output("pump_table", "style_data_conditional"),
-        Input("trend_table", "active_cell"),  Input("pump_table", "active_cell"), Input("timestamp", "data"),
-        Input("radio_trend", "value"),  Input("radio_pump", "value"),
+        Input("trend_table", "active_cell"),  Input("pump_table", "active_cell"),
+        Input("trend_table", "data"), Input("pump_table", "data"),
+        Input("radio_timeframe", "value"), Input("radio_trend", "value"), Input("radio_pump", "value"),
+        Input("trend_table", "sort_by"), Input("pump_table", "sort_by"),
+        State("altcoin", "data"),
         State("trend_table", "style_data_conditional"), State("pump_table", "style_data_conditional"),
         prevent_initial_call=True,
     )
-    def select_altcoin(active_cell_trend, active_cell_pump, timestamp, filter_trend, filter_pump, style_trend, style_pump):
+    def select_altcoin(
+        active_cell_trend, active_cell_pump, data_trend, data_pump, timeframe, filter_trend, filter_pump,
+        sort_by_trend, sort_by_pump, altcoin, style_trend, style_pump,
+    ):
         """ Highlight the table row of the currently selected altcoin. """
-        # remove highlighting when reloading or applying filters
-        if ctx.triggered_id in ["timestamp", "radio_trend", "radio_pump"]:
-            style_trend[1] = {}
-            style_pump[1] = {}
-            return no_update, None, [], style_trend, None, [], style_pump
+        # another timeframe, filter or sorting removes the highlighting, whereas data updates and page selections move
+        # it to the new row of the selected altcoin (and remove it if the altcoin is not visible anymore)
+        triggered = ctx.triggered_prop_ids.keys()
+        if triggered & {"trend_table.data", "pump_table.data"}:
+            styles = []
+            for table, data, style in [("trend", data_trend, style_trend), ("pump", data_pump, style_pump)]:
+                if f"{table}_table.data" not in triggered:
+                    styles.append(no_update)
+                    continue
+                rows = [row for row, record in enumerate(data) if record["id"] == altcoin]
+                is_reset = triggered & {"radio_timeframe.value", f"radio_{table}.value", f"{table}_table.sort_by"}
+                style[1] = get_row_highlight_condition(rows[0]) if style[1] and rows and not is_reset else {}
+                styles.append(style)
+            return no_update, None, [], styles[0], None, [], styles[1]
+        if not triggered & {"trend_table.active_cell", "pump_table.active_cell"}:
+            raise PreventUpdate
 
         altcoin = no_update
         if ctx.triggered_id == "trend_table":
@@ -138,83 +217,89 @@ def register_callbacks(app: Dash):
     @app.callback(
         Output("bar_chart", "children"),
         Input("timestamp", "data"),
+        Input("radio_timeframe", "value"),
         Input("radio_overview_filter", "value"),
         Input("radio_overview_timeframe", "value"),
         prevent_initial_call=True,
     )
-    def update_overview_card(timestamp, filter, timeframe):
+    def update_overview_card(timestamp, kline_timeframe, filter, timeframe):
         """ 
         Update the bar figure containing the top gainers whenever the data was updated 
         or another filter or timeframe was selected. 
         """
-        df = pd.read_csv(os.path.join("data", "market_data.csv"), index_col="name")
+        df = get_market_data(timestamp, kline_timeframe)
         col = f"gain_{timeframe.lower()}"
         btc_gain = df.loc["BTC", col]
-        df = df.drop(["BTC"]) # only keep altcoins
-        df = filter_df(df, filter)
-        df = df.sort_values(by=[col], ascending=False).iloc[:30]
+        df = df.iloc[get_snapshot_index(timestamp, kline_timeframe).top_rows[(filter, col)]]
 
         return get_bar_figure(names=df.index, gains=df[col], btc_gain=btc_gain, timeframe=timeframe)
         
 
     @app.callback(
-        Output("bitcoin_chart", "children"),
+        Output("chart_style", "data"),
         Input("timestamp", "data"),
-        Input("radio_btc_chart", "value"),
+        State("chart_style", "data"),
         prevent_initial_call=True,
     )
-    def update_bitcoin_chart(timestamp, timeframe):
-        """ Update the Bitcoin chart whenever the data was updated or another timeframe was selected. """
-        klines = pd.read_csv(os.path.join("data", "klines", "BTC.csv"), index_col="timestamp")
-        klines = add_emas(klines=klines, ema_lengths=[12, 21, 50])
+    def load_chart_style(timestamp, chart_style):
+        """ Send the layout and styles of the candlestick charts once per session. """
+        if chart_style is not None:
+            raise PreventUpdate
+        return get_chart_style()
 
-        if timeframe == "1W":
-            klines = klines.iloc[-42:]
-        else:
-            klines = klines.iloc[-186:]
 
-        return get_candlestick_figure(title="BTC / USD", klines=klines)
+    @app.callback(
+        Output("bitcoin_chart_data", "data"),
+        Input("timestamp", "data"),
+        Input("radio_timeframe", "value"),
+        prevent_initial_call=True,
+    )
+    def update_bitcoin_chart(timestamp, kline_timeframe):
+        """ Update the Bitcoin chart data whenever the data was updated or another kline timeframe was selected. """
+        return get_chart_data("BTC", "usd", kline_timeframe, timestamp)
     
 
     @app.callback(
-        Output("altcoin_usd_chart", "children"), 
-        Output("altcoin_btc_chart", "children"),
+        Output("altcoin_chart_data", "data"),
         Input("timestamp", "data"),
         Input("altcoin", "data"),
-        Input("radio_altcoin_chart", "value"), 
+        Input("radio_timeframe", "value"),
         prevent_initial_call=True,
     )
-    def update_altcoin_charts(timestamp, altcoin, timeframe):
-        """ Update both altcoin charts whenever the data was updated or another timeframe was selected. """
+    def update_altcoin_charts(timestamp, altcoin, kline_timeframe):
+        """ 
+        Update the chart data of the selected altcoin in USD and BTC whenever the data was updated, another altcoin or
+        kline timeframe was selected. The chart data is served from the cache if possible.
+        """
         if altcoin in [None, ""]:
             raise PreventUpdate
-        
-        btc_klines = pd.read_csv(os.path.join("data", "klines", "BTC.csv"), index_col="timestamp")
-        usd_denom_klines = pd.read_csv(os.path.join("data", "klines", f"{altcoin}.csv"), index_col="timestamp")
-        btc_denom_klines = pd.DataFrame(
-            index=usd_denom_klines.index,
-            data={
-                "open": usd_denom_klines["open"] / btc_klines["open"], 
-                "high": usd_denom_klines["high"] / btc_klines["close"],
-                "low": usd_denom_klines["low"] / btc_klines["close"], 
-                "close": usd_denom_klines["close"] / btc_klines["close"],
-            },
-        ).dropna()
-
-        usd_denom_klines = add_emas(klines=usd_denom_klines, ema_lengths=[12, 21, 50])
-        btc_denom_klines = add_emas(klines=btc_denom_klines, ema_lengths=[12, 21, 50])
-
-        if timeframe == "1W":
-            usd_denom_klines = usd_denom_klines.iloc[-42:]
-            btc_denom_klines = btc_denom_klines.iloc[-42:]
-        else:
-            usd_denom_klines = usd_denom_klines.iloc[-186:]
-            btc_denom_klines = btc_denom_klines.iloc[-186:]
 
-        usd_chart = get_candlestick_figure(title=f"{altcoin} / USD", klines=usd_denom_klines)
-        btc_chart = get_candlestick_figure(title=f"{altcoin} / BTC", klines=btc_denom_klines)
+        return {
+            "usd": get_chart_data(altcoin, "usd", kline_timeframe, timestamp),
+            "btc": get_chart_data(altcoin, "btc", kline_timeframe, timestamp),
+        }
+
 
-        return usd_chart, btc_chart
+    # the charts are rendered and switched between 1W and 1M in the browser (see assets/charts.js)
+    app.clientside_callback(
+        ClientsideFunction(namespace="charts", function_name="render_chart"),
+        Output("bitcoin_chart", "children"),
+        Input("bitcoin_chart_data", "data"),
+        Input("radio_btc_chart", "value"),
+        Input("chart_style", "data"),
+        prevent_initial_call=True,
+    )
+
+
+    app.clientside_callback(
+        ClientsideFunction(namespace="charts", function_name="render_altcoin_charts"),
+        Output("altcoin_usd_chart", "children"),
+        Output("altcoin_btc_chart", "children"),
+        Input("altcoin_chart_data", "data"),
+        Input("radio_altcoin_chart", "value"),
+        Input("chart_style", "data"),
+        prevent_initial_call=True,
+    )
 
 
     @app.callback(
@@ -225,7 +310,7 @@ def register_callbacks(app: Dash):
     )
     def update_bitcoin_links(timestamp):
         """ Update the TradingView and exchange links for Bitcoin whenever the data was updated. """
-        df = pd.read_csv(os.path.join("data", "config.csv"), index_col="name")
+        df = get_config(timestamp)
         tradingview_link = dbc.CardLink("TradingView", target="_blank", href=df.loc["BTC", "chart_usd"])
         
         exchange_links = []
@@ -241,11 +326,12 @@ def register_callbacks(app: Dash):
         Output("altcoin_tradingview", "children"),
         Output("altcoin_exchanges", "children"),
         Input("altcoin", "data"),
+        State("timestamp", "data"),
         prevent_initial_call=True,
     )
-    def update_altcoin_links(altcoin):
+    def update_altcoin_links(altcoin, timestamp):
         """ Update the TradingView and exchange links for the current altcoin whenever a new altcoin was selected. """
-        df = pd.read_csv(os.path.join("data", "config.csv"), index_col="name")
+        df = get_config(timestamp)
 
         tradingview_links = []
         if type(df.loc[altcoin, "chart_usd"]) == str:
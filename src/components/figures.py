@@ -1,9 +1,21 @@
-import pandas as pd
+import base64
 import copy
+import threading
+import numpy as np
+import pandas as pd
 import plotly.graph_objects as go
 from dash import dcc
+from typing import Dict
+
+
+# the figure template is loaded with the first figure since loading it takes a while (see load_template)
+_template_lock = threading.Lock()
+_template_loaded = False
 
 
+CHART_FIELDS = ["open", "high", "low", "close", "ema_12", "ema_21", "ema_50"]
+MISSING_LEVEL = 2**16 - 1 # quantized value of missing prices in the compact chart data
+
 figure_args = {
     "title_x": 0.5,
     "title_y": 0.98,
@@ -66,6 +78,7 @@ box_args = {
 
 def get_bar_figure(names: pd.Index, gains: pd.Series, btc_gain: float, timeframe: str) -> dcc.Graph:
     """ Return bar figure with top gainers of the last 24 hours. """
+    load_template()
     figure = go.Figure(data=go.Bar(
         x=names,
         y=gains,
@@ -93,60 +106,81 @@ def get_bar_figure(names: pd.Index, gains: pd.Series, btc_gain: float, timeframe
         annotation_yshift=-1,
     )
 
-    return dcc.Graph(figure=figure, config={"displayModeBar": False})
+    return get_graph(figure)
 
 
-def get_candlestick_figure(title: str, klines: pd.DataFrame) -> dcc.Graph:
-    """ Create and return a candlestick chart using the passed kline data. """
-    datetime = pd.to_datetime(klines.index, unit="s")
+def load_template() -> None:
+    """ Make the dark Bootstrap theme the default template of all figures (only loaded once per process). """
+    global _template_loaded
+    with _template_lock:
+        if not _template_loaded:
+            from dash_bootstrap_templates import load_figure_template
+            load_figure_template("darkly")
+            _template_loaded = True
 
-    # define candlestick and EMA traces
-    candlestick = go.Candlestick(
-        x=datetime,
-        open=klines["open"], high=klines["high"], 
-        low=klines["low"], close=klines["close"],
-    )
-    emas = [
-        go.Scatter(x=datetime, y=klines[ema], mode="lines", line=ema_args[ema], opacity=0.67)
-        for ema in ["ema_12", "ema_21", "ema_50"] if ema in klines.columns
-    ]
-    
-    # create figure
-    figure = go.Figure(data=[*emas, candlestick])
-    figure.update_layout(
-        title_text=title,
-        xaxis_rangeslider_visible=False,
-        hovermode=False,
-        **figure_args,
-    )
 
-    # required values for the chart annotations
-    lowest_low = klines["low"].min()
-    current_close = klines["close"].iloc[-1]
-    timestamp_low = klines["low"][klines["low"] == lowest_low].index[0]
-    datetime_low = pd.to_datetime(timestamp_low, unit="s")
-    gain = (current_close / lowest_low - 1.) * 100.
-
-    # horizontal lines that mark the price levels of the lowest low
-    # and the current close
-    figure.add_hline(y=lowest_low, **h_line_args)
-    figure.add_hline(y=current_close, **h_line_args)
-
-    # vertical arrow that visualizes the current gain
-    figure.add_annotation(
-        x=datetime_low,
-        y=current_close,
-        ax=datetime_low,
-        ay=lowest_low,
-        **arrow_args,
-    )
+def get_graph(figure: go.Figure) -> dcc.Graph:
+    """ Return a graph component containing the given figure. """
+    return dcc.Graph(figure=figure, config={"displayModeBar": False})
 
-    # annotation box containing the gain value
-    figure.add_annotation(
-        x=datetime_low,
-        y=0.5 * (current_close + lowest_low),
-        text="{:.1f}".format(gain) + "%",
-        **box_args,
-    )
 
-    return dcc.Graph(figure=figure, config={"displayModeBar": False})
+def get_chart_style() -> dict:
+    """
+    Return the layout of the candlestick charts and the styles of their EMA traces, price level lines and gain
+    annotations. The charts are rendered in the browser from the compact chart data (see assets/charts.js).
+    """
+    load_template()
+    figure = go.Figure()
+    figure.update_layout(xaxis_rangeslider_visible=False, hovermode=False, **figure_args)
+    figure.add_hline(y=0, **h_line_args)
+    figure.add_annotation(x=0, y=0, ax=0, ay=0, **arrow_args)
+    figure.add_annotation(x=0, y=0, **box_args)
+    layout = figure.to_plotly_json()["layout"]
+
+    return {
+        "layout": {key: value for key, value in layout.items() if key not in ["shapes", "annotations"]},
+        "h_line": layout["shapes"][0],
+        "arrow": layout["annotations"][0],
+        "box": layout["annotations"][1],
+        "emas": {ema: {"mode": "lines", "line": args, "opacity": 0.67} for ema, args in ema_args.items()},
+    }
+
+
+def create_chart_data(title: str, klines: pd.DataFrame, interval: int, look_backs: Dict[str, int]) -> dict:
+    """
+    Create and return the compact data of a candlestick chart using the passed kline data (including the EMAs), which
+    has to cover the longest chart timeframe. The number of klines of each chart timeframe is given by look_backs.
+
+    The prices are quantized to 16 bit integers between the lowest and highest value of the chart, which is far below
+    the resolution of the chart (the largest integer marks missing values). The timestamps are given by the first
+    timestamp and the interval (in minutes) and only sent as offsets (in intervals) if some klines are missing.
+    Both arrays are base64 encoded.
+    """
+    values = klines[CHART_FIELDS].to_numpy(dtype=float).T
+    lowest, highest = np.nanmin(values), np.nanmax(values)
+    scale = (highest - lowest) / (MISSING_LEVEL - 1) if highest > lowest else 1.
+    levels = np.where(np.isnan(values), MISSING_LEVEL, np.rint((values - lowest) / scale))
+
+    step = interval * 60
+    start = int(klines.index[0])
+    offsets = (klines.index.to_numpy(dtype=np.int64) - start) // step
+    is_complete = offsets[-1] == len(offsets) - 1
+
+    return {
+        "title": title,
+        "num_klines": len(klines),
+        "look_backs": {name: min(look_back, len(klines)) for name, look_back in look_backs.items()},
+        "start": start,
+        "step": step,
+        "offsets": None if is_complete else _encode(offsets.astype("<u4")),
+        "fields": CHART_FIELDS,
+        "min": lowest,
+        "scale": scale,
+        "missing": MISSING_LEVEL,
+        "values": _encode(levels.astype("<u2")),
+    }
+
+
+def _encode(values: np.ndarray) -> str:
+    """ Return the raw bytes of the given array as base64 string. """
+    return base64.b64encode(values.tobytes()).decode("ascii")
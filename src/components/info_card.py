@@ -1,5 +1,10 @@
 from dash import html
 import dash_bootstrap_components as dbc
+from typing import List
+
+from src.components.radio_items import get_radio_items
+from src.instrumentation import LATENCY_BUCKETS
+from src.timeframes import ALL_TIMEFRAMES, BASE_INTERVAL, TIMEFRAMES, DEFAULT_TIMEFRAME
 
 
 link_dropdown = dbc.DropdownMenu(
@@ -12,20 +17,96 @@ link_dropdown = dbc.DropdownMenu(
     align_end=True,
 )
 
-# card at the top that shows the time of the last update and links to external sites.
+# collapsible panel with the instrumentation of the most recent update (see src/instrumentation.py)
+debug_panel = dbc.Collapse(html.Div(id="debug_panel_content"), id="debug_panel", is_open=False)
+
+# timeframe selection, timeframes that are no multiple of the base interval are shown as disabled options
+timeframe_selection = html.Div([
+    get_radio_items(
+        id="radio_timeframe",
+        options=list(ALL_TIMEFRAMES),
+        value=DEFAULT_TIMEFRAME,
+        disabled=[name for name in ALL_TIMEFRAMES if name not in TIMEFRAMES],
+    ),
+    dbc.Tooltip(
+        f"Timeframes below {BASE_INTERVAL} minutes need a smaller base interval (BASE_INTERVAL in src/timeframes.py).",
+        target="radio_timeframe",
+    ) if len(TIMEFRAMES) < len(ALL_TIMEFRAMES) else None,
+])
+
+# card at the top that shows the time of the last update, the timeframe selection and links to external sites.
 info_card = dbc.Card(
-    dbc.Row([
-        dbc.Col([
-            html.H3("Cryptocurrency Dashboard"),
-            html.P("Last update:", id="last_update_text"),
+    [
+        dbc.Row([
+            dbc.Col([
+                html.H3("Cryptocurrency Dashboard"),
+                html.P("Last update:", id="last_update_text"),
+            ]),
+            dbc.Col(
+                dbc.Stack([
+                    timeframe_selection,
+                    dbc.Button("Update Data", id="update_button"),
+                    dbc.Button("Debug", id="debug_button", color="secondary", outline=True),
+                    link_dropdown,
+                ], direction="horizontal", gap=3, style={"float": "right"}),
+                align="center"
+            ),
         ]),
-        dbc.Col(
-            dbc.Stack([
-                dbc.Button("Update Data", id="update_button"),
-                link_dropdown,
-            ], direction="horizontal", gap=3, style={"float": "right"}),
-            align="center"
-        ),
-    ]),  
+        debug_panel,
+    ],
     body=True,
 )
+
+
+def get_debug_tables(metrics: dict) -> List:
+    """
+    Return the contents of the debug panel given the stored metrics (see load_metrics in src/instrumentation.py):
+    the wall time of each stage of the most recent update and the request statistics of each exchange since the
+    metrics were created.
+    """
+    last_update = metrics["last_update"]
+    if last_update is None:
+        return [html.P("No instrumented update yet.")]
+
+    stage_rows = [
+        html.Tr([html.Td(name), html.Td(f"{seconds:.3f} s")])
+        for name, seconds in list(last_update["stages"].items()) + [("total", last_update["duration"])]
+    ]
+    exchange_rows = [
+        html.Tr([
+            html.Td(exchange),
+            html.Td(stats["requests"]),
+            html.Td(f"{stats['latency_sum'] / max(1, stats['requests']):.3f} s"),
+            html.Td(f"{_get_quantile(stats['buckets'], 0.95)}"),
+            html.Td(f"{stats['bytes'] / 1e6:.1f} MB"),
+            html.Td(stats["retries"]),
+            html.Td(stats["failed"]),
+        ])
+        for exchange, stats in metrics["exchanges"].items()
+    ]
+    header = html.Thead(html.Tr([
+        html.Th(name) for name in ["Exchange", "Requests", "Mean Latency", "P95 Latency", "Payload", "Retries", "Failed"]
+    ]))
+    return [
+        html.Br(),
+        html.P(
+            f"Last update ({last_update['kind']}): {last_update['coins_dropped']} coins dropped | "
+            f"Updates: {', '.join(f'{count} {kind}' for kind, count in metrics['updates'].items())} | "
+            f"Full metrics: /metrics"
+        ),
+        dbc.Row([
+            dbc.Col(dbc.Table([html.Tbody(stage_rows)], size="sm"), width=3),
+            dbc.Col(dbc.Table([header, html.Tbody(exchange_rows)], size="sm"), width=9),
+        ]),
+    ]
+
+
+def _get_quantile(buckets: List[int], quantile: float) -> str:
+    """ Return the upper bound of the latency histogram bucket that contains the given quantile. """
+    threshold = quantile * sum(buckets)
+    count = 0
+    for bound, bucket_count in zip(LATENCY_BUCKETS + [None], buckets):
+        count += bucket_count
+        if count >= threshold and bucket_count > 0:
+            return f"> {LATENCY_BUCKETS[-1]:g} s" if bound is None else f"<= {bound:g} s"
+    return "-"
@@ -2,6 +2,7 @@ from dash import html
 import dash_bootstrap_components as dbc
 
 from src.components.radio_items import get_radio_items
+from src.snapshot_index import FILTERS
 
 
 # card that shows the top gainers
@@ -12,6 +13,6 @@ overview_card = dbc.Card(
             dbc.Col(get_radio_items(id="radio_overview_timeframe", options=["1D", "1W", "1M"], alignment="right")),
         ]),
         html.Div(id="bar_chart"),
-        get_radio_items(id="radio_overview_filter", options=["All", "Watchlist", "Tier 1", "Tier 2", "Tier 3", "Tier 4"]),
+        get_radio_items(id="radio_overview_filter", options=FILTERS),
     ], body=True
 )
@@ -1,17 +1,22 @@
 import dash_bootstrap_components as dbc
-from typing import List
+from typing import List, Optional
 
 
 def get_radio_items(
         id: str,
         options: List[str],
         alignment: str = "center",
+        value: Optional[str] = None,
+        disabled: List[str] = [],
     ) -> dbc.RadioItems:
-    """ Return radio items with the passed options. """
+    """
+    Return radio items with the passed options. The first option is selected by default. The disabled options are
+    shown but cannot be selected.
+    """
     return dbc.RadioItems(
         id=id,
-        options=options, 
-        value=options[0], 
+        options=[{"label": option, "value": option, "disabled": option in disabled} for option in options],
+        value=options[0] if value is None else value, 
         inline=True,
         style={
             "textAlign": alignment,
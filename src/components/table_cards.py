@@ -3,12 +3,17 @@ import dash_bootstrap_components as dbc
 from dash.dash_table import DataTable, FormatTemplate
 
 from src.components.radio_items import get_radio_items
+from src.snapshot_index import FILTERS
 
 
 percentage = FormatTemplate.percentage(1)
 
+# the tables are paged and sorted on the server (see src/table_pages.py)
 table_style_args = {
     "page_size": 30,
+    "page_action": "custom",
+    "sort_action": "custom",
+    "sort_mode": "single",
     "style_cell": {"border": "0px"},
     "style_header": {
         "backgroundColor": "rgb(55, 90, 127)",
@@ -45,7 +50,7 @@ trend_card = dbc.Card(
     html.Div(
         [
             dbc.Col(html.H4("Uptrend Screener")),           
-            get_radio_items(id="radio_trend", options=["All", "Watchlist", "Tier 1", "Tier 2", "Tier 3", "Tier 4"]),
+            get_radio_items(id="radio_trend", options=FILTERS),
             DataTable(
                 id="trend_table",
                 data=list(), 
@@ -55,8 +60,9 @@ trend_card = dbc.Card(
                     dict(id="gain_1d", name="Gain 1D", type="numeric", format=percentage),
                     dict(id="gain_1w", name="Gain 1W", type="numeric", format=percentage),
                     dict(id="gain_1m", name="Gain 1M", type="numeric", format=percentage),
+                    dict(id="trend_strength_btc", name="BTC Trend", type="numeric", format=FormatTemplate.percentage(2)),
+                    dict(id="gain_btc_1w", name="BTC Gain 1W", type="numeric", format=percentage),
                 ],
-                sort_action="native",
                 sort_by=[{"column_id": "trend_strength", "direction": "desc"}],
                 **table_style_args,
             )
@@ -71,7 +77,7 @@ pump_card = dbc.Card(
     html.Div(
         [   
             dbc.Col(html.H4("Pump Screener")),
-            get_radio_items(id="radio_pump", options=["All", "Watchlist", "Tier 1", "Tier 2", "Tier 3", "Tier 4"]),
+            get_radio_items(id="radio_pump", options=FILTERS),
             DataTable(
                 id="pump_table",
                 data=list(), 
@@ -82,6 +88,7 @@ pump_card = dbc.Card(
                     dict(id="gain_1w", name="Gain 1W", type="numeric", format=percentage),
                     dict(id="gain_1m", name="Gain 1M", type="numeric", format=percentage),
                 ],
+                sort_by=[{"column_id": "pump_strength", "direction": "desc"}],
                 **table_style_args,
             )
         ], 
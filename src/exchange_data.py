@@ -1,9 +1,19 @@
 import time
-import requests
+import numpy as np
 import pandas as pd
+from operator import itemgetter
+from itertools import chain
 from requests.models import Response
-from concurrent.futures import ThreadPoolExecutor
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+
+from src.fetcher import KlineRequest, FetchResult, fetch_all
+from src.instrumentation import stage
+
+# use the faster orjson decoder if it is installed
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
 
 
 """
@@ -23,6 +33,9 @@ GATIO_ENDPOINT = "https://api.gateio.ws/api/v4/spot/candlesticks"
 HUOBI_ENDPOINT = "https://api.huobi.pro/market/history/kline"
 KUCOIN_ENDPOINT = "https://api.kucoin.com/api/v1/market/candles"
 
+# maximum number of klines per request of each exchange (Huobi only returns the most recent klines)
+MAX_KLINES = {"binance": 1000, "bybit": 1000, "gateio": 1000, "huobi": 2000, "kucoin": 1500}
+
 INTERVALS = {
     "binance": {5: "5m", 15: "15m", 60: "1h", 240: "4h", 1440: "1d"},
     "bybit": {5: "5", 15: "15", 60: "60", 240: "240", 1440: "D"},
@@ -36,7 +49,8 @@ def get_klines(
     info_df: pd.DataFrame,
     interval: int,
     num_klines: int = 100,
-    ) -> Dict[str, pd.DataFrame]:
+    since: Optional[Dict[str, int]] = None,
+    ) -> Tuple[Dict[str, pd.DataFrame], Dict[str, str], List[str]]:
     """
     Fetch the most recent klines for all the coins in info_df.
 
@@ -46,69 +60,173 @@ def get_klines(
         interval
             Kline interval in minutes.
         num_klines
-            How many klines to fetch.
+            How many klines to fetch. Klines beyond the maximum number of klines per request of an exchange are
+            fetched in pages (not supported by Huobi, which only returns its most recent klines).
+        since
+            Optional timestamps (in seconds) of the last closed klines that are already stored locally.
+            For the coins contained in this dictionary, only the klines after these timestamps are fetched.
 
     Returns:
         Dictionary containing the klines for each coin.
         Key: name of the coin. Value: data frame containing the kline data.
+        Dictionary containing the outcome of the kline retrieval for each coin.
+        Key: name of the coin. Value: "ok", "retried" (successful after retries), "perps" (fetched from the
+        Binance perps endpoint since the spot request failed) or "failed" (coin is missing in the kline dictionary).
+        List of the coins whose klines are incomplete, i.e. an older page could not be fetched before the requested
+        number of klines or the first kline of the coin was reached.
+    """
+    limits = [_get_num_klines(name, interval, num_klines, since) for name in info_df.index]
+    page_limits = [min(limit, MAX_KLINES[exchange]) for limit, exchange in zip(limits, info_df["exchange"])]
+    kline_dict, status_dict = _fetch_klines(info_df, interval, page_limits)
+
+    # prepend older pages until the requested number of klines or the first kline of a coin is reached
+    pending, incomplete = {}, []
+    for name, limit, page_limit in zip(info_df.index, limits, page_limits):
+        is_full = name in kline_dict and len(kline_dict[name]) >= page_limit
+        if limit > page_limit and is_full and info_df.loc[name, "exchange"] != "huobi":
+            pending[name] = limit
+    while len(pending) > 0:
+        ends = {name: int(kline_dict[name]["timestamp"].iloc[0]) - interval * 60 for name in pending}
+        page_dict, _ = get_kline_pages(info_df.loc[list(pending)], interval, ends)
+        for name in list(pending):
+            page = page_dict.get(name)
+            if page is None:
+                incomplete.append(name)
+            page = None if page is None else page[page["timestamp"] <= ends[name]]
+            if page is None or len(page) == 0:
+                del pending[name]
+                continue
+            num_missing = pending[name] - len(kline_dict[name])
+            kline_dict[name] = pd.concat([page.iloc[-num_missing:], kline_dict[name]], ignore_index=True)
+            if len(kline_dict[name]) >= pending[name]:
+                del pending[name]
+
+    return kline_dict, status_dict, incomplete
+
+
+def get_kline_pages(
+    info_df: pd.DataFrame,
+    interval: int,
+    ends: Dict[str, int],
+    ) -> Tuple[Dict[str, pd.DataFrame], Dict[str, str]]:
+    """
+    Fetch one page of klines for all the coins in info_df, i.e. the maximum number of klines per request of the
+    exchange that end with the kline containing the given timestamp. Older klines are fetched by requesting the page
+    that ends before the first kline of the previous page. Huobi does not support this, its pages always contain the
+    most recent klines.
+
+    Args:
+        info_df
+            Data frame with information about the coins.
+        interval
+            Kline interval in minutes.
+        ends
+            Timestamp (in seconds) within the last kline of the page for each coin in info_df.
+
+    Returns:
+        Dictionary containing the klines for each coin and dictionary containing the outcome of the kline retrieval
+        for each coin (see get_klines). The pages of coins that are not listed yet at the end timestamp are empty.
+    """
+    limits = [MAX_KLINES[exchange] for exchange in info_df["exchange"]]
+    return _fetch_klines(info_df, interval, limits, [ends[name] for name in info_df.index])
+
+
+def _fetch_klines(
+    info_df: pd.DataFrame,
+    interval: int,
+    limits: List[int],
+    ends: Optional[List[int]] = None,
+    ) -> Tuple[Dict[str, pd.DataFrame], Dict[str, str]]:
+    """
+    Fetch the given number of klines for all the coins in info_df that end with the kline containing the given
+    timestamps (the most recent klines by default). Returns the kline and status dictionaries (see get_klines).
     """
-    responses = _get_all_responses(info_df, interval, num_klines)
+    ends = [None] * len(info_df) if ends is None else ends
+    with stage("fetch"):
+        results = _get_all_results(info_df, interval, limits, ends)
 
-    kline_dict = {}
-    names = info_df.index.values
-    for i in range(len(names)):
-        exchange = info_df.loc[names[i], "exchange"]
+    kline_dict, status_dict = {}, {}
+    perps_names, perps_requests = [], []
+    for name, limit, end, result in zip(info_df.index, limits, ends, results):
+        exchange = info_df.loc[name, "exchange"]
         try:
+            with stage("parse"):
+                kline_dict[name] = _parse_klines(exchange, result.response)
+            status_dict[name] = "retried" if result.attempts > 1 else "ok"
+        except Exception:
             if exchange == "binance":
-                try:
-                    kline_dict[names[i]] = _get_binance_klines(responses[i])
-                except:
-                    # try perps endpoint in case there is no spot listing
-                    params = {
-                        "symbol": info_df.loc[names[i], "symbol"],
-                        "interval": INTERVALS[exchange][interval],
-                        "limit": num_klines,
-                    }
-                    response = requests.get(BINANCE_PERPS_ENDPOINT, params=params)
-                    kline_dict[names[i]] = _get_binance_klines(response)
-            elif exchange == "bybit":
-                kline_dict[names[i]] = _get_bybit_klines(responses[i])
-            elif exchange == "gateio":
-                kline_dict[names[i]] = _get_gateio_klines(responses[i])
-            elif exchange == "huobi":
-                kline_dict[names[i]] = _get_huobi_klines(responses[i])
-            elif exchange == "kucoin":
-                kline_dict[names[i]] = _get_kucoin_klines(responses[i])
-        except:
-            print(f"Kline retrieval error! Name: {names[i]}, exchange: {exchange}")
+                # try perps endpoint in case there is no spot listing
+                params = {
+                    "symbol": info_df.loc[name, "symbol"],
+                    "interval": INTERVALS[exchange][interval],
+                    "limit": limit,
+                }
+                if end is not None:
+                    params["endTime"] = end * 1000
+                perps_names.append(name)
+                perps_requests.append(KlineRequest("binance_perps", BINANCE_PERPS_ENDPOINT, params, weight=1))
+            else:
+                print(f"Kline retrieval error! Name: {name}, exchange: {exchange}")
+                status_dict[name] = "failed"
+
+    # send all perps requests at once
+    with stage("fetch"):
+        perps_results = fetch_all(perps_requests)
+    for name, result in zip(perps_names, perps_results):
+        try:
+            with stage("parse"):
+                kline_dict[name] = _parse_klines("binance", result.response)
+            status_dict[name] = "perps"
+        except Exception:
+            print(f"Kline retrieval error! Name: {name}, exchange: binance")
+            status_dict[name] = "failed"
     
-    return kline_dict
+    return kline_dict, status_dict
+
+
+def _get_num_klines(
+    name: str,
+    interval: int,
+    num_klines: int,
+    since: Optional[Dict[str, int]],
+    ) -> int:
+    """
+    Return how many klines need to be fetched for the given coin. If the timestamp of the last stored closed kline
+    is known, only the klines after it (plus the last closed kline itself as overlap) are requested.
+    """
+    if since is None or name not in since:
+        return num_klines
+
+    num_new_klines = int(time.time() - since[name]) // (interval * 60) + 1
+    return max(2, min(num_klines, num_new_klines))
 
 
-def _get_all_responses(
+def _get_all_results(
     info_df: pd.DataFrame,
     interval: int,
-    num_klines: int = 100,
-    ) -> List[Response]:
+    limits: List[int],
+    ends: List[Optional[int]],
+    ) -> List[FetchResult]:
     """
-    Send kline data requests for all the coins in info_df and return all the response objects.
+    Send kline data requests for all the coins in info_df and return all the results.
+    The number of klines to fetch for each coin is given by limits and the end timestamps by ends.
     """
-    with ThreadPoolExecutor(max_workers=50) as executor:
-        futures = [
-            executor.submit(_get_response, name, info_df, interval, num_klines) 
-            for name in info_df.index
-        ]
-        return [future.result() for future in futures]
+    return fetch_all([
+        _get_request(name, info_df, interval, limit, end)
+        for name, limit, end in zip(info_df.index, limits, ends)
+    ])
 
 
-def _get_response(
+def _get_request(
     name: str,
     info_df: pd.DataFrame,
     interval: int,
     num_klines: int,
-    ) -> Response:
+    end: Optional[int] = None,
+    ) -> KlineRequest:
     """
-    Send a kline data request for the given coin and return the response object.
+    Return the kline data request for the given coin. The klines end with the kline that contains the given timestamp
+    (in seconds) or with the most recent kline if it is None.
     """
     exchange = info_df.loc[name, "exchange"]    
     if exchange == "binance":
@@ -117,7 +235,9 @@ def _get_response(
             "interval": INTERVALS[exchange][interval],
             "limit": num_klines,
         }
-        return requests.get(BINANCE_ENDPOINT, params=params)
+        if end is not None:
+            params["endTime"] = end * 1000
+        return KlineRequest(exchange, BINANCE_ENDPOINT, params, weight=2)
     elif exchange == "bybit":
         params = {
             "category": "spot",
@@ -125,47 +245,67 @@ def _get_response(
             "interval": INTERVALS[exchange][interval],
             "limit": num_klines,
         }
-        return requests.get(BYBIT_ENDPOINT, params=params)
+        if end is not None:
+            params["end"] = end * 1000
+        return KlineRequest(exchange, BYBIT_ENDPOINT, params)
     elif exchange == "gateio":
         params = {
             "currency_pair": info_df.loc[name, "symbol"],
             "interval": INTERVALS[exchange][interval],
             "limit": num_klines,
         }
-        return requests.get(GATIO_ENDPOINT, params=params)
+        if end is not None:
+            # the limit must not be combined with a time range
+            del params["limit"]
+            params["from"] = end // (interval * 60) * interval * 60 - (num_klines - 1) * interval * 60
+            params["to"] = end
+        return KlineRequest(exchange, GATIO_ENDPOINT, params)
     elif exchange == "huobi":
         params = {
             "symbol": info_df.loc[name, "symbol"].lower(),
             "period": INTERVALS[exchange][interval],
             "size": num_klines,
         }
-        return requests.get(HUOBI_ENDPOINT, params=params)
+        return KlineRequest(exchange, HUOBI_ENDPOINT, params)
     elif exchange == "kucoin":
         params = {
             "symbol": info_df.loc[name, "symbol"],
             "type": INTERVALS[exchange][interval],
             "startAt": int(time.time()) - interval * num_klines * 60,
         }
-        return requests.get(KUCOIN_ENDPOINT, params=params)
+        if end is not None:
+            params["startAt"] = end // (interval * 60) * interval * 60 - (num_klines - 1) * interval * 60
+            params["endAt"] = end
+        return KlineRequest(exchange, KUCOIN_ENDPOINT, params)
     else:
         raise ValueError(f"Invalid exchange: {exchange}")
 
 
+def _parse_klines(exchange: str, response: Optional[Response]) -> pd.DataFrame:
+    """
+    Return data frame with kline data given a response from the API of the given exchange.
+    Raise an error if the request failed.
+    """
+    if response is None or response.status_code != 200:
+        raise ValueError(f"Invalid response from {exchange}")
+
+    parsers = {
+        "binance": _get_binance_klines,
+        "bybit": _get_bybit_klines,
+        "gateio": _get_gateio_klines,
+        "huobi": _get_huobi_klines,
+        "kucoin": _get_kucoin_klines,
+    }
+    return parsers[exchange](response)
+
+
 def _get_binance_klines(response: Response) -> pd.DataFrame:
     """ 
     Return data frame with kline data given a response from the Binance API.
     Format of the kline data is consistent across all exchanges.
     """
-    data = response.json()
-    n = len(data)
-
-    return pd.DataFrame(data={
-        "timestamp": [data[i][0] // 1000 for i in range(n)], # in seconds
-        "open": [float(data[i][1]) for i in range(n)],
-        "high": [float(data[i][2]) for i in range(n)],
-        "low": [float(data[i][3]) for i in range(n)],
-        "close": [float(data[i][4]) for i in range(n)],
-    })
+    data = _loads(response.content)
+    return _to_data_frame(data, fields=itemgetter(0, 1, 2, 3, 4), timestamp_unit=1000)
 
 
 def _get_bybit_klines(response: Response) -> pd.DataFrame:
@@ -173,17 +313,10 @@ def _get_bybit_klines(response: Response) -> pd.DataFrame:
     Return data frame with kline data given a response from the Bybit API.
     Format of the kline data is consistent across all exchanges.
     """
-    data = response.json()["result"]["list"]
-    n = len(data)
+    data = _loads(response.content)["result"]["list"]
 
     # klines are in reversed order (last kline is at index 0)
-    return pd.DataFrame(data={
-        "timestamp": [int(data[i][0]) // 1000 for i in reversed(range(n))], # in seconds
-        "open": [float(data[i][1]) for i in reversed(range(n))],
-        "high": [float(data[i][2]) for i in reversed(range(n))],
-        "low": [float(data[i][3]) for i in reversed(range(n))],
-        "close": [float(data[i][4]) for i in reversed(range(n))],
-    })
+    return _to_data_frame(data, fields=itemgetter(0, 1, 2, 3, 4), timestamp_unit=1000, reverse=True)
 
 
 def _get_gateio_klines(response: Response) -> pd.DataFrame:
@@ -191,16 +324,8 @@ def _get_gateio_klines(response: Response) -> pd.DataFrame:
     Return data frame with kline data given a response from the Gate.io API.
     Format of the kline data is consistent across all exchanges.
     """
-    data = response.json()
-    n = len(data)
-
-    return pd.DataFrame(data={
-        "timestamp": [int(data[i][0]) for i in range(n)],
-        "open": [float(data[i][5]) for i in range(n)],
-        "high": [float(data[i][3]) for i in range(n)],
-        "low": [float(data[i][4]) for i in range(n)],
-        "close": [float(data[i][2]) for i in range(n)],
-    })
+    data = _loads(response.content)
+    return _to_data_frame(data, fields=itemgetter(0, 5, 3, 4, 2))
 
 
 def _get_huobi_klines(response: Response) -> pd.DataFrame:
@@ -208,17 +333,10 @@ def _get_huobi_klines(response: Response) -> pd.DataFrame:
     Return data frame with kline data given a response from the Huobi API.
     Format of the kline data is consistent across all exchanges.
     """
-    data = response.json()["data"]
-    n = len(data)
+    data = _loads(response.content)["data"]
 
     # klines are in reversed order (last kline is at index 0)
-    return pd.DataFrame(data={
-        "timestamp": [int(data[i]["id"]) for i in reversed(range(n))],
-        "open": [float(data[i]["open"]) for i in reversed(range(n))],
-        "high": [float(data[i]["high"]) for i in reversed(range(n))],
-        "low": [float(data[i]["low"]) for i in reversed(range(n))],
-        "close": [float(data[i]["close"]) for i in reversed(range(n))],
-    })
+    return _to_data_frame(data, fields=itemgetter("id", "open", "high", "low", "close"), reverse=True)
 
 
 def _get_kucoin_klines(response: Response) -> pd.DataFrame:
@@ -226,14 +344,33 @@ def _get_kucoin_klines(response: Response) -> pd.DataFrame:
     Return data frame with kline data given a response from the KuCoin API.
     Format of the kline data is consistent across all exchanges.
     """
-    data = response.json()["data"]
-    n = len(data)
+    data = _loads(response.content)["data"]
 
     # klines are in reversed order (last kline is at index 0)
+    return _to_data_frame(data, fields=itemgetter(0, 1, 3, 4, 2), reverse=True)
+
+
+def _to_data_frame(
+    data: List,
+    fields: itemgetter,
+    timestamp_unit: int = 1,
+    reverse: bool = False,
+    ) -> pd.DataFrame:
+    """
+    Return data frame with kline data given the decoded klines of an exchange API. The fields getter returns the
+    timestamp, open, high, low and close values of a single kline. All values (numbers or numeric strings) are
+    converted into one contiguous float64 array in a single pass. Timestamps are converted from the given unit
+    (1000 for milliseconds) into seconds. If reverse is true, the kline order is reversed by slicing.
+    """
+    values = np.fromiter(chain.from_iterable(map(fields, data)), dtype=np.float64, count=5 * len(data))
+    values = values.reshape(-1, 5)
+    if reverse:
+        values = values[::-1]
+
     return pd.DataFrame(data={
-        "timestamp": [int(data[i][0]) for i in reversed(range(n))],
-        "open": [float(data[i][1]) for i in reversed(range(n))],
-        "high": [float(data[i][3]) for i in reversed(range(n))],
-        "low": [float(data[i][4]) for i in reversed(range(n))],
-        "close": [float(data[i][2]) for i in reversed(range(n))],
+        "timestamp": values[:, 0].astype(np.int64) // timestamp_unit, # in seconds
+        "open": values[:, 1],
+        "high": values[:, 2],
+        "low": values[:, 3],
+        "close": values[:, 4],
     })
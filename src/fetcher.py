@@ -0,0 +1,227 @@
+import os
+import time
+import random
+import asyncio
+import requests
+from functools import partial
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from requests.models import Response
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, NamedTuple, Optional
+
+from src.instrumentation import record_request
+
+
+"""
+Asynchronous request engine for the exchange APIs.
+
+Requests are scheduled on an asyncio event loop and sent through one pooled keep-alive session per exchange host,
+so that connections (and TLS handshakes) are reused across coins. Each exchange has its own concurrency limit and
+request weight budget per minute. Failed requests are retried with jittered exponential backoff. Rate limit responses
+(HTTP 429/418) and the used weight reported by the exchange pause or shrink the budget of the whole exchange. The
+budget is paused for the full Retry-After period, requests that would have to wait longer than BACKOFF_MAX seconds
+fail instead (the coins are fetched again by the next update).
+The latency, payload size and attempts of each request are recorded by src/instrumentation.py.
+Set the environment variable EXCHANGE_API_URL (e.g. http://127.0.0.1:8000) to
+send all requests to a local stub server instead of the exchanges (see src/stub_exchange.py).
+"""
+
+REQUEST_TIMEOUT = 10 # in seconds
+
+# retries of failed requests (connection errors, rate limits, server errors)
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5 # in seconds
+BACKOFF_MAX = 30. # in seconds
+RATE_LIMIT_STATUS_CODES = {418, 429}
+RETRY_STATUS_CODES = RATE_LIMIT_STATUS_CODES | {500, 502, 503, 504}
+
+# response headers that contain the request weight used within the current minute
+USED_WEIGHT_HEADERS = {
+    "binance": "X-MBX-USED-WEIGHT-1M",
+    "binance_perps": "X-MBX-USED-WEIGHT-1M",
+}
+
+# maximum number of concurrent requests and request weight budget per minute for each exchange
+EXCHANGE_LIMITS = {
+    "binance": {"concurrency": 20, "weight_per_minute": 6000},
+    "binance_perps": {"concurrency": 10, "weight_per_minute": 2400},
+    "bybit": {"concurrency": 10, "weight_per_minute": 6000},
+    "gateio": {"concurrency": 10, "weight_per_minute": 1200},
+    "huobi": {"concurrency": 10, "weight_per_minute": 6000},
+    "kucoin": {"concurrency": 10, "weight_per_minute": 4000},
+}
+
+
+class KlineRequest(NamedTuple):
+    """ Kline data request for a single coin. """
+    exchange: str
+    url: str
+    params: Dict
+    weight: int = 1
+
+
+class FetchResult(NamedTuple):
+    """ Response of a kline data request (None if all attempts failed) and the number of attempts. """
+    response: Optional[Response]
+    attempts: int
+
+
+class _WeightBudget:
+    """
+    Token bucket that limits the request weight per minute of an exchange. It does not need a lock since tokens are
+    only taken on the event loop thread without awaiting in between.
+    """
+
+    def __init__(self, weight_per_minute: int):
+        self.capacity = weight_per_minute
+        self.rate = weight_per_minute / 60.
+        self.tokens = float(weight_per_minute)
+        self.updated = time.monotonic()
+        self.paused_until = 0.
+
+    async def acquire(self, weight: int) -> bool:
+        """
+        Wait until the given request weight is available and take it from the budget. Returns False without waiting
+        if the budget is paused for more than BACKOFF_MAX seconds.
+        """
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                if self.paused_until - now > BACKOFF_MAX:
+                    return False
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= weight:
+                self.tokens -= weight
+                return True
+            await asyncio.sleep((weight - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """ Stop handing out request weight for the given number of seconds. """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def sync(self, used_weight: int) -> None:
+        """ Make sure that the budget does not exceed the weight that the exchange reports as still available. """
+        self.tokens = min(self.tokens, float(self.capacity - used_weight))
+
+
+# sessions and weight budgets are kept for the lifetime of the process
+_sessions: Dict[str, requests.Session] = {}
+_budgets: Dict[str, _WeightBudget] = {}
+
+
+def fetch_all(kline_requests: List[KlineRequest]) -> List[FetchResult]:
+    """
+    Send all the given requests concurrently and return the results in the same order.
+    The response of a result is None if the request could not be sent successfully within all attempts
+    (e.g. due to connection errors, timeouts or rate limits).
+    """
+    if len(kline_requests) == 0:
+        return []
+    return asyncio.run(_fetch_all(kline_requests))
+
+
+async def _fetch_all(kline_requests: List[KlineRequest]) -> List[FetchResult]:
+    """
+    Send all the given requests while respecting the concurrency limits and weight budgets of the exchanges.
+    The blocking requests are sent from a thread pool that is large enough to saturate all concurrency limits.
+    """
+    exchanges = {request.exchange for request in kline_requests}
+    semaphores = {exchange: asyncio.Semaphore(EXCHANGE_LIMITS[exchange]["concurrency"]) for exchange in exchanges}
+    for exchange in exchanges:
+        if exchange not in _budgets:
+            _budgets[exchange] = _WeightBudget(EXCHANGE_LIMITS[exchange]["weight_per_minute"])
+
+    max_workers = sum(EXCHANGE_LIMITS[exchange]["concurrency"] for exchange in exchanges)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return await asyncio.gather(*[
+            _fetch(request, semaphores[request.exchange], executor)
+            for request in kline_requests
+        ])
+
+
+async def _fetch(
+    request: KlineRequest,
+    semaphore: asyncio.Semaphore,
+    executor: ThreadPoolExecutor,
+    ) -> FetchResult:
+    """
+    Send a single request as soon as a concurrency slot and enough request weight are available.
+    The request is retried if it fails due to connection errors, rate limits or server errors. It fails without
+    further attempts if the exchange asks to wait longer than BACKOFF_MAX seconds.
+    """
+    budget = _budgets[request.exchange]
+    url = _get_url(request.url)
+    get = partial(_get_session(url).get, url, params=request.params, timeout=REQUEST_TIMEOUT)
+
+    response, latency = None, 0.
+    for attempt in range(1, MAX_RETRIES + 2):
+        async with semaphore:
+            if not await budget.acquire(request.weight):
+                break
+            start = time.perf_counter()
+            try:
+                response = await asyncio.get_running_loop().run_in_executor(executor, get)
+            except requests.RequestException:
+                response = None
+            latency = time.perf_counter() - start
+
+        if response is not None:
+            used_weight = response.headers.get(USED_WEIGHT_HEADERS.get(request.exchange, ""))
+            if used_weight is not None and used_weight.isdigit():
+                budget.sync(int(used_weight))
+            if response.status_code not in RETRY_STATUS_CODES:
+                record_request(request.exchange, latency, len(response.content), attempt, failed=False)
+                return FetchResult(response, attempt)
+
+        if attempt > MAX_RETRIES:
+            break
+
+        # wait as long as requested by the exchange or back off exponentially with full jitter
+        delay = random.uniform(0., min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+        if response is not None and response.status_code in RATE_LIMIT_STATUS_CODES:
+            retry_after = _get_retry_after(response)
+            delay = retry_after if retry_after is not None else max(delay, BACKOFF_BASE * 2 ** attempt)
+            budget.pause(delay)
+            if delay > BACKOFF_MAX:
+                break
+        await asyncio.sleep(delay)
+
+    record_request(request.exchange, latency, 0 if response is None else len(response.content), attempt, failed=True)
+    return FetchResult(None, attempt)
+
+
+def _get_retry_after(response: Response) -> Optional[float]:
+    """ Return the number of seconds to wait according to the Retry-After header of the response (if present). """
+    retry_after = response.headers.get("Retry-After")
+    try:
+        return max(0., float(retry_after))
+    except (TypeError, ValueError):
+        return None
+
+
+def _get_session(url: str) -> requests.Session:
+    """
+    Return the pooled session for the host of the given URL. The pool is large enough to keep a connection
+    for each concurrent request, even if all exchanges share the same host (e.g. the stub server).
+    """
+    host = urlsplit(url).netloc
+    if host not in _sessions:
+        pool_size = sum(limits["concurrency"] for limits in EXCHANGE_LIMITS.values())
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _sessions[host] = session
+    return _sessions[host]
+
+
+def _get_url(url: str) -> str:
+    """ Return the given URL or the corresponding URL of the stub server if EXCHANGE_API_URL is set. """
+    base_url = os.environ.get("EXCHANGE_API_URL")
+    if not base_url:
+        return url
+    return base_url.rstrip("/") + urlsplit(url).path
@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from src.kline_store import read_klines
+from src.snapshot_cache import get_market_data
+from src.components.figures import create_chart_data
+from src.timeframes import TIMEFRAMES, DEFAULT_TIMEFRAME, WEEK, MONTH, get_look_back
+from src.utils import add_emas
+
+
+"""
+In-process LRU cache of the candlestick chart data.
+
+The candlestick charts are rendered in the browser (see assets/charts.js) from compact chart data, which covers all
+chart timeframes ("1W" and "1M") at once, such that switching between them does not send any request. The chart data
+is keyed by coin, denomination ("usd" or "btc"), kline timeframe and the version of the snapshot (i.e. the value of
+the timestamp store), so new data never hits outdated charts. The least recently used chart data is evicted once the
+encoded arrays exceed MAX_CACHE_SIZE. After each update, the chart data of Bitcoin and the top coins of both
+screeners is built in the background (see prewarm), such that most chart selections are served from the cache.
+"""
+
+MAX_CACHE_SIZE = 64 * 2**20 # in bytes of encoded chart data
+NUM_PREWARMED_COINS = 10 # number of top coins of each screener whose charts are prewarmed
+CHART_TIMEFRAMES = {"1W": WEEK, "1M": MONTH}
+
+ChartKey = Tuple[str, str, str, int]
+
+_cache = OrderedDict()
+_state = {"size": 0, "prewarmed_version": None}
+_lock = threading.Lock()
+
+
+def get_chart_data(coin: str, denomination: str, kline_timeframe: str, version: int) -> dict:
+    """ Return the chart data of the given coin and denomination from the cache or create and cache it. """
+    key = (coin, denomination, kline_timeframe, version)
+    chart_data = _get(key)
+    if chart_data is None:
+        chart_data = _create_chart_data(coin, denomination, kline_timeframe, version)
+        _put(key, chart_data)
+    return chart_data
+
+
+def prewarm(version: int) -> None:
+    """
+    Create the chart data of Bitcoin and the top coins of both screeners (default timeframe) for the given snapshot
+    version in a background thread. Nothing happens if the chart data of this or a newer version was already prewarmed.
+    """
+    with _lock:
+        if _state["prewarmed_version"] is not None and version <= _state["prewarmed_version"]:
+            return
+        _state["prewarmed_version"] = version
+    threading.Thread(target=_prewarm, args=(version,), daemon=True).start()
+
+
+def clear() -> None:
+    """ Remove all cached chart data. """
+    with _lock:
+        _cache.clear()
+        _state["size"] = 0
+
+
+def _get(key: ChartKey) -> Optional[dict]:
+    """ Return the cached chart data of the given key (None if it is not cached) and mark it as recently used. """
+    with _lock:
+        if key not in _cache:
+            return None
+        _cache.move_to_end(key)
+        return _cache[key]
+
+
+def _put(key: ChartKey, chart_data: dict) -> None:
+    """ Cache the chart data of the given key and evict the least recently used chart data if necessary. """
+    with _lock:
+        if key in _cache:
+            return
+        _cache[key] = chart_data
+        _state["size"] += _get_size(chart_data)
+        while _state["size"] > MAX_CACHE_SIZE and len(_cache) > 1:
+            _, evicted = _cache.popitem(last=False)
+            _state["size"] -= _get_size(evicted)
+
+
+def _get_size(chart_data: dict) -> int:
+    """ Return the size of the encoded arrays of the given chart data. """
+    return len(chart_data["values"]) + len(chart_data["offsets"] or "")
+
+
+def _create_chart_data(coin: str, denomination: str, kline_timeframe: str, version: int) -> dict:
+    """
+    Create the chart data of the given coin denominated in USD or BTC including the EMAs from the klines of the given
+    snapshot version.
+    """
+    interval = TIMEFRAMES[kline_timeframe]
+    look_backs = {name: get_look_back(interval, period) for name, period in CHART_TIMEFRAMES.items()}
+    klines = read_klines(coin, interval, denomination, version)
+    klines = add_emas(klines=klines, ema_lengths=[12, 21, 50])
+    klines = klines.iloc[-max(look_backs.values()):]
+    return create_chart_data(f"{coin} / {denomination.upper()}", klines, interval, look_backs)
+
+
+def _prewarm(version: int) -> None:
+    """ Create and cache the chart data of Bitcoin and the top coins of both screeners. """
+    try:
+        df = get_market_data(version, DEFAULT_TIMEFRAME).drop(["BTC"])
+        top_trend = df.sort_values(by=["trend_strength"], ascending=False).index[:NUM_PREWARMED_COINS]
+        top_pump = df.loc[df["pump_strength"] > 2].sort_values(by=["pump_strength"], ascending=False).index
+        coins = list(dict.fromkeys([*top_trend, *top_pump[:NUM_PREWARMED_COINS]]))
+
+        get_chart_data("BTC", "usd", DEFAULT_TIMEFRAME, version)
+        for coin in coins:
+            for denomination in ["usd", "btc"]:
+                get_chart_data(coin, denomination, DEFAULT_TIMEFRAME, version)
+    except Exception as e:
+        print(f"Chart prewarming error! {e}")
@@ -0,0 +1,159 @@
+import time
+import warnings
+import numpy as np
+from typing import List, Optional
+
+
+"""
+Incremental state of the indicators behind the trend and pump strengths.
+
+IndicatorState holds everything that is needed to compute the trend and pump strengths of a set of coins: the
+unnormalized EMA sums and weights of the closed klines and ring buffers with the ranges (without wicks) of the most
+recent closed klines together with their running sums. Appending a closed kline updates the state of a coin in
+constant time, independent of the length of its history. The most recent kline of each coin, which is usually still
+open, is not part of the state. It is kept as provisional kline that is only overlaid when computing the metrics and
+can therefore be replaced on every update.
+
+The EMAs are equal to close.ewm(span=length).mean() in pandas (adjust=True) and the range statistics are equal to
+nanmean and nanstd (ddof=1) up to floating point rounding. The relative differences stay below 1e-9, also after many
+appended klines.
+"""
+
+EMA_LENGTHS = [12, 21, 50]
+PUMP_LOOK_BACK = 42 # in klines
+
+
+class IndicatorState:
+    """ Vectorized indicator state of multiple coins. All rows arguments must not contain duplicates. """
+
+    def __init__(self, num_coins: int, ema_lengths: List[int] = EMA_LENGTHS, look_back: int = PUMP_LOOK_BACK):
+        self.decays = 1. - 2. / (np.array(ema_lengths, dtype=float)[:, None] + 1.)
+        self.ema_sums = np.zeros((len(ema_lengths), num_coins))
+        self.ema_weights = np.zeros((len(ema_lengths), num_coins))
+
+        # ring buffers of the signed ranges of the closed klines, position points to the oldest range of each coin
+        self.ranges = np.full((num_coins, look_back), np.nan)
+        self.position = np.zeros(num_coins, dtype=int)
+        self.range_count = np.zeros(num_coins)
+        self.range_sum = np.zeros(num_coins)
+        self.range_sq_sum = np.zeros(num_coins)
+
+        # provisional most recent kline of each coin
+        self.timestamp = np.zeros(num_coins, dtype=np.int64)
+        self.open = np.full(num_coins, np.nan)
+        self.close = np.full(num_coins, np.nan)
+
+    @classmethod
+    def from_klines(
+        cls,
+        klines: np.ndarray,
+        ema_lengths: List[int] = EMA_LENGTHS,
+        look_back: int = PUMP_LOOK_BACK,
+        ) -> "IndicatorState":
+        """
+        Create the state from right-aligned klines of shape (coin, kline) as returned by stack_klines in
+        src/kline_store.py. The last kline of each coin becomes the provisional kline.
+        """
+        state = cls(len(klines), ema_lengths, look_back)
+        if klines.shape[1] == 0:
+            return state
+
+        # closed form of the EMA recursion over all closed klines
+        closed = klines[:, :-1]
+        valid = ~np.isnan(closed["close"])
+        close = np.where(valid, closed["close"], 0.)
+        weights = state.decays ** np.arange(closed.shape[1] - 1, -1, -1)
+        state.ema_sums = (close @ weights.T).T
+        state.ema_weights = (valid @ weights.T).T
+
+        # the ring buffers start at position 0, i.e. they are ordered from the oldest to the most recent range
+        ranges = closed["close"][:, -look_back:] - closed["open"][:, -look_back:]
+        state.ranges[:, look_back - ranges.shape[1]:] = ranges
+        state.range_count = np.count_nonzero(~np.isnan(state.ranges), axis=1).astype(float)
+        state.range_sum = np.nansum(np.abs(state.ranges), axis=1)
+        state.range_sq_sum = np.nansum(state.ranges ** 2, axis=1)
+
+        state.set_provisional(np.arange(len(klines)), klines[:, -1])
+        return state
+
+    def append(self, rows: np.ndarray, klines: np.ndarray) -> None:
+        """ Append one closed kline (structured array with one kline per row) to the state of the given coins. """
+        valid = ~np.isnan(klines["close"])
+        self.ema_sums[:, rows] = self.decays * self.ema_sums[:, rows] + np.where(valid, klines["close"], 0.)
+        self.ema_weights[:, rows] = self.decays * self.ema_weights[:, rows] + valid
+
+        # replace the oldest range and update the running sums
+        position = self.position[rows]
+        evicted = self.ranges[rows, position]
+        added = klines["close"] - klines["open"]
+        self.range_count[rows] += np.isnan(evicted) * 1. - np.isnan(added)
+        self.range_sum[rows] += np.nan_to_num(np.abs(added)) - np.nan_to_num(np.abs(evicted))
+        self.range_sq_sum[rows] += np.nan_to_num(added ** 2) - np.nan_to_num(evicted ** 2)
+        self.ranges[rows, position] = added
+        self.position[rows] = (position + 1) % self.ranges.shape[1]
+
+    def set_provisional(self, rows: np.ndarray, klines: np.ndarray) -> None:
+        """ Replace the provisional klines (structured array with one kline per row) of the given coins. """
+        self.timestamp[rows] = klines["timestamp"]
+        self.open[rows] = klines["open"]
+        self.close[rows] = klines["close"]
+
+    def replace(self, rows: np.ndarray, state: "IndicatorState") -> None:
+        """ Replace the state of the given coins with the state of the coins in the given state (in the same order). """
+        self.ema_sums[:, rows] = state.ema_sums
+        self.ema_weights[:, rows] = state.ema_weights
+        for name in ["ranges", "position", "range_count", "range_sum", "range_sq_sum", "timestamp", "open", "close"]:
+            getattr(self, name)[rows] = getattr(state, name)
+
+    def get_emas(
+        self,
+        rows: Optional[np.ndarray] = None,
+        include_provisional: Optional[np.ndarray] = None,
+        ) -> np.ndarray:
+        """
+        Return the most recent EMA values of shape (EMA length, coin) for the given coins (all by default).
+        The provisional klines are included where include_provisional is True (everywhere by default).
+        """
+        rows = np.arange(len(self.close)) if rows is None else rows
+        close = self.close[rows]
+        included = ~np.isnan(close) if include_provisional is None else include_provisional & ~np.isnan(close)
+        ema_sums, ema_weights = self.ema_sums[:, rows], self.ema_weights[:, rows]
+        ema_sums = np.where(included, self.decays * ema_sums + np.where(included, close, 0.), ema_sums)
+        ema_weights = np.where(included, self.decays * ema_weights + 1., ema_weights)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return ema_sums / ema_weights
+
+    def get_trend_strengths(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Return the trend strengths of the given coins (all by default), see get_trend_strengths in src/metrics.py.
+        The provisional klines are discarded if they are less than 1 hour old.
+        """
+        rows = np.arange(len(self.close)) if rows is None else rows
+        is_recent = time.time() - self.timestamp[rows] < 3600
+        ema_12, ema_21, ema_50 = self.get_emas(rows, include_provisional=~is_recent)
+        return (ema_12 / ema_21 + ema_21 / ema_50) / 2. - 1.
+
+    def get_pump_strengths(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Return the pump strengths of the given coins (all by default), see get_pump_strengths in src/metrics.py.
+        The look-back consists of the most recent closed klines and the provisional kline.
+        """
+        rows = np.arange(len(self.close)) if rows is None else rows
+        look_back = self.ranges.shape[1]
+        chronological = self.ranges[rows[:, None], (self.position[rows, None] + np.arange(look_back)) % look_back]
+        provisional = self.close[rows] - self.open[rows]
+
+        # the look-back ends with the provisional kline, the statistics exclude its 3 most recent ranges
+        excluded = chronological[:, [0, -2, -1]]
+        count = self.range_count[rows] - np.count_nonzero(~np.isnan(excluded), axis=1)
+        range_sum = self.range_sum[rows] - np.nansum(np.abs(excluded), axis=1)
+        range_sq_sum = self.range_sq_sum[rows] - np.nansum(excluded ** 2, axis=1)
+
+        # coins with too short histories result in NaN values and therefore in a pump strength of 0
+        with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            max_range = np.nanmax(np.column_stack([chronological[:, -2:], provisional]), axis=1)
+            mean = range_sum / count
+            std = np.sqrt(np.maximum(range_sq_sum - range_sum * mean, 0.) / (count - 1))
+            std = np.where(count > 1, std, np.nan)
+            return np.where(max_range > mean + 2 * std, max_range / mean - 1., 0.)
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+
+"""
+Instrumentation of the update pipeline.
+
+While an update runs (see instrument_update), the pipeline records the wall time of its stages (e.g. fetching,
+parsing, computing the metrics and saving), the latency, payload size and number of retries of each exchange request
+and the number of coins that were dropped because their kline retrieval failed. Stages are timed with the stage()
+context manager, which is a no-op outside of updates.
+
+Updates run in different processes (background thread, long callback processes, updater of the multi-process mode),
+but never concurrently since they hold the refresh lock (see src/scheduler.py). At the end of each update, its
+recordings are added to the cumulative metrics in data/metrics.json, which are read by all processes:
+
+    - the /metrics endpoint renders them in the Prometheus text format (see render_metrics),
+    - the debug panel of the info card shows the most recent update (see src/components/info_card.py).
+"""
+
+METRICS_PATH = os.path.join("data", "metrics.json")
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.] # in seconds
+
+# recordings of the update that is currently running in this process (None outside of updates)
+_run = None
+_lock = threading.Lock()
+
+
+@contextmanager
+def instrument_update(kind: str = "refresh") -> Iterator[None]:
+    """
+    Record the stages and requests of the update in the with block and add them to the stored metrics afterwards.
+    Must be called while holding the refresh lock. The kind (e.g. "refresh" or "stream") labels the update counter.
+    """
+    global _run
+    with _lock:
+        _run = {"started": time.time(), "stages": {}, "exchanges": {}, "coins_dropped": 0}
+    try:
+        yield
+    finally:
+        with _lock:
+            run, _run = _run, None
+        run["duration"] = time.time() - run["started"]
+        try:
+            _save_metrics(_add_run(load_metrics(), run, kind))
+        except Exception as e:
+            print(f"Metrics error! {e}")
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """ Add the wall time of the with block to the given stage of the running update (if any). """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            if _run is not None:
+                _run["stages"][name] = _run["stages"].get(name, 0.) + elapsed
+
+
+def record_request(exchange: str, latency: float, num_bytes: int, attempts: int, failed: bool) -> None:
+    """ Record a request of the running update (latency in seconds of the last attempt, size of the response). """
+    with _lock:
+        if _run is None:
+            return
+        stats = _run["exchanges"].setdefault(exchange, _new_exchange_stats())
+        stats["buckets"][_get_bucket(latency)] += 1
+        stats["latency_sum"] += latency
+        stats["requests"] += 1
+        stats["bytes"] += num_bytes
+        stats["retries"] += attempts - 1
+        stats["failed"] += failed
+
+
+def record_dropped_coins(num_coins: int) -> None:
+    """ Record the number of coins that were dropped by the running update. """
+    with _lock:
+        if _run is not None:
+            _run["coins_dropped"] += num_coins
+
+
+def load_metrics() -> dict:
+    """ Return the stored cumulative metrics (empty metrics if there are none yet). """
+    try:
+        with open(METRICS_PATH, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"updates": {}, "stages": {}, "exchanges": {}, "coins_dropped": 0, "last_update": None}
+
+
+def render_metrics(metrics: Optional[dict] = None) -> str:
+    """ Return the stored metrics in the Prometheus text exposition format. """
+    metrics = load_metrics() if metrics is None else metrics
+    lines = []
+
+    def add(name: str, kind: str, description: str, samples: List[tuple]) -> None:
+        lines.extend([f"# HELP {name} {description}", f"# TYPE {name} {kind}"])
+        for suffix, labels, value in samples:
+            label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+            lines.append(f"{name}{suffix}{{{label_text}}} {value}" if label_text else f"{name}{suffix} {value}")
+
+    add("dashboard_updates_total", "counter", "Number of published updates.", [
+        ("", {"kind": kind}, count) for kind, count in metrics["updates"].items()
+    ])
+    last_update = metrics["last_update"]
+    if last_update is not None:
+        add("dashboard_last_update_timestamp_seconds", "gauge", "Start of the most recent update.", [
+            ("", {}, last_update["started"]),
+        ])
+        add("dashboard_last_update_duration_seconds", "gauge", "Wall time of the most recent update.", [
+            ("", {}, last_update["duration"]),
+        ])
+        add("dashboard_last_update_stage_seconds", "gauge", "Wall time of each stage of the most recent update.", [
+            ("", {"stage": name}, seconds) for name, seconds in last_update["stages"].items()
+        ])
+        add("dashboard_last_update_coins_dropped", "gauge", "Coins dropped by the most recent update.", [
+            ("", {}, last_update["coins_dropped"]),
+        ])
+    add("dashboard_stage_seconds", "summary", "Wall time of the update stages.", [
+        sample for name, stats in metrics["stages"].items()
+        for sample in [("_sum", {"stage": name}, stats["sum"]), ("_count", {"stage": name}, stats["count"])]
+    ])
+
+    exchanges = metrics["exchanges"]
+    bounds = [f"{bound:g}" for bound in LATENCY_BUCKETS] + ["+Inf"]
+    add("dashboard_exchange_request_seconds", "histogram", "Latency of the exchange requests.", [
+        sample for exchange, stats in exchanges.items()
+        for sample in [
+            ("_bucket", {"exchange": exchange, "le": bound}, count)
+            for bound, count in zip(bounds, _cumulative(stats["buckets"]))
+        ] + [
+            ("_sum", {"exchange": exchange}, stats["latency_sum"]),
+            ("_count", {"exchange": exchange}, stats["requests"]),
+        ]
+    ])
+    for key, name, description in [
+        ("bytes", "dashboard_exchange_response_bytes_total", "Payload bytes of the exchange responses."),
+        ("retries", "dashboard_exchange_retries_total", "Retried exchange requests (one per additional attempt)."),
+        ("failed", "dashboard_exchange_failed_requests_total", "Exchange requests that failed in all attempts."),
+    ]:
+        add(name, "counter", description, [
+            ("", {"exchange": exchange}, stats[key]) for exchange, stats in exchanges.items()
+        ])
+    add("dashboard_coins_dropped_total", "counter", "Coins dropped because their kline retrieval failed.", [
+        ("", {}, metrics["coins_dropped"]),
+    ])
+    return "\n".join(lines) + "\n"
+
+
+def _add_run(metrics: dict, run: dict, kind: str) -> dict:
+    """ Add the recordings of an update to the cumulative metrics. """
+    metrics["updates"][kind] = metrics["updates"].get(kind, 0) + 1
+    for name, seconds in run["stages"].items():
+        stats = metrics["stages"].setdefault(name, {"sum": 0., "count": 0})
+        stats["sum"] += seconds
+        stats["count"] += 1
+    for exchange, run_stats in run["exchanges"].items():
+        stats = metrics["exchanges"].setdefault(exchange, _new_exchange_stats())
+        stats["buckets"] = [a + b for a, b in zip(stats["buckets"], run_stats["buckets"])]
+        for key in ["latency_sum", "requests", "bytes", "retries", "failed"]:
+            stats[key] += run_stats[key]
+    metrics["coins_dropped"] += run["coins_dropped"]
+    metrics["last_update"] = {"kind": kind, **run}
+    return metrics
+
+
+def _save_metrics(metrics: dict) -> None:
+    """ Atomically replace the stored metrics. """
+    with open(METRICS_PATH + ".tmp", "w") as f:
+        json.dump(metrics, f)
+    os.replace(METRICS_PATH + ".tmp", METRICS_PATH)
+
+
+def _new_exchange_stats() -> dict:
+    """ Return empty request statistics of an exchange. """
+    return {
+        "buckets": [0] * (len(LATENCY_BUCKETS) + 1), "latency_sum": 0., "requests": 0, "bytes": 0, "retries": 0,
+        "failed": 0,
+    }
+
+
+def _get_bucket(latency: float) -> int:
+    """ Return the index of the histogram bucket of the given latency (the last bucket is unbounded). """
+    return next((i for i, bound in enumerate(LATENCY_BUCKETS) if latency <= bound), len(LATENCY_BUCKETS))
+
+
+def _cumulative(counts: List[int]) -> List[int]:
+    """ Return the cumulative bucket counts of the Prometheus histogram format. """
+    return [sum(counts[:i + 1]) for i in range(len(counts))]
@@ -0,0 +1,339 @@
+import os
+import time
+import threading
+import numpy as np
+import pandas as pd
+from typing import Collection, Dict, List, Optional, Tuple
+
+from src.snapshot_store import NUM_KLINE_GENERATIONS, get_generation_dir, get_staging_dir
+from src.timeframes import resample_klines
+
+
+"""
+Persistent local store for kline data.
+
+The klines are part of the generations of the stored data (see src/snapshot_store.py), i.e. the files below are
+located in the directory of a generation, e.g. data/snapshots/{version}. They are written into the staging directory
+of a new generation and never modified afterwards, generations with unchanged klines hard-link the files of the
+previous generation instead (see link_klines). Reads use the most recent generation by default.
+
+The klines of all coins are saved in a single binary file klines.npy. It contains a structured array of shape
+(coin, kline) with an int64 timestamp and float64 OHLC fields. The klines of each coin are right-aligned,
+i.e. the most recent kline of every coin is in the last column, and shorter histories are padded with zero
+timestamps and NaN prices at the beginning.
+
+The index file index.csv contains one row per coin (in the same order as the array) and records the
+exchange, symbol and interval of the stored klines, the number of stored klines, the timestamp of the last
+closed kline and whether the kline history is complete. Stored klines are only reused if the exchange, symbol and
+interval of a coin still match the index. The klines of incomplete histories (an older page could not be fetched, see
+get_klines in src/exchange_data.py) are fetched again by the next update.
+
+The klines of all coins denominated in BTC (see get_btc_denominated_klines) are computed in one pass whenever the
+klines are saved and stored in klines_btc.npy with the same layout.
+
+Other directories with the same files can hold longer kline histories, e.g. the history written by backfill_klines.py
+for backtests (see src/backtest.py).
+"""
+
+KLINES_FILE = "klines.npy"
+BTC_KLINES_FILE = "klines_btc.npy"
+INDEX_FILE = "index.csv"
+
+FIELDS = ["open", "high", "low", "close"]
+KLINE_DTYPE = np.dtype([("timestamp", np.int64)] + [(field, np.float64) for field in FIELDS])
+
+# (directory, memory-mapped klines by denomination, index) of the most recently opened generation directories, the
+# tuple is only replaced as a whole (under the lock) such that readers never see a partially updated cache
+_mmap_lock = threading.Lock()
+_mmap_cache: Tuple[Tuple[str, Dict[str, np.ndarray], pd.DataFrame], ...] = ()
+
+
+def load_klines(
+    info_df: pd.DataFrame,
+    interval: int,
+    num_klines: Optional[int] = None,
+    ) -> Tuple[Dict[str, pd.DataFrame], Dict[str, int]]:
+    """
+    Load the stored klines for all the coins in info_df.
+
+    Args:
+        info_df
+            Data frame with information about the coins.
+        interval
+            Kline interval in minutes.
+        num_klines
+            Optional length of the kline histories. If the store holds shorter histories (i.e. it was written with
+            a shorter history length), no stored klines are returned such that the full histories are fetched again.
+
+    Returns:
+        Dictionary containing the stored klines for each coin and dictionary containing the timestamp (in seconds)
+        of the last closed kline for each coin. Coins without valid stored klines are missing in both dictionaries,
+        coins with incomplete kline histories are only missing in the second dictionary such that their full
+        histories are fetched again.
+    """
+    klines, index_df = _open_store()
+    if klines is None or (num_klines is not None and klines.shape[1] < num_klines):
+        return {}, {}
+
+    kline_dict, last_closed = {}, {}
+    for name in info_df.index.intersection(index_df.index):
+        entry = index_df.loc[name]
+        if (
+            entry["exchange"] != info_df.loc[name, "exchange"]
+            or entry["symbol"] != info_df.loc[name, "symbol"]
+            or entry["interval"] != interval
+        ):
+            continue
+
+        kline_dict[name] = _to_data_frame(klines, int(entry["row"]), int(entry["num_klines"]))
+        if entry.get("complete", True):
+            last_closed[name] = int(entry["last_closed"])
+
+    return kline_dict, last_closed
+
+
+def read_klines(
+    name: str,
+    interval: Optional[int] = None,
+    denomination: str = "usd",
+    version: Optional[int] = None,
+    ) -> pd.DataFrame:
+    """
+    Return the stored klines of the given coin denominated in USD or BTC ("usd" or "btc") as a data frame indexed by
+    the timestamps. If an interval (in minutes) is given, the stored klines are resampled into klines with this
+    interval. Klines without BTC price are omitted. The klines are read from the generation with the given version if
+    its klines are still retained and from the most recent generation otherwise. The store files are memory-mapped
+    once per generation.
+    """
+    klines, index_df = _open_store(denomination, version)
+    if klines is None or name not in index_df.index:
+        raise KeyError(f"No stored klines for {name}")
+
+    entry = index_df.loc[name]
+    row, num_klines = int(entry["row"]), int(entry["num_klines"])
+    if interval is not None and interval != entry["interval"]:
+        klines = resample_klines(klines[row:row + 1], int(entry["interval"]), interval)
+        row, num_klines = 0, np.count_nonzero(~np.isnan(klines["close"]))
+
+    return _to_data_frame(klines, row, num_klines).set_index("timestamp").dropna()
+
+
+def save_klines(
+    info_df: pd.DataFrame,
+    kline_dict: Dict[str, pd.DataFrame],
+    interval: int,
+    version: int,
+    incomplete: Collection[str] = (),
+    ) -> None:
+    """
+    Save the klines of all the coins in info_df with a single write and the corresponding index file into the
+    staging directory of the given generation. Every coin in info_df needs an entry in kline_dict. The kline histories
+    of the given coins are marked as incomplete.
+    """
+    names = list(info_df.index)
+    num_klines = max([len(kline_dict[name]) for name in names], default=0)
+    save_stacked_klines(info_df.loc[names], stack_klines(kline_dict, names, num_klines), interval, version, incomplete)
+
+
+def save_stacked_klines(
+    info_df: pd.DataFrame,
+    klines: np.ndarray,
+    interval: int,
+    version: int,
+    incomplete: Collection[str] = (),
+    ) -> None:
+    """
+    Save right-aligned klines of shape (coin, kline) as returned by stack_klines and the corresponding index file into
+    the staging directory of the given generation. The rows of the klines belong to the coins in info_df (in the same
+    order). The kline histories of the given coins are marked as incomplete.
+    """
+    write_stacked_klines(get_staging_dir(version), info_df, klines, interval, incomplete)
+
+
+def link_klines(version: int, source_version: int) -> bool:
+    """
+    Hard-link the store files of the given published generation into the staging directory of the given generation
+    instead of writing the same klines again. Returns False (without leaving any linked file behind) if the klines of
+    the source generation are no longer retained or hard links are not supported.
+    """
+    source_dir = get_generation_dir(source_version)
+    staging_dir = get_staging_dir(version)
+    linked = []
+    try:
+        for file_name in [KLINES_FILE, BTC_KLINES_FILE, INDEX_FILE]:
+            os.link(os.path.join(source_dir, file_name), os.path.join(staging_dir, file_name))
+            linked.append(file_name)
+    except OSError:
+        # the store files must never be written through a link into a published generation
+        for file_name in linked:
+            os.remove(os.path.join(staging_dir, file_name))
+        return False
+    return True
+
+
+def write_stacked_klines(
+    directory: str,
+    info_df: pd.DataFrame,
+    klines: np.ndarray,
+    interval: int,
+    incomplete: Collection[str] = (),
+    ) -> None:
+    """
+    Write the store files of right-aligned klines of shape (coin, kline) of the coins in info_df into the given
+    directory, e.g. a generation or a separate store with a long kline history (see backfill_klines.py). The kline
+    histories of the given coins are marked as incomplete.
+    """
+    timestamps = klines["timestamp"]
+    is_closed = (timestamps > 0) & (timestamps + interval * 60 <= time.time())
+    index_df = pd.DataFrame(
+        index=pd.Index(info_df.index, name="name"),
+        data={
+            "exchange": info_df["exchange"],
+            "symbol": info_df["symbol"],
+            "interval": interval,
+            "num_klines": np.count_nonzero(timestamps > 0, axis=1),
+            "last_closed": np.max(np.where(is_closed, timestamps, 0), axis=1, initial=0),
+            "complete": ~info_df.index.isin(list(incomplete)),
+        },
+    )
+
+    btc_klines = klines[info_df.index.get_loc("BTC")] if "BTC" in info_df.index else None
+
+    np.save(os.path.join(directory, KLINES_FILE), klines)
+    np.save(os.path.join(directory, BTC_KLINES_FILE), get_btc_denominated_klines(klines, btc_klines))
+    index_df.to_csv(os.path.join(directory, INDEX_FILE), index_label="name")
+
+
+def stack_klines(
+    kline_dict: Dict[str, pd.DataFrame],
+    names: List[str],
+    num_klines: int,
+    ) -> np.ndarray:
+    """
+    Stack the most recent num_klines klines of the given coins into a right-aligned structured array of shape
+    (coin, kline). Missing klines at the beginning are padded with zero timestamps and NaN prices.
+    """
+    klines = np.zeros((len(names), num_klines), dtype=KLINE_DTYPE)
+    for field in FIELDS:
+        klines[field] = np.nan
+
+    for i, name in enumerate(names):
+        coin_klines = kline_dict[name].iloc[-num_klines:] if num_klines > 0 else kline_dict[name].iloc[:0]
+        n = len(coin_klines)
+        if n == 0:
+            continue
+        klines["timestamp"][i, -n:] = coin_klines["timestamp"].values
+        for field in FIELDS:
+            klines[field][i, -n:] = coin_klines[field].values
+
+    return klines
+
+
+def get_btc_denominated_klines(klines: np.ndarray, btc_klines: Optional[np.ndarray]) -> np.ndarray:
+    """
+    Return the klines of shape (coin, kline) denominated in BTC given the klines of Bitcoin (one row of the same
+    layout, None if Bitcoin is missing). The klines are matched with the Bitcoin klines by their timestamps and klines
+    without matching Bitcoin kline get NaN prices.
+
+    The open and close prices are exact ratios (open / BTC open and close / BTC close). Since the price paths within
+    the klines are unknown, high and low are the bounds of the ratio within the kline (high / BTC low and low / BTC
+    high), i.e. every price of the BTC pair within the kline is between them and the candle bodies are always within
+    the wicks. The gains of the BTC pairs from the lowest lows (gain_btc_* in src/market_data.py) are therefore upper
+    bounds of the actual gains.
+    """
+    result = np.zeros(klines.shape, dtype=klines.dtype)
+    result["timestamp"] = klines["timestamp"]
+    for field in FIELDS:
+        result[field] = np.nan
+    if btc_klines is None:
+        return result
+
+    btc_klines = btc_klines[btc_klines["timestamp"] > 0]
+    if len(btc_klines) == 0:
+        return result
+    positions = np.minimum(np.searchsorted(btc_klines["timestamp"], klines["timestamp"]), len(btc_klines) - 1)
+    matched = btc_klines[positions]
+    is_matched = (klines["timestamp"] > 0) & (matched["timestamp"] == klines["timestamp"])
+
+    open_price = klines["open"] / matched["open"]
+    close_price = klines["close"] / matched["close"]
+    high = klines["high"] / matched["low"]
+    low = klines["low"] / matched["high"]
+    for field, values in [("open", open_price), ("high", high), ("low", low), ("close", close_price)]:
+        result[field] = np.where(is_matched, values, np.nan)
+    return result
+
+
+def merge_klines(
+    stored_klines: Optional[pd.DataFrame],
+    new_klines: pd.DataFrame,
+    interval: int,
+    num_klines: int,
+    ) -> pd.DataFrame:
+    """
+    Merge newly fetched klines into the stored klines and return the most recent num_klines klines.
+    Stored klines with the same timestamps as new klines (e.g. the previously open kline) are replaced.
+    The stored klines are discarded if there would be a gap between them and the new klines.
+    """
+    if stored_klines is None or len(stored_klines) == 0 or len(new_klines) == 0:
+        return new_klines.iloc[-num_klines:].reset_index(drop=True)
+
+    if new_klines["timestamp"].iloc[0] > stored_klines["timestamp"].iloc[-1] + interval * 60:
+        return new_klines.iloc[-num_klines:].reset_index(drop=True)
+
+    stored_klines = stored_klines[stored_klines["timestamp"] < new_klines["timestamp"].iloc[0]]
+    klines = pd.concat([stored_klines, new_klines], ignore_index=True)
+    return klines.iloc[-num_klines:].reset_index(drop=True)
+
+
+def _open_store(
+    denomination: str = "usd",
+    version: Optional[int] = None,
+    ) -> Tuple[Optional[np.ndarray], Optional[pd.DataFrame]]:
+    """
+    Return the memory-mapped kline array of the given denomination ("usd" or "btc") and the index of the given
+    generation (the most recent one by default or if the klines of the generation are no longer retained). Both are
+    cached for the NUM_KLINE_GENERATIONS most recently opened generations.
+    """
+    global _mmap_cache
+    directory = get_generation_dir(version)
+    if version is not None and not os.path.exists(os.path.join(directory, KLINES_FILE)):
+        directory = get_generation_dir()
+    if directory is None or not os.path.exists(os.path.join(directory, KLINES_FILE)):
+        return None, None
+
+    entry = _get_cached_store(directory)
+    if entry is None:
+        with _mmap_lock:
+            entry = _get_cached_store(directory)
+            if entry is None:
+                entry = _load_store(directory)
+                _mmap_cache = (entry,) + _mmap_cache[:NUM_KLINE_GENERATIONS - 1]
+
+    _, klines, index_df = entry
+    return klines[denomination], index_df
+
+
+def _get_cached_store(directory: str) -> Optional[Tuple[str, Dict[str, np.ndarray], pd.DataFrame]]:
+    """ Return the cached store of the given generation directory (None if it is not cached). """
+    for entry in _mmap_cache:
+        if entry[0] == directory:
+            return entry
+    return None
+
+
+def _load_store(directory: str) -> Tuple[str, Dict[str, np.ndarray], pd.DataFrame]:
+    """ Memory-map the kline arrays and read the index of the given generation directory. """
+    index_df = pd.read_csv(os.path.join(directory, INDEX_FILE), index_col="name")
+    index_df["row"] = np.arange(len(index_df))
+    klines = {
+        "usd": np.load(os.path.join(directory, KLINES_FILE), mmap_mode="r"),
+        "btc": np.load(os.path.join(directory, BTC_KLINES_FILE), mmap_mode="r"),
+    }
+    return directory, klines, index_df
+
+
+def _to_data_frame(klines: np.ndarray, row: int, num_klines: int) -> pd.DataFrame:
+    """ Return the most recent num_klines klines of the given row as a data frame without padding. """
+    coin_klines = klines[row, klines.shape[1] - num_klines:]
+    return pd.DataFrame(data={field: coin_klines[field] for field in KLINE_DTYPE.names})
@@ -11,7 +11,12 @@ from src.components.table_cards import trend_card, pump_card
 layout = html.Div(
     [
         dcc.Store(id="timestamp", data=0), # timestamp of most recent update
+        dcc.Store(id="refresh_version", data=0), # version returned by the most recent refresh of this client
+        dcc.Interval(id="version_interval", interval=10 * 1000), # poll for snapshots of other refreshes
         dcc.Store(id="altcoin", data=""), # which altcoin is currently selected
+        dcc.Store(id="chart_style"), # layout and styles of the candlestick charts (see assets/charts.js)
+        dcc.Store(id="bitcoin_chart_data"), # compact chart data of Bitcoin
+        dcc.Store(id="altcoin_chart_data"), # compact chart data of the selected altcoin in USD and BTC
         dbc.Container(
             [
                 dbc.Row(dbc.Col(info_card, width=12)),
@@ -1,47 +1,133 @@
 import os
-import time
 import numpy as np
 import pandas as pd
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 from src.exchange_data import get_klines
-from src.utils import get_emas
+from src.instrumentation import stage, record_dropped_coins
+from src.kline_store import load_klines, save_klines, merge_klines, stack_klines, get_btc_denominated_klines
+from src.metrics import get_gains, get_trend_strengths, get_pump_strengths
+from src.shared_snapshot import write_shared_snapshot
+from src.snapshot_cache import invalidate
+from src.snapshot_store import get_staging_dir
+from src.timeframes import (
+    BASE_INTERVAL, NUM_BASE_KLINES, TIMEFRAMES, DAY, WEEK, MONTH, get_look_back, resample_klines,
+)
+
+# look-back periods of the gains by column name
+GAIN_PERIODS = {"gain_1d": DAY, "gain_1w": WEEK, "gain_1m": MONTH}
+BTC_GAIN_PERIODS = {"gain_btc_1d": DAY, "gain_btc_1w": WEEK, "gain_btc_1m": MONTH}
+
+
+def update_market_data(version: int) -> None:
+    """
+    Update and save all market data values using the latest exchange data.
+    Only klines of the base interval are fetched. The market data of each timeframe is computed from resampled klines
+    and saved together with the klines as the given version of the stored data (see src/snapshot_store.py), which is
+    published by the caller.
+    """
+    # fetch latest kline data (only the klines after the last stored closed klines)
+    config_df = pd.read_csv(os.path.join("data", "config.csv"), index_col="name")
+    with stage("load_klines"):
+        stored_kline_dict, last_closed = load_klines(config_df, interval=BASE_INTERVAL, num_klines=NUM_BASE_KLINES)
+    new_kline_dict, status_dict, incomplete = get_klines(
+        config_df, interval=BASE_INTERVAL, num_klines=NUM_BASE_KLINES, since=last_closed,
+    )
+    with stage("merge_klines"):
+        kline_dict = {
+            name: merge_klines(stored_kline_dict.get(name), new_kline_dict[name], BASE_INTERVAL, NUM_BASE_KLINES)
+            for name in new_kline_dict
+        }
+
+        # discard coins/tokens for which errors occured during the kline retrieval
+        record_dropped_coins(len(config_df) - len(kline_dict))
+        df = config_df.loc[[name for name in config_df.index if name in kline_dict]]
+
+        # stack klines of all coins into one aligned (coin, kline) array
+        base_klines = stack_klines(kline_dict, names=list(df.index), num_klines=NUM_BASE_KLINES)
+
+    # save updated data and the outcome of the kline retrieval for each coin, the stored klines of discarded coins are
+    # carried forward such that only their missing klines are fetched by the next update (all their klines if their
+    # stored history is incomplete, i.e. it has no last closed kline)
+    with stage("save_klines"):
+        stored_df = config_df.loc[[name for name in config_df.index if name in kline_dict or name in stored_kline_dict]]
+        incomplete += [name for name in stored_kline_dict if name not in kline_dict and name not in last_closed]
+        save_klines(
+            stored_df, {**stored_kline_dict, **kline_dict}, interval=BASE_INTERVAL, version=version,
+            incomplete=incomplete,
+        )
+    with stage("metrics"):
+        market_data = compute_market_data(df, base_klines)
+    with stage("save_market_data"):
+        save_market_data(market_data, pd.Series(status_dict, name="status"), version)
+
+
+def compute_market_data(df: pd.DataFrame, base_klines: np.ndarray) -> Dict[str, pd.DataFrame]:
+    """
+    Compute the market data of all timeframes for the coins in df given their right-aligned base klines of shape
+    (coin, kline) (in the same order). Returns a dictionary containing a copy of df with the market data values
+    for each timeframe.
+    """
+    btc_base_klines = get_btc_denominated_klines(
+        base_klines, base_klines[df.index.get_loc("BTC")] if "BTC" in df.index else None,
+    )
+    return {
+        timeframe: _get_market_data(
+            df.copy(),
+            resample_klines(base_klines, BASE_INTERVAL, interval),
+            resample_klines(btc_base_klines, BASE_INTERVAL, interval),
+            interval,
+        )
+        for timeframe, interval in TIMEFRAMES.items()
+    }
+
+
+def save_market_data(market_data: Dict[str, pd.DataFrame], kline_status: Optional[pd.Series], version: int) -> None:
+    """ Save the market data of each timeframe and the kline status as shared snapshot of the given version. """
+    write_shared_snapshot(get_staging_dir(version), version, market_data, kline_status)
+
+    # make sure that cached snapshots of this process are reloaded
+    invalidate()
 
 
-def update_market_data() -> None:
+def add_btc_pair_metrics(df: pd.DataFrame, btc_klines: np.ndarray, interval: int) -> pd.DataFrame:
     """
-    Update and save all market data values using the latest exchange data.
+    Compute the gains and trend strengths of the BTC pairs given the klines denominated in BTC with the given interval
+    (in minutes) and add them to the data frame. These metrics measure the outperformance over Bitcoin.
     """
-    # fetch latest kline data
-    df = pd.read_csv(os.path.join("data", "config.csv"), index_col="name")
-    kline_dict = get_klines(df, interval=240, num_klines=200)
+    df = _add_gains(
+        df=df, klines=btc_klines, look_back=[get_look_back(interval, period) for period in BTC_GAIN_PERIODS.values()],
+        col_names=list(BTC_GAIN_PERIODS),
+    )
+    return _add_trend_strengths(df, btc_klines, col_name="trend_strength_btc")
 
-    # discard coins/tokens for which errors occured during the kline retrieval
-    df = df.loc[kline_dict.keys()]
 
+def _get_market_data(df: pd.DataFrame, klines: np.ndarray, btc_klines: np.ndarray, interval: int) -> pd.DataFrame:
+    """
+    Compute all market data values given the klines in USD and BTC with the given interval (in minutes) and add them
+    to the data frame. Gains are computed over fixed periods, the trend and pump strengths over numbers of klines.
+    """
     # compute gains from lowest lows within last 1D, 1W and 1M
     df = _add_gains(
-        df=df, kline_dict=kline_dict, look_back=[6, 42, 186],
-        col_names=["gain_1d", "gain_1w", "gain_1m"],
+        df=df, klines=klines, look_back=[get_look_back(interval, period) for period in GAIN_PERIODS.values()],
+        col_names=list(GAIN_PERIODS),
     )
 
     # compute strength of current uptrends
-    df = _add_trend_strengths(df, kline_dict)
+    df = _add_trend_strengths(df, klines)
 
     # compute strength of current pumps
-    df = _add_pump_strengths(df, kline_dict)
+    df = _add_pump_strengths(df, klines)
 
-    # save updated data
-    if not os.path.exists(os.path.join("data", "klines")):
-        os.makedirs(os.path.join("data", "klines"))
-    df.to_csv(os.path.join("data", "market_data.csv"), index_label="name")
-    for name in kline_dict:
-        kline_dict[name].to_csv(os.path.join("data", "klines", f"{name}.csv"), index=False)
+    # compute gains and strength of current uptrends of the BTC pairs
+    df = add_btc_pair_metrics(df, btc_klines, interval)
+
+    return df
 
 
 def _add_gains(
     df: pd.DataFrame, 
-    kline_dict: Dict[str, pd.DataFrame],
+    klines: np.ndarray,
     look_back: List[int],
     col_names: List[str],
     ) -> pd.DataFrame:
@@ -50,69 +136,26 @@ def _add_gains(
     Each look-back value thereby defines the number of most recent klines from which the corresponding gain
     will be computed.
     """
-    gains = [[] for _ in look_back]
-    for name in df.index:
-        lows = [kline_dict[name]["low"].iloc[-offset:].min() for offset in look_back]
-        current_price = kline_dict[name]["close"].iloc[-1]
-        for i in range(len(look_back)):
-            gains[i].append(current_price / lows[i] - 1.)
-
+    gains = get_gains(klines, look_back)
     for i in range(len(look_back)):
         df[col_names[i]] = gains[i]
     
     return df
 
 
-def _add_trend_strengths(
-    df: pd.DataFrame,
-    kline_dict: Dict[str, pd.DataFrame],
-    ) -> pd.DataFrame:
+def _add_trend_strengths(df: pd.DataFrame, klines: np.ndarray, col_name: str = "trend_strength") -> pd.DataFrame:
     """
-    Compute the strength of the current uptrends. For that, EMAs with lengths 12, 21 and 50 are computed
-    and compared with each other. The most recent klines will be discarded for the computation if they 
-    are less than 1 hour old.
+    Compute the strength of the current uptrends and add them to the data frame.
+    See get_trend_strengths in src/metrics.py for details.
     """
-    strengths = []
-    for name in df.index:
-        klines = kline_dict[name]
-
-        # discard last kline if it is less than 1 hour old
-        if time.time() - klines["timestamp"].iloc[-1] < 3600:
-            klines = klines.iloc[:-1]
-
-        # compute strength of uptrend using EMA values
-        ema_12, ema_21, ema_50 = get_emas(close=klines["close"], ema_lengths=[12, 21, 50])
-        scores = np.array([
-            ema_12.iloc[-1] / ema_21.iloc[-1],
-            ema_21.iloc[-1] / ema_50.iloc[-1],
-        ])
-        strengths.append(scores.mean() - 1.)
-
-    df["trend_strength"] = strengths
+    df[col_name] = get_trend_strengths(klines)
     return df
 
 
-def _add_pump_strengths(
-    df: pd.DataFrame,
-    kline_dict: Dict[str, pd.DataFrame],
-    look_back: int = 42,
-    ) -> pd.DataFrame:
+def _add_pump_strengths(df: pd.DataFrame, klines: np.ndarray, look_back: int = 42) -> pd.DataFrame:
     """
-    Compute the strength of the current pumps. For that, the largest kline range (without wicks) of the 
-    last 3 klines is compared with the mean and std of the absolute kline ranges within the last week.
+    Compute the strength of the current pumps and add them to the data frame.
+    See get_pump_strengths in src/metrics.py for details.
     """
-    strengths = []
-    for name in df.index:
-        klines = kline_dict[name].iloc[-look_back:]
-        ranges = (klines["close"] - klines["open"])
-        max_range = ranges.iloc[-3:].max()
-        mean = ranges.iloc[:-3].abs().mean()
-        std = ranges.iloc[:-3].abs().std()
-
-        if max_range > mean + 2 * std:
-            strengths.append(max_range / mean - 1.)
-        else:
-            strengths.append(0.)
-
-    df["pump_strength"] = strengths
+    df["pump_strength"] = get_pump_strengths(klines, look_back)
     return df
@@ -0,0 +1,45 @@
+import numpy as np
+from typing import List
+
+from src.indicators import IndicatorState
+
+
+"""
+Vectorized computation of the dashboard metrics for all coins at once.
+
+All functions operate on right-aligned kline arrays of shape (coin, kline) as returned by stack_klines in
+src/kline_store.py, i.e. the most recent kline of every coin is in the last column and shorter histories are
+padded with NaN prices at the beginning. The results are identical to computing the metrics with pandas for
+each coin separately. The trend and pump strengths are computed from the incremental indicator state in
+src/indicators.py, which can be updated in constant time when new klines arrive.
+"""
+
+
+def get_gains(klines: np.ndarray, look_back: List[int]) -> List[np.ndarray]:
+    """
+    Return the percentage gains from the lowest lows within the given number of most recent klines
+    to the current close for each look-back value.
+    """
+    current_price = klines["close"][:, -1]
+    return [
+        current_price / np.nanmin(klines["low"][:, -offset:], axis=1) - 1.
+        for offset in look_back
+    ]
+
+
+def get_trend_strengths(klines: np.ndarray) -> np.ndarray:
+    """
+    Return the strength of the current uptrends. For that, EMAs with lengths 12, 21 and 50 are computed
+    and compared with each other. The most recent klines will be discarded for the computation if they
+    are less than 1 hour old.
+    """
+    return IndicatorState.from_klines(klines).get_trend_strengths()
+
+
+def get_pump_strengths(klines: np.ndarray, look_back: int = 42) -> np.ndarray:
+    """
+    Return the strength of the current pumps. For that, the largest kline range (without wicks) of the
+    last 3 klines is compared with the mean and std of the absolute kline ranges within the look-back
+    (by default 42 klines, i.e. one week of 4h klines).
+    """
+    return IndicatorState.from_klines(klines, look_back=look_back).get_pump_strengths()
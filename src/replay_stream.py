@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import websockets
+import pandas as pd
+from urllib.parse import urlsplit
+from typing import Dict, List, Tuple
+
+from src.exchange_data import INTERVALS
+from src.stub_exchange import get_klines
+from src.streaming import STREAM_URLS, get_subscribe_messages, parse_message
+
+
+"""
+Local replay server for the kline WebSocket streams of Binance, Bybit and Gate.io.
+
+Recordings are JSON lines files containing one stream message per line together with its exchange and the delay
+(in seconds) since the previous message. They are either recorded from the exchanges or synthesized from the
+deterministic klines of the stub exchange (see src/stub_exchange.py), which makes it possible to run the streaming
+mode completely offline:
+
+    python -m src.replay_stream synthesize --output stream.jsonl --exchange binance
+    python -m src.replay_stream serve --recording stream.jsonl --port 8765
+    python -m src.stub_exchange --port 8000
+    EXCHANGE_API_URL=http://127.0.0.1:8000 EXCHANGE_STREAM_URL=ws://127.0.0.1:8765 python app.py --streaming
+
+The server plays the messages of an exchange back to every client that connects to the URL path of the exchange,
+starting after the first (subscription) message of the client. Subscriptions are not filtered, i.e. every client
+receives all recorded messages of its exchange.
+"""
+
+# exchanges by the URL paths of their streams
+EXCHANGE_PATHS = {urlsplit(url).path: exchange for exchange, url in STREAM_URLS.items()}
+
+Recording = Dict[str, List[Tuple[float, str]]]
+
+
+def load_recording(path: str) -> Recording:
+    """ Return the delays and messages of the given recording for each exchange. """
+    recording = {exchange: [] for exchange in STREAM_URLS}
+    with open(path, "r") as f:
+        for line in f:
+            entry = json.loads(line)
+            recording[entry["exchange"]].append((entry["delay"], entry["message"]))
+    return recording
+
+
+def synthesize_recording(
+    exchange: str,
+    symbols: List[str],
+    interval: int,
+    num_klines: int,
+    num_updates: int,
+    delay: float,
+    ) -> List[Tuple[str, float, str]]:
+    """
+    Return synthetic stream messages (exchange, delay, message) of the given symbols. The messages start with the
+    currently open kline and cover num_klines klines with the given interval (in minutes). Each kline is sent
+    num_updates times with a growing price range, the last time as closed kline. All symbols are updated at once,
+    i.e. the delay only applies to the first message of each round.
+    """
+    start = int(time.time()) // (interval * 60) * interval * 60
+    end = start + (num_klines - 1) * interval * 60
+    kline_dict = {symbol: get_klines(symbol, interval * 60, end, num_klines) for symbol in symbols}
+
+    messages = []
+    for i in range(num_klines):
+        for update in range(1, num_updates + 1):
+            progress = update / num_updates
+            for j, symbol in enumerate(symbols):
+                timestamp, open_price, high, low, close = kline_dict[symbol][i]
+                close = open_price + (close - open_price) * progress
+                kline = (
+                    timestamp, open_price, max(open_price, close, open_price + (high - open_price) * progress),
+                    min(open_price, close, open_price + (low - open_price) * progress), close,
+                )
+                message = format_message(exchange, symbol, kline, interval, closed=update == num_updates)
+                messages.append((exchange, delay if j == 0 else 0., message))
+    return messages
+
+
+def format_message(
+    exchange: str,
+    symbol: str,
+    kline: Tuple[int, float, float, float, float],
+    interval: int,
+    closed: bool,
+    ) -> str:
+    """ Return a kline update (timestamp in seconds, open, high, low, close) in the stream format of the exchange. """
+    t, o, h, l, c = kline
+    now = int(time.time() * 1000)
+    name = INTERVALS[exchange][interval]
+    if exchange == "binance":
+        data = {"stream": f"{symbol.lower()}@kline_{name}", "data": {"e": "kline", "E": now, "s": symbol, "k": {
+            "t": t * 1000, "T": (t + interval * 60) * 1000 - 1, "s": symbol, "i": name, "o": f"{o:.8f}",
+            "c": f"{c:.8f}", "h": f"{h:.8f}", "l": f"{l:.8f}", "v": "1000.0", "n": 100, "x": closed,
+        }}}
+    elif exchange == "bybit":
+        data = {"topic": f"kline.{name}.{symbol}", "type": "snapshot", "ts": now, "data": [{
+            "start": t * 1000, "end": (t + interval * 60) * 1000 - 1, "interval": name, "open": f"{o:.8f}",
+            "close": f"{c:.8f}", "high": f"{h:.8f}", "low": f"{l:.8f}", "volume": "1000.0",
+            "turnover": f"{1000. * c:.8f}", "confirm": closed, "timestamp": now,
+        }]}
+    elif exchange == "gateio":
+        data = {"time": now // 1000, "time_ms": now, "channel": "spot.candlesticks", "event": "update", "result": {
+            "t": str(t), "v": f"{1000. * c:.8f}", "c": f"{c:.8f}", "h": f"{h:.8f}", "l": f"{l:.8f}", "o": f"{o:.8f}",
+            "n": f"{name}_{symbol}", "a": "1000.0", "w": closed,
+        }}
+    else:
+        raise ValueError(f"Invalid exchange: {exchange}")
+    return json.dumps(data)
+
+
+async def record_messages(
+    exchange: str,
+    symbols: List[str],
+    interval: int,
+    duration: float,
+    ) -> List[Tuple[str, float, str]]:
+    """ Record the kline stream messages (exchange, delay, message) of the given symbols for duration seconds. """
+    messages = []
+    async with websockets.connect(STREAM_URLS[exchange], max_size=None) as websocket:
+        for message in get_subscribe_messages(exchange, symbols, interval):
+            await websocket.send(message)
+
+        end = time.time() + duration
+        last = time.time()
+        while time.time() < end:
+            try:
+                message = await asyncio.wait_for(websocket.recv(), timeout=end - time.time())
+            except asyncio.TimeoutError:
+                break
+            if len(parse_message(exchange, message)) > 0:
+                messages.append((exchange, time.time() - last, message))
+                last = time.time()
+    return messages
+
+
+def save_recording(path: str, messages: List[Tuple[str, float, str]]) -> None:
+    """ Save the given messages (exchange, delay, message) as a recording. """
+    with open(path, "w") as f:
+        for exchange, delay, message in messages:
+            f.write(json.dumps({"exchange": exchange, "delay": round(delay, 3), "message": message}) + "\n")
+
+
+async def serve(recording: Recording, host: str, port: int, speed: float) -> None:
+    """ Serve the recording forever. The delays between messages are divided by speed. """
+    async def handle(websocket):
+        exchange = EXCHANGE_PATHS.get(websocket.path)
+        if exchange is None:
+            await websocket.close(code=1008, reason="Unknown stream")
+            return
+
+        # wait for the first subscription, then ignore all further client messages (subscriptions and pings)
+        await websocket.recv()
+        drain = asyncio.create_task(_drain(websocket))
+        try:
+            for delay, message in recording[exchange]:
+                if delay > 0:
+                    await asyncio.sleep(delay / speed)
+                await websocket.send(message)
+            await websocket.wait_closed()
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            drain.cancel()
+
+    async with websockets.serve(handle, host, port, max_size=None):
+        await asyncio.Future()
+
+
+async def _drain(websocket) -> None:
+    """ Discard all incoming messages of the given connection. """
+    try:
+        async for _ in websocket:
+            pass
+    except websockets.ConnectionClosed:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay server for the kline streams of the exchanges.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="play back a recording")
+    serve_parser.add_argument("--recording", required=True, help="path of the recording")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--speed", type=float, default=1., help="playback speed factor")
+
+    for command, description in [("synthesize", "synthesize a recording"), ("record", "record the exchange streams")]:
+        subparser = subparsers.add_parser(command, help=description)
+        subparser.add_argument("--output", required=True, help="path of the recording")
+        subparser.add_argument("--exchange", default="binance", choices=list(STREAM_URLS))
+        subparser.add_argument("--symbols", nargs="*", help="default: all coins of the exchange")
+        subparser.add_argument("--interval", type=int, default=60, help="kline interval in minutes")
+        if command == "synthesize":
+            subparser.add_argument("--num-klines", type=int, default=3, help="number of klines per symbol")
+            subparser.add_argument("--num-updates", type=int, default=20, help="number of updates per kline")
+            subparser.add_argument("--delay", type=float, default=1., help="delay between updates in seconds")
+        else:
+            subparser.add_argument("--duration", type=float, default=60., help="recording duration in seconds")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        asyncio.run(serve(load_recording(args.recording), args.host, args.port, args.speed))
+    else:
+        symbols = args.symbols
+        if not symbols:
+            df = pd.read_csv(os.path.join("data", "config.csv"), index_col="name")
+            symbols = list(df.loc[df["exchange"] == args.exchange, "symbol"])
+
+        if args.command == "synthesize":
+            messages = synthesize_recording(
+                args.exchange, symbols, args.interval, args.num_klines, args.num_updates, args.delay,
+            )
+        else:
+            messages = asyncio.run(record_messages(args.exchange, symbols, args.interval, args.duration))
+        save_recording(args.output, messages)
+        print(f"Saved {len(messages)} messages to {args.output}")
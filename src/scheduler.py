@@ -0,0 +1,170 @@
+import os
+import time
+import threading
+import diskcache
+from typing import Optional, Callable
+
+from src.instrumentation import instrument_update, stage
+from src.snapshot_store import get_snapshot_info, get_snapshot_version, publish_generation
+from src.timeframes import TIMEFRAMES
+
+
+"""
+Refresh service for the market data.
+
+All refreshes go through refresh_market_data(), which runs update_market_data() at most once at a time across all
+processes (Dash workers, long callback processes, background thread). Refresh requests that arrive while a refresh is
+in flight are merged into it, i.e. they wait for it to finish and return its version instead of fetching again.
+Page loads only refresh if the most recent snapshot is older than MAX_SNAPSHOT_AGE, otherwise all sessions share it.
+Each refresh writes a new generation of the stored data, which is published atomically together with its version in
+data/snapshot.json once it is complete (see src/snapshot_store.py). Versions are strictly increasing. Clients poll this version (see
+the /version endpoint and the version_interval component) to pick up new data.
+
+The background refresh thread wakes up shortly after each candle close of the shortest timeframe and optionally in
+shorter intervals to update the still open candle. Updates of the streaming service (see src/streaming.py) are
+published in the same way with publish_update().
+
+In the multi-process serving mode (see gunicorn.conf.py), only one designated updater process (python app.py
+--updater) writes data. The web workers run with the environment variable DASHBOARD_ROLE=worker: their refresh
+requests are handed to the background refresh thread of the updater, which picks them up within
+REQUEST_POLL_INTERVAL seconds, and they only wait for the resulting snapshot.
+
+Each refresh and published update is instrumented while it holds the refresh lock (see src/instrumentation.py).
+"""
+
+CACHE_DIR = os.path.join(".", "cache")
+
+CANDLE_INTERVAL = min(TIMEFRAMES.values()) # in minutes, candles of the shortest timeframe
+CLOSE_DELAY = 30 # in seconds, gives the exchanges some time to finalize the closed candles
+OPEN_CANDLE_INTERVAL = None # in minutes, optional refresh interval for the still open candle
+REFRESH_TIMEOUT = 600 # in seconds, the refresh lock is released after this time in case a process died
+REQUEST_POLL_INTERVAL = 1 # in seconds
+MAX_SNAPSHOT_AGE = int(os.environ.get("MAX_SNAPSHOT_AGE", 15 * 60)) # in seconds, staleness threshold of page loads
+
+# workers never write data themselves but request refreshes from the updater process
+IS_UPDATER = os.environ.get("DASHBOARD_ROLE", "updater") != "worker"
+
+_cache = diskcache.Cache(CACHE_DIR)
+
+
+def refresh_market_data(max_age: Optional[float] = None) -> int:
+    """
+    Run update_market_data() or join the refresh that is currently in flight. If max_age (in seconds) is given,
+    nothing is refreshed as long as the most recent snapshot finished at most max_age seconds ago.
+
+    Returns:
+        Version (timestamp in seconds) of the most recent snapshot.
+    """
+    if max_age is not None:
+        snapshot = get_snapshot_info()
+        if snapshot is not None and time.time() - snapshot["finished"] <= max_age:
+            return snapshot["version"]
+
+    if not IS_UPDATER:
+        return _request_refresh()
+
+    requested_at = time.time()
+    with diskcache.Lock(_cache, "refresh_lock", expire=REFRESH_TIMEOUT):
+        # a refresh that finished after this request was made was in flight and already contains the latest data
+        snapshot = get_snapshot_info()
+        if snapshot is not None and snapshot["finished"] >= requested_at:
+            return snapshot["version"]
+
+        # the exchange clients are only imported by the process that actually fetches the data
+        from src.market_data import update_market_data
+
+        version = _get_next_version()
+        with instrument_update("refresh"):
+            update_market_data(version)
+            with stage("publish"):
+                publish_generation(version)
+    return version
+
+
+def publish_update(
+    update: Callable[[int], None],
+    expected_version: Optional[int] = None,
+    kind: str = "stream",
+    ) -> Optional[int]:
+    """
+    Run the given function, which writes new market data (e.g. from the streaming service) with the version passed to
+    it, exclusively with respect to all refreshes and publish its result as a new snapshot. If expected_version is given, the update is skipped in
+    case the most recent snapshot has another version, i.e. the data of the update is outdated. The kind labels the
+    update in the instrumentation.
+
+    Returns:
+        Version of the published snapshot or None if the update was skipped.
+    """
+    with diskcache.Lock(_cache, "refresh_lock", expire=REFRESH_TIMEOUT):
+        if expected_version is not None and get_snapshot_version() != expected_version:
+            return None
+
+        version = _get_next_version()
+        with instrument_update(kind):
+            update(version)
+            with stage("publish"):
+                publish_generation(version)
+    return version
+
+
+def start_background_refresh(open_candle_interval: Optional[int] = OPEN_CANDLE_INTERVAL) -> threading.Thread:
+    """
+    Start a daemon thread that refreshes the market data after each candle close and, if open_candle_interval
+    (in minutes) is given, additionally in these intervals.
+    """
+    thread = threading.Thread(target=_run_background_refresh, args=(open_candle_interval,), daemon=True)
+    thread.start()
+    return thread
+
+
+def get_next_refresh_time(now: float, open_candle_interval: Optional[int] = None) -> float:
+    """ Return the time (in seconds) of the next scheduled background refresh. """
+    intervals = [CANDLE_INTERVAL] if open_candle_interval is None else [CANDLE_INTERVAL, open_candle_interval]
+    return min(
+        ((now - CLOSE_DELAY) // (interval * 60) + 1) * interval * 60 + CLOSE_DELAY
+        for interval in intervals
+    )
+
+
+def _run_background_refresh(open_candle_interval: Optional[int]) -> None:
+    """ Refresh the market data forever according to the schedule and whenever a worker requested a refresh. """
+    next_refresh = get_next_refresh_time(time.time(), open_candle_interval)
+    handled_request = _cache.get("refresh_requested", 0.)
+    while True:
+        time.sleep(max(0., min(next_refresh - time.time(), REQUEST_POLL_INTERVAL)))
+
+        # requests that were made before the most recent snapshot finished are already served by it
+        requested_at = _cache.get("refresh_requested", 0.)
+        snapshot = get_snapshot_info()
+        is_requested = requested_at > max(handled_request, 0. if snapshot is None else snapshot["finished"])
+        if time.time() < next_refresh and not is_requested:
+            continue
+
+        handled_request = requested_at
+        try:
+            refresh_market_data()
+        except Exception as e:
+            print(f"Background refresh error! {e}")
+        next_refresh = get_next_refresh_time(time.time(), open_candle_interval)
+
+
+def _request_refresh() -> int:
+    """
+    Request a refresh from the updater process and return the version of the first snapshot that finished after the
+    request.
+    """
+    requested_at = time.time()
+    _cache.set("refresh_requested", requested_at)
+    while time.time() < requested_at + REFRESH_TIMEOUT:
+        snapshot = get_snapshot_info()
+        if snapshot is not None and snapshot["finished"] >= requested_at:
+            return snapshot["version"]
+        time.sleep(REQUEST_POLL_INTERVAL / 4)
+    raise TimeoutError("The updater did not publish a new snapshot, is it running?")
+
+
+def _get_next_version() -> int:
+    """ Return the current time in seconds, but at least the version of the most recent snapshot plus 1. """
+    version = get_snapshot_version()
+    return int(time.time()) if version is None else max(int(time.time()), version + 1)
+
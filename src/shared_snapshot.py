@@ -0,0 +1,110 @@
+import os
+import json
+import mmap
+import struct
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional, Tuple
+
+
+"""
+Shared market data snapshot of all processes.
+
+The market data of all timeframes and the outcome of the kline retrieval of a generation (see src/snapshot_store.py)
+are stored together in one binary file that is memory-mapped by the readers (e.g. the gunicorn workers). The file starts with a fixed header (magic bytes,
+generation and length of the description), followed by a JSON description of the data frames (index, column order and
+non-float columns) and the float columns of each data frame as contiguous float64 block. The float columns are used
+directly from the memory map, i.e. the operating system shares them between all processes.
+
+The generation in the header is the version of the snapshot. The file is written into the staging directory of its
+generation and never modified after the generation was published. Readers that still map the file of a previous
+generation keep using it until they reload. Only the updater process writes snapshots.
+"""
+
+SHARED_SNAPSHOT_FILE = "market_snapshot.bin"
+MAGIC = b"CDSNAP01"
+HEADER = struct.Struct("<8sQQ") # magic bytes, generation, length of the JSON description
+
+MarketData = Dict[str, pd.DataFrame]
+
+
+def write_shared_snapshot(
+    directory: str,
+    generation: int,
+    market_data: MarketData,
+    kline_status: Optional[pd.Series],
+    ) -> None:
+    """ Write the shared snapshot with the given market data of each timeframe and kline status into the directory. """
+    description = {"frames": {}, "kline_status": None}
+    blocks = []
+    offset = 0
+    for timeframe, df in market_data.items():
+        float_columns = [column for column in df.columns if pd.api.types.is_float_dtype(df[column])]
+        block = np.ascontiguousarray(df[float_columns].to_numpy(dtype=np.float64).T)
+        description["frames"][timeframe] = {
+            "index": list(df.index),
+            "columns": list(df.columns),
+            "float_columns": float_columns,
+            "other_columns": {column: df[column].tolist() for column in df.columns if column not in float_columns},
+            "offset": offset,
+        }
+        blocks.append(block)
+        offset += block.nbytes
+    if kline_status is not None:
+        description["kline_status"] = kline_status.to_dict()
+
+    description = json.dumps(description).encode()
+    with open(os.path.join(directory, SHARED_SNAPSHOT_FILE), "wb") as f:
+        f.write(HEADER.pack(MAGIC, generation, len(description)))
+        f.write(description)
+        f.write(b"\0" * (_get_data_start(len(description)) - HEADER.size - len(description)))
+        for block in blocks:
+            f.write(block.tobytes())
+
+
+def read_shared_snapshot(directory: Optional[str]) -> Optional[Tuple[int, MarketData, Optional[pd.Series]]]:
+    """
+    Return the generation, the market data of each timeframe and the kline status (None if it is unknown) of the
+    shared snapshot in the given directory (None if there is none). The float columns are read-only views of the
+    memory-mapped file.
+    """
+    if directory is None:
+        return None
+
+    path = os.path.join(directory, SHARED_SNAPSHOT_FILE)
+    try:
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+
+    magic, generation, length = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError(f"Invalid shared snapshot: {path}")
+    description = json.loads(buffer[HEADER.size:HEADER.size + length])
+    data_start = _get_data_start(length)
+
+    market_data = {}
+    for timeframe, frame in description["frames"].items():
+        index = pd.Index(frame["index"], name="name")
+        float_columns = frame["float_columns"]
+        block = np.frombuffer(
+            buffer, dtype=np.float64, count=len(float_columns) * len(index), offset=data_start + frame["offset"],
+        ).reshape(len(float_columns), len(index))
+
+        # the transposed block has the memory layout of a pandas block, i.e. the data frame does not copy it
+        df = pd.DataFrame(block.T, index=index, columns=float_columns, copy=False)
+        for position, column in enumerate(frame["columns"]):
+            if column in frame["other_columns"]:
+                df.insert(position, column, frame["other_columns"][column])
+        market_data[timeframe] = df
+
+    kline_status = description["kline_status"]
+    if kline_status is not None:
+        kline_status = pd.Series(kline_status, name="status").rename_axis("name")
+    return generation, market_data, kline_status
+
+
+def _get_data_start(length: int) -> int:
+    """ Return the offset of the float blocks given the length of the description (aligned to 8 bytes). """
+    return (HEADER.size + length + 7) // 8 * 8
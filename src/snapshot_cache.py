@@ -0,0 +1,56 @@
+import os
+import threading
+import pandas as pd
+from typing import Optional
+
+from src.shared_snapshot import read_shared_snapshot
+from src.snapshot_store import get_generation_dir
+
+
+"""
+In-process cache of the market data snapshot that is shared by all Dash callbacks.
+
+The snapshot (market data of all timeframes, config and kline retrieval status) is loaded once per data update from
+the shared snapshot file of the most recent generation (see src/shared_snapshot.py and src/snapshot_store.py). It is
+versioned by the value of the timestamp store, i.e. the time of the most recent update: a callback that passes a newer
+timestamp than the cached one triggers a reload, older timestamps are served from the cache. update_market_data()
+calls invalidate() so that updates within the same process are picked up immediately. The cached data frames must not
+be modified.
+"""
+
+_cache = {"version": None, "market_data": None, "config": None, "kline_status": None}
+_lock = threading.Lock()
+
+
+def get_market_data(version: int, timeframe: str) -> pd.DataFrame:
+    """ Return the market data of the given timeframe of the snapshot with at least the given version. """
+    return _get_snapshot(version)["market_data"][timeframe]
+
+
+def get_config(version: int) -> pd.DataFrame:
+    """ Return the config of the snapshot with at least the given version. """
+    return _get_snapshot(version)["config"]
+
+
+def get_kline_status(version: int) -> Optional[pd.Series]:
+    """ Return the outcome of the kline retrieval for each coin (None if it is unknown). """
+    return _get_snapshot(version)["kline_status"]
+
+
+def invalidate() -> None:
+    """ Discard the cached snapshot such that it is reloaded on the next access. """
+    with _lock:
+        _cache["version"] = None
+
+
+def _get_snapshot(version: int) -> dict:
+    """ Return the cached snapshot and reload it first if it is missing or older than the given version. """
+    with _lock:
+        if _cache["version"] is None or version > _cache["version"]:
+            snapshot = read_shared_snapshot(get_generation_dir())
+            if snapshot is None:
+                raise FileNotFoundError("No market data snapshot was published yet")
+            generation, _cache["market_data"], _cache["kline_status"] = snapshot
+            _cache["config"] = pd.read_csv(os.path.join("data", "config.csv"), index_col="name")
+            _cache["version"] = generation
+        return dict(_cache)
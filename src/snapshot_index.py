@@ -0,0 +1,81 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+
+from src.snapshot_cache import get_market_data
+
+
+"""
+Precomputed filter and sort indexes of the market data.
+
+A SnapshotIndex is built once per market data frame, i.e. once per snapshot version and timeframe, and contains
+everything the screeners and the overview need to select and order coins without touching the data frame:
+
+    - the row positions and boolean masks of the altcoins (i.e. without Bitcoin) of each filter,
+    - the row orders of all numeric columns and the names (ascending and descending, NaN values last),
+    - the top TOP_N altcoins of each filter for each gain column (descending).
+
+The filters are "All", "Watchlist", one filter per tier and the custom groups (e.g. sectors) of data/groups.csv,
+which contains one row per group and coin (columns "group" and "name"). The groups are loaded once at startup.
+"""
+
+GROUPS_PATH = os.path.join("data", "groups.csv")
+TIERS = [1, 2, 3, 4]
+TOP_N = 30
+GAIN_COLUMNS = ["gain_1d", "gain_1w", "gain_1m"]
+
+
+def load_groups() -> Dict[str, List[str]]:
+    """ Return the names of the coins of each custom group (in the order of data/groups.csv). """
+    if not os.path.exists(GROUPS_PATH):
+        return {}
+    groups_df = pd.read_csv(GROUPS_PATH)
+    return {group: list(names) for group, names in groups_df.groupby("group", sort=False)["name"]}
+
+
+GROUPS = load_groups()
+FILTERS = ["All", "Watchlist"] + [f"Tier {tier}" for tier in TIERS] + list(GROUPS)
+
+
+class SnapshotIndex:
+    """ Filter and sort indexes of one market data frame. """
+
+    def __init__(self, df: pd.DataFrame):
+        is_altcoin = (df.index != "BTC")
+        masks = {"All": is_altcoin, "Watchlist": is_altcoin & (df["watchlist"] == 1).to_numpy()}
+        for tier in TIERS:
+            masks[f"Tier {tier}"] = is_altcoin & (df["tier"] == tier).to_numpy()
+        for group, names in GROUPS.items():
+            masks[group] = is_altcoin & df.index.isin(names)
+        self.masks = masks
+        self.rows = {filter: np.flatnonzero(mask) for filter, mask in masks.items()}
+
+        orders = {("id", "asc"): np.argsort(df.index.to_numpy(dtype=str), kind="stable")}
+        orders[("id", "desc")] = orders[("id", "asc")][::-1]
+        for column in df.columns:
+            if pd.api.types.is_numeric_dtype(df[column]):
+                values = df[column].to_numpy(dtype=float)
+                orders[(column, "asc")] = np.argsort(values, kind="stable")
+                orders[(column, "desc")] = np.argsort(-values, kind="stable")
+        self.orders = orders
+
+        self.top_rows = {
+            (filter, column): orders[(column, "desc")][mask[orders[(column, "desc")]]][:TOP_N]
+            for filter, mask in masks.items() for column in GAIN_COLUMNS
+        }
+
+
+# indexes by timeframe together with the market data frame they belong to
+_cache = {}
+_lock = threading.Lock()
+
+
+def get_snapshot_index(version: int, timeframe: str) -> SnapshotIndex:
+    """ Return the index of the market data of the given timeframe of the snapshot with at least the given version. """
+    df = get_market_data(version, timeframe)
+    with _lock:
+        if timeframe not in _cache or _cache[timeframe][0] is not df:
+            _cache[timeframe] = (df, SnapshotIndex(df))
+        return _cache[timeframe][1]
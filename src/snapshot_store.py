@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+from typing import List, Optional
+
+from src.shared_snapshot import SHARED_SNAPSHOT_FILE, read_shared_snapshot
+from src.timeframes import TIMEFRAMES, DEFAULT_TIMEFRAME
+
+
+"""
+Versioned generations of the stored data.
+
+Every update writes a complete generation of the stored data, i.e. the klines (see src/kline_store.py) and the shared
+market data snapshot (see src/shared_snapshot.py), into the staging directory data/snapshots/{version}.tmp. Once the
+generation is complete, its files are fsynced and the directory is renamed to data/snapshots/{version}. The generation
+is then published by atomically replacing the pointer data/snapshot.json, which contains the version and finishing
+time of the most recent generation. Readers resolve all paths through the pointer (or a version they already know)
+and published files are never modified, so readers never see a partially written generation or a mix of two
+generations. All writers are serialized by the refresh lock (see src/scheduler.py).
+
+Generations are kept for SNAPSHOT_RETENTION seconds. Since the streaming service publishes every few seconds, only the
+MAX_GENERATIONS most recent generations and the first generation of every HISTORY_INTERVAL are retained. The klines
+are by far the largest part of a generation (about 30 MB for 350 coins), they are only kept for the
+NUM_KLINE_GENERATIONS most recent generations and generations with unchanged klines share the files via hard links
+(see link_klines in src/kline_store.py). Older generations only keep the market data, which is enough to compare them
+(see diff_generations):
+
+    python -m src.snapshot_store list
+    python -m src.snapshot_store diff OLD_VERSION NEW_VERSION --timeframe 4h
+"""
+
+SNAPSHOTS_DIR = os.path.join("data", "snapshots")
+POINTER_PATH = os.path.join("data", "snapshot.json")
+
+SNAPSHOT_RETENTION = 24 * 3600 # in seconds
+MAX_GENERATIONS = 100
+HISTORY_INTERVAL = 15 * 60 # in seconds
+NUM_KLINE_GENERATIONS = 3
+
+
+def get_snapshot_info() -> Optional[dict]:
+    """ Return version and finishing time of the most recent snapshot (None if there is none yet). """
+    try:
+        with open(POINTER_PATH, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def get_snapshot_version() -> Optional[int]:
+    """ Return the version of the most recent snapshot (None if there is none yet). """
+    snapshot = get_snapshot_info()
+    return None if snapshot is None else snapshot["version"]
+
+
+def get_generation_dir(version: Optional[int] = None) -> Optional[str]:
+    """ Return the directory of the given generation (by default the most recent one, None if there is none yet). """
+    version = get_snapshot_version() if version is None else version
+    return None if version is None else os.path.join(SNAPSHOTS_DIR, str(version))
+
+
+def get_staging_dir(version: int, create: bool = True) -> str:
+    """ Return the staging directory of the given generation, which is created if it is missing and create is set. """
+    directory = os.path.join(SNAPSHOTS_DIR, f"{version}.tmp")
+    if create:
+        os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def publish_generation(version: int) -> None:
+    """
+    Publish the staged generation with the given version: fsync its files, move it to its final directory, replace
+    the pointer and delete the generations that are no longer retained. Raises FileNotFoundError if nothing was
+    staged for the given version.
+    """
+    staging_dir = get_staging_dir(version, create=False)
+    if not os.path.isdir(staging_dir):
+        raise FileNotFoundError(f"Generation {version} was not staged")
+    for file_name in os.listdir(staging_dir):
+        with open(os.path.join(staging_dir, file_name), "rb+") as f:
+            os.fsync(f.fileno())
+    os.rename(staging_dir, get_generation_dir(version))
+    _fsync_dir(SNAPSHOTS_DIR)
+
+    with open(POINTER_PATH + ".tmp", "w") as f:
+        json.dump({"version": version, "finished": time.time()}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(POINTER_PATH + ".tmp", POINTER_PATH)
+
+    _prune_generations(version)
+
+
+def list_generations() -> List[int]:
+    """ Return the versions of all published generations that are still retained (in ascending order). """
+    if not os.path.exists(SNAPSHOTS_DIR):
+        return []
+    return sorted(int(name) for name in os.listdir(SNAPSHOTS_DIR) if name.isdigit())
+
+
+def diff_generations(old_version: int, new_version: int, timeframe: str = DEFAULT_TIMEFRAME) -> pd.DataFrame:
+    """
+    Compare the market data of the given timeframe of two generations. Returns a data frame with one row per coin of
+    either generation, the status of the coin ("added", "removed", "changed" or "unchanged") and the change of each
+    metric (new value minus old value, NaN for added and removed coins).
+    """
+    old_df = _read_market_data(old_version, timeframe)
+    new_df = _read_market_data(new_version, timeframe)
+    columns = [
+        column for column in new_df.columns
+        if column in old_df.columns and pd.api.types.is_float_dtype(new_df[column])
+    ]
+    names = old_df.index.union(new_df.index, sort=False)
+    changes = new_df[columns].reindex(names) - old_df[columns].reindex(names)
+
+    is_changed = (changes.fillna(0.) != 0.).any(axis=1)
+    status = np.where(is_changed, "changed", "unchanged")
+    status = np.where(names.isin(old_df.index), status, "added")
+    status = np.where(names.isin(new_df.index), status, "removed")
+    changes.insert(0, "status", status)
+    return changes
+
+
+def _read_market_data(version: int, timeframe: str) -> pd.DataFrame:
+    """ Return the market data of the given timeframe of the given generation. """
+    snapshot = read_shared_snapshot(get_generation_dir(version))
+    if snapshot is None:
+        raise FileNotFoundError(f"Generation {version} is not retained")
+    return snapshot[1][timeframe]
+
+
+def _prune_generations(current: int) -> None:
+    """
+    Delete abandoned staging directories and the generations (or only their klines) that are no longer retained.
+    The given current generation is always retained completely. Files that are still in use (e.g. memory-mapped on
+    Windows) are deleted by a later call.
+    """
+    for name in os.listdir(SNAPSHOTS_DIR):
+        if name.endswith(".tmp"):
+            shutil.rmtree(os.path.join(SNAPSHOTS_DIR, name), ignore_errors=True)
+
+    generations = list_generations()
+    recent = [version for version in generations if version >= time.time() - SNAPSHOT_RETENTION]
+    first_per_interval = {}
+    for version in recent:
+        first_per_interval.setdefault(version // HISTORY_INTERVAL, version)
+    retained = set(recent[-MAX_GENERATIONS:] + list(first_per_interval.values()) + [current])
+    with_klines = set(generations[-NUM_KLINE_GENERATIONS:] + [current])
+    for version in generations:
+        directory = get_generation_dir(version)
+        if version not in retained:
+            shutil.rmtree(directory, ignore_errors=True)
+        elif version not in with_klines:
+            for file_name in os.listdir(directory):
+                if file_name != SHARED_SNAPSHOT_FILE:
+                    try:
+                        os.remove(os.path.join(directory, file_name))
+                    except OSError:
+                        pass
+
+
+def _fsync_dir(directory: str) -> None:
+    """ Make a rename within the given directory durable (not supported on Windows). """
+    if os.name != "posix":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the retained generations of the stored data.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="list the retained generations")
+    diff_parser = subparsers.add_parser("diff", help="compare the market data of two generations")
+    diff_parser.add_argument("old_version", type=int)
+    diff_parser.add_argument("new_version", type=int)
+    diff_parser.add_argument("--timeframe", default=DEFAULT_TIMEFRAME, choices=list(TIMEFRAMES))
+    diff_parser.add_argument("--sort-by", default="trend_strength", help="metric whose largest changes are shown")
+    diff_parser.add_argument("--num-rows", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == "list":
+        current = get_snapshot_version()
+        for version in list_generations():
+            files = os.listdir(get_generation_dir(version))
+            details = ["current" if version == current else "", "with klines" if len(files) > 1 else ""]
+            print(time.strftime("%d.%m.%Y, %H:%M:%S", time.localtime(version)), version, *filter(None, details))
+    else:
+        diff = diff_generations(args.old_version, args.new_version, args.timeframe)
+        print(diff["status"].value_counts().to_string())
+        order = diff[args.sort_by].abs().sort_values(ascending=False, na_position="last").index
+        print(diff.loc[order[:args.num_rows]].to_string())
@@ -0,0 +1,422 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import websockets
+import numpy as np
+import pandas as pd
+from urllib.parse import urlsplit
+from typing import Dict, List, Optional, Tuple
+
+from src.exchange_data import INTERVALS
+from src.kline_store import load_klines, stack_klines, save_stacked_klines, link_klines, get_btc_denominated_klines
+from src.market_data import update_market_data, compute_market_data, save_market_data, GAIN_PERIODS, BTC_GAIN_PERIODS
+from src.metrics import get_gains
+from src.indicators import IndicatorState
+from src.instrumentation import stage
+from src.scheduler import refresh_market_data, publish_update, get_snapshot_version
+from src.shared_snapshot import read_shared_snapshot
+from src.snapshot_store import get_generation_dir
+from src.timeframes import BASE_INTERVAL, NUM_BASE_KLINES, TIMEFRAMES, get_look_back, resample_klines
+
+# use the faster orjson decoder if it is installed
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
+
+
+"""
+Streaming ingestion of klines via the kline WebSocket channels of the exchanges.
+
+The streaming service keeps the most recent base klines of all coins in memory (see KlineBuffer) and applies the kline
+updates of the exchanges as they arrive. Every PUBLISH_INTERVAL seconds, the market data of the updated coins is
+recomputed and published together with the klines as a new snapshot (see publish_update in src/scheduler.py), which
+the clients pick up like any other refresh. The trend and pump strengths (also of the BTC pairs) are updated in
+constant time per coin with the incremental indicator states of each timeframe (see src/indicators.py), only the
+gains need the klines of the last month.
+
+To avoid rewriting all klines every few seconds, the klines are only saved again once a new kline started or after
+KLINE_SAVE_INTERVAL seconds. The snapshots in between link the klines of the previous snapshot, i.e. the open klines of
+the stored klines (and the charts) lag behind the market data by at most KLINE_SAVE_INTERVAL seconds.
+
+Binance, Bybit and Gate.io are streamed. Coins of other exchanges and coins whose klines were fetched from the perps
+endpoints are only updated by the regular refreshes. The buffer is reloaded from the store whenever a regular refresh
+published a snapshot, and a regular update is run after each reconnect to fill the gap in the streamed klines.
+Set the environment variable EXCHANGE_STREAM_URL to stream from the local replay server (see src/replay_stream.py).
+
+API docs:
+    - https://binance-docs.github.io/apidocs/spot/en/#kline-candlestick-streams
+    - https://bybit-exchange.github.io/docs/v5/websocket/public/kline
+    - https://www.gate.io/docs/developers/apiv4/ws/en/#candlesticks-channel
+"""
+
+STREAM_URLS = {
+    "binance": "wss://stream.binance.com:9443/stream",
+    "bybit": "wss://stream.bybit.com/v5/public/spot",
+    "gateio": "wss://api.gateio.ws/ws/v4/",
+}
+
+STREAMS_PER_CONNECTION = 200
+SUBSCRIBE_DELAY = 0.25 # in seconds, binance allows at most 5 incoming messages per second
+HEARTBEAT_INTERVAL = 20 # in seconds
+PUBLISH_INTERVAL = 10 # in seconds
+KLINE_SAVE_INTERVAL = 5 * 60 # in seconds
+RECONNECT_DELAY = 5 # in seconds
+
+Kline = Tuple[int, float, float, float, float]
+
+
+class KlineBuffer:
+    """
+    Most recent base klines of all streamed coins in one right-aligned (coin, kline) array (see stack_klines in
+    src/kline_store.py), the indicator states of each timeframe (of the klines in USD and in BTC) and the market data
+    computed from them. Updates of the open kline replace the last kline of a coin, a new kline drops the oldest kline
+    of the coin. All methods must be called from the same thread. Outdated buffers are loaded again in another thread
+    by creating a new buffer, which replaces the outdated one with replace (see _publish_forever).
+    """
+
+    def __init__(self, info_df: pd.DataFrame):
+        self.info_df = info_df
+        self.reload()
+
+    def reload(self) -> None:
+        """ Load the klines and kline status from the store and recompute the market data of all coins. """
+        self.version = get_snapshot_version()
+        snapshot = read_shared_snapshot(get_generation_dir(self.version))
+        self.kline_status = None if snapshot is None else snapshot[2]
+        kline_dict, last_closed = load_klines(self.info_df, interval=BASE_INTERVAL)
+        self.df = self.info_df.loc[[name for name in self.info_df.index if name in kline_dict]]
+        self.incomplete = [name for name in self.df.index if name not in last_closed]
+        self.klines = stack_klines(kline_dict, names=list(self.df.index), num_klines=NUM_BASE_KLINES)
+        self.set_saved(self.klines)
+        self.rows = {key: row for row, key in enumerate(zip(self.df["exchange"], self.df["symbol"]))}
+        self.market_data = compute_market_data(self.df, self.klines)
+        self.btc_row = self.df.index.get_loc("BTC") if "BTC" in self.df.index else None
+        self.states = self._get_states("usd")
+        self.btc_states = self._get_states("btc")
+        self.btc_timestamp = 0 if self.btc_row is None else self.klines["timestamp"][self.btc_row, -1]
+        self.updated_rows = set()
+
+    def replace(self, buffer: "KlineBuffer") -> None:
+        """
+        Replace the klines, indicator states and market data with those of the given newly loaded buffer. Updates
+        that were applied to this buffer in the meantime are replaced by the next updates of the coins.
+        """
+        self.__dict__.update(buffer.__dict__)
+
+    def set_saved(self, klines: np.ndarray) -> None:
+        """ Remember the time and the open klines of the most recently saved klines. """
+        self.saved_at = time.time()
+        self.saved_timestamps = klines["timestamp"][:, -1].copy()
+
+    def is_saved(self, klines: np.ndarray) -> bool:
+        """
+        Return whether the saved klines are recent enough to be linked instead of saving the given klines, i.e. no
+        new kline started since they were saved and they are less than KLINE_SAVE_INTERVAL seconds old.
+        """
+        is_recent = time.time() - self.saved_at < KLINE_SAVE_INTERVAL
+        return is_recent and np.array_equal(klines["timestamp"][:, -1], self.saved_timestamps)
+
+    def update(self, exchange: str, symbol: str, kline: Kline) -> None:
+        """ Apply a kline update (timestamp in seconds, open, high, low, close) of the given symbol. """
+        row = self.rows.get((exchange, symbol))
+        if row is None or kline[0] < self.klines["timestamp"][row, -1]:
+            return
+
+        if kline[0] > self.klines["timestamp"][row, -1]:
+            self.klines[row, :-1] = self.klines[row, 1:]
+        self.klines[row, -1] = kline
+        self.updated_rows.add(row)
+
+    def recompute(self) -> None:
+        """ Recompute the market data of the coins that were updated since the last call. """
+        if len(self.updated_rows) == 0:
+            return
+
+        rows = np.array(sorted(self.updated_rows))
+        self.updated_rows = set()
+        names = self.df.index[rows]
+        for timeframe, interval in TIMEFRAMES.items():
+            klines = self._get_recent_klines(rows, interval, "usd")
+            self._update_state(self.states[timeframe], rows, klines, interval, "usd")
+
+            df = self.market_data[timeframe]
+            look_back = [get_look_back(interval, period) for period in GAIN_PERIODS.values()]
+            df.loc[names, list(GAIN_PERIODS)] = np.column_stack(get_gains(klines, look_back))
+            df.loc[names, "trend_strength"] = self.states[timeframe].get_trend_strengths(rows)
+            df.loc[names, "pump_strength"] = self.states[timeframe].get_pump_strengths(rows)
+
+        # the metrics of all BTC pairs change with every update of Bitcoin, but their closed klines only change once a
+        # new Bitcoin kline started (the closed klines of coins that were updated before Bitcoin are then corrected)
+        btc_rows = rows
+        if self.btc_row in rows:
+            btc_rows = np.arange(len(self.df))
+            if self.klines["timestamp"][self.btc_row, -1] > self.btc_timestamp:
+                self.btc_states = self._get_states("btc")
+                self.btc_timestamp = self.klines["timestamp"][self.btc_row, -1]
+        names = self.df.index[btc_rows]
+        for timeframe, interval in TIMEFRAMES.items():
+            klines = self._get_recent_klines(btc_rows, interval, "btc")
+            self._update_state(self.btc_states[timeframe], btc_rows, klines, interval, "btc")
+
+            df = self.market_data[timeframe]
+            look_back = [get_look_back(interval, period) for period in BTC_GAIN_PERIODS.values()]
+            df.loc[names, list(BTC_GAIN_PERIODS)] = np.column_stack(get_gains(klines, look_back))
+            df.loc[names, "trend_strength_btc"] = self.btc_states[timeframe].get_trend_strengths(btc_rows)
+
+    def _get_base_klines(self, rows: np.ndarray, denomination: str, num_klines: Optional[int] = None) -> np.ndarray:
+        """
+        Return the most recent num_klines base klines (all by default) of the given coins denominated in USD or BTC
+        ("usd" or "btc").
+        """
+        klines = self.klines[rows] if num_klines is None else self.klines[rows, -num_klines:]
+        if denomination == "usd":
+            return klines
+        return get_btc_denominated_klines(klines, None if self.btc_row is None else self.klines[self.btc_row])
+
+    def _get_states(self, denomination: str) -> Dict[str, IndicatorState]:
+        """ Return the indicator state of each timeframe built from all klines denominated in USD or BTC. """
+        klines = self._get_base_klines(np.arange(len(self.df)), denomination)
+        return {
+            timeframe: IndicatorState.from_klines(resample_klines(klines, BASE_INTERVAL, interval))
+            for timeframe, interval in TIMEFRAMES.items()
+        }
+
+    def _get_recent_klines(self, rows: np.ndarray, interval: int, denomination: str) -> np.ndarray:
+        """
+        Return the resampled klines of the given coins that are needed for the gains and the two most recent klines
+        (right-aligned and padded to at least 2 klines per coin).
+        """
+        num_base_klines = get_look_back(BASE_INTERVAL, max(GAIN_PERIODS.values())) + 2 * interval // BASE_INTERVAL
+        klines = resample_klines(self._get_base_klines(rows, denomination, num_base_klines), BASE_INTERVAL, interval)
+        if klines.shape[1] < 2:
+            padding = np.zeros((len(rows), 2 - klines.shape[1]), dtype=klines.dtype)
+            for field in ["open", "high", "low", "close"]:
+                padding[field] = np.nan
+            klines = np.concatenate([padding, klines], axis=1)
+        return klines
+
+    def _update_state(
+        self,
+        state: IndicatorState,
+        rows: np.ndarray,
+        klines: np.ndarray,
+        interval: int,
+        denomination: str,
+        ) -> None:
+        """
+        Update the indicator state of the given coins with their most recent resampled klines (right-aligned, at
+        least 2 per coin) denominated in USD or BTC. Once a new kline started, the previous kline is closed and
+        appended to the state. The state of a coin is rebuilt from all its klines if klines were missed, i.e. if the
+        previous kline does not follow the provisional kline of the state.
+        """
+        previous = klines[:, -2]
+        is_new = klines["timestamp"][:, -1] > state.timestamp[rows]
+        is_consecutive = previous["timestamp"] == state.timestamp[rows]
+
+        state.append(rows[is_new & is_consecutive], previous[is_new & is_consecutive])
+        missed = rows[is_new & ~is_consecutive]
+        if len(missed) > 0:
+            missed_klines = resample_klines(self._get_base_klines(missed, denomination), BASE_INTERVAL, interval)
+            state.replace(missed, IndicatorState.from_klines(missed_klines))
+        state.set_provisional(rows, klines[:, -1])
+
+
+def start_streaming(info_df: Optional[pd.DataFrame] = None) -> threading.Thread:
+    """
+    Start a daemon thread that runs the streaming service for the coins in info_df (by default all coins of
+    data/config.csv).
+    """
+    if info_df is None:
+        info_df = pd.read_csv(os.path.join("data", "config.csv"), index_col="name")
+    thread = threading.Thread(target=asyncio.run, args=(_run_streaming(info_df),), daemon=True)
+    thread.start()
+    return thread
+
+
+def get_subscribe_messages(exchange: str, symbols: List[str], interval: int) -> List[str]:
+    """ Return the messages that subscribe to the kline channels of the given symbols and interval (in minutes). """
+    interval = INTERVALS[exchange][interval]
+    if exchange == "binance":
+        params = [f"{symbol.lower()}@kline_{interval}" for symbol in symbols]
+        return [json.dumps({"method": "SUBSCRIBE", "params": params, "id": 1})]
+    elif exchange == "bybit":
+        # at most 10 topics per message
+        return [
+            json.dumps({"op": "subscribe", "args": [f"kline.{interval}.{symbol}" for symbol in symbols[i:i + 10]]})
+            for i in range(0, len(symbols), 10)
+        ]
+    elif exchange == "gateio":
+        return [
+            json.dumps({
+                "time": int(time.time()), "channel": "spot.candlesticks", "event": "subscribe",
+                "payload": [interval, symbol],
+            })
+            for symbol in symbols
+        ]
+    raise ValueError(f"Invalid exchange: {exchange}")
+
+
+def parse_message(exchange: str, message: str) -> List[Tuple[str, Kline]]:
+    """
+    Return the symbols and klines (timestamp in seconds, open, high, low, close) of a stream message.
+    Messages that do not contain kline updates (e.g. subscription responses) result in an empty list.
+    """
+    data = _loads(message)
+    if exchange == "binance":
+        if "data" not in data or data["data"].get("e") != "kline":
+            return []
+        k = data["data"]["k"]
+        return [(k["s"], (k["t"] // 1000, float(k["o"]), float(k["h"]), float(k["l"]), float(k["c"])))]
+    elif exchange == "bybit":
+        if not data.get("topic", "").startswith("kline."):
+            return []
+        symbol = data["topic"].split(".")[2]
+        return [
+            (symbol, (int(k["start"]) // 1000, float(k["open"]), float(k["high"]), float(k["low"]), float(k["close"])))
+            for k in data["data"]
+        ]
+    elif exchange == "gateio":
+        if data.get("channel") != "spot.candlesticks" or data.get("event") != "update":
+            return []
+        k = data["result"]
+        symbol = k["n"].split("_", 1)[1]
+        return [(symbol, (int(k["t"]), float(k["o"]), float(k["h"]), float(k["l"]), float(k["c"])))]
+    raise ValueError(f"Invalid exchange: {exchange}")
+
+
+def _get_heartbeat_message(exchange: str) -> Optional[str]:
+    """ Return the application level ping message of the given exchange (None if it relies on WebSocket pings). """
+    if exchange == "bybit":
+        return json.dumps({"op": "ping"})
+    elif exchange == "gateio":
+        return json.dumps({"time": int(time.time()), "channel": "spot.ping"})
+    return None
+
+
+def _get_stream_url(exchange: str) -> str:
+    """ Return the stream URL of the given exchange or the corresponding URL of the replay server if set. """
+    url = STREAM_URLS[exchange]
+    base_url = os.environ.get("EXCHANGE_STREAM_URL")
+    if not base_url:
+        return url
+    return base_url.rstrip("/") + urlsplit(url).path
+
+
+async def _run_streaming(info_df: pd.DataFrame) -> None:
+    """ Fill the gaps in the stored klines, then stream and publish the kline updates forever. """
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, refresh_market_data)
+    buffer = await loop.run_in_executor(None, KlineBuffer, info_df)
+
+    # coins whose klines were fetched from the perps endpoints cannot be streamed from the spot channels
+    status = buffer.kline_status
+    perps = set() if status is None else set(status.index[status == "perps"])
+
+    tasks = [_publish_forever(buffer)]
+    for exchange in STREAM_URLS:
+        df = buffer.df.loc[(buffer.df["exchange"] == exchange) & ~buffer.df.index.isin(perps)]
+        symbols = list(df["symbol"])
+        tasks += [
+            _stream_klines(exchange, symbols[i:i + STREAMS_PER_CONNECTION], buffer)
+            for i in range(0, len(symbols), STREAMS_PER_CONNECTION)
+        ]
+    await asyncio.gather(*tasks)
+
+
+async def _stream_klines(exchange: str, symbols: List[str], buffer: KlineBuffer) -> None:
+    """ Apply the kline updates of the given symbols to the buffer and reconnect whenever the connection is lost. """
+    loop = asyncio.get_running_loop()
+    reconnected = False
+    while True:
+        try:
+            async with websockets.connect(_get_stream_url(exchange), max_size=None) as websocket:
+                for message in get_subscribe_messages(exchange, symbols, BASE_INTERVAL):
+                    await websocket.send(message)
+                    await asyncio.sleep(SUBSCRIBE_DELAY)
+                if reconnected:
+                    # the gap fill runs in the background while streaming continues, its errors are logged when it ends
+                    loop.run_in_executor(None, _fill_gaps).add_done_callback(_log_gap_fill_error)
+
+                heartbeat = asyncio.create_task(_send_heartbeats(exchange, websocket))
+                try:
+                    async for message in websocket:
+                        for symbol, kline in parse_message(exchange, message):
+                            buffer.update(exchange, symbol, kline)
+                finally:
+                    heartbeat.cancel()
+            print(f"Stream of {exchange} closed!")
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+            print(f"Stream error for {exchange}! {e}")
+
+        reconnected = True
+        await asyncio.sleep(RECONNECT_DELAY)
+
+
+async def _send_heartbeats(exchange: str, websocket) -> None:
+    """ Keep the connection alive by sending application level pings if the exchange requires them. """
+    while _get_heartbeat_message(exchange) is not None:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        await websocket.send(_get_heartbeat_message(exchange))
+
+
+async def _publish_forever(buffer: KlineBuffer) -> None:
+    """ Publish the buffered klines and their market data in regular intervals. """
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(PUBLISH_INTERVAL)
+        try:
+            buffer.recompute()
+            klines = buffer.klines.copy()
+            is_saved = buffer.is_saved(klines)
+            published = await loop.run_in_executor(
+                None, _publish, buffer.version, buffer.df, klines,
+                {timeframe: df.copy() for timeframe, df in buffer.market_data.items()}, buffer.kline_status,
+                buffer.incomplete, is_saved,
+            )
+            if published is None:
+                buffer.replace(await loop.run_in_executor(None, KlineBuffer, buffer.info_df))
+            else:
+                buffer.version = published
+                if not is_saved:
+                    buffer.set_saved(klines)
+        except Exception as e:
+            print(f"Streaming publish error! {e}")
+
+
+def _publish(
+    version: Optional[int],
+    info_df: pd.DataFrame,
+    klines: np.ndarray,
+    market_data: Dict[str, pd.DataFrame],
+    kline_status: Optional[pd.Series],
+    incomplete: List[str],
+    is_saved: bool = False,
+    ) -> Optional[int]:
+    """
+    Save and publish the given klines and market data unless another snapshot was published since the given version.
+    The kline histories of the coins in incomplete stay marked as incomplete (see load_klines in src/kline_store.py).
+    If is_saved is True, the klines of the given version are linked instead of saving the given klines (see
+    KlineBuffer.is_saved). Returns the published version or None if the buffer is outdated and needs to be reloaded.
+    """
+    def update(new_version: int):
+        with stage("save_klines"):
+            if not (is_saved and version is not None and link_klines(new_version, version)):
+                save_stacked_klines(info_df, klines, BASE_INTERVAL, new_version, incomplete)
+        with stage("save_market_data"):
+            save_market_data(market_data, kline_status, new_version)
+
+    return publish_update(update, expected_version=version)
+
+
+def _fill_gaps() -> None:
+    """ Fetch the klines that were missed while the stream was disconnected. """
+    publish_update(update_market_data, kind="gap_fill")
+
+
+def _log_gap_fill_error(future: asyncio.Future) -> None:
+    """ Print the error of a finished gap fill (see _fill_gaps). """
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Streaming gap fill error! {future.exception()}")
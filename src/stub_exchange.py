@@ -0,0 +1,342 @@
+import os
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from requests.models import Response
+from typing import List, Dict, Tuple, Iterable, Optional
+
+from src.exchange_data import _parse_klines
+
+
+"""
+Local stub server that imitates the kline endpoints of Binance, Bybit, Gate.io, Huobi and KuCoin.
+
+All endpoints are served on the same host (the URL paths of the exchanges do not overlap) and return deterministic
+synthetic klines for any symbol in the response format of the corresponding exchange. Point the dashboard to the
+stub server by setting the environment variable EXCHANGE_API_URL, e.g.:
+
+    python -m src.stub_exchange --port 8000
+    EXCHANGE_API_URL=http://127.0.0.1:8000 python app.py
+
+With --fixtures, the recorded responses in benchmarks/fixtures (see benchmarks/bench_parsers.py) are replayed instead
+of synthetic klines for the exchanges with a fixture (see replay_klines).
+
+Like the real API, Gate.io rejects requests for klines that are more than GATEIO_MAX_POINTS klines ago. Rate limits
+and other errors can be imitated randomly (--error-rate) or deterministically (--num-errors, every request is answered
+with the error the given number of times before it succeeds), see create_server.
+"""
+
+# interval names of the exchanges in seconds
+INTERVAL_SECONDS = {
+    "1m": 60, "5m": 300, "15m": 900, "1h": 3600, "4h": 14400, "1d": 86400, # binance, gateio
+    "1": 60, "5": 300, "15": 900, "60": 3600, "240": 14400, "D": 86400, # bybit
+    "1min": 60, "5min": 300, "15min": 900, "60min": 3600, "4hour": 14400, "1day": 86400, # huobi
+    "1hour": 3600, # kucoin (remaining intervals are equal to the huobi ones)
+}
+
+# URL paths of the kline endpoints
+PATHS = [
+    "/api/v3/klines", "/fapi/v1/markPriceKlines", "/v5/market/kline",
+    "/api/v4/spot/candlesticks", "/market/history/kline", "/api/v1/market/candles",
+]
+
+# maximum number of klines per request of each endpoint
+MAX_KLINES = {"binance": 1000, "bybit": 1000, "gateio": 1000, "huobi": 2000, "kucoin": 1500}
+
+# Gate.io only serves the most recent klines
+GATEIO_MAX_POINTS = 10000
+
+
+def get_klines(symbol: str, interval: int, end: int, num_klines: int) -> List[Tuple[int, float, float, float, float]]:
+    """
+    Return deterministic synthetic klines (timestamp, open, high, low, close) for the given symbol. The klines end with
+    the kline that contains the timestamp end (in seconds) and the prices only depend on the symbol and timestamps.
+    """
+    last = end // interval * interval
+    base_price = 1. + zlib.crc32(symbol.upper().encode()) % 100000 / 100.
+
+    klines = []
+    for timestamp in range(last - (num_klines - 1) * interval, last + 1, interval):
+        if timestamp < 0:
+            continue
+        seed = zlib.crc32(f"{symbol.upper()}{timestamp}".encode())
+        drift = ((seed % 1000) / 1000. - 0.48) * 0.04
+        level = base_price * (1. + 0.3 * ((timestamp // interval) % 97) / 97.)
+        open_price = level * (1. + drift)
+        close_price = level * (1. + drift * ((seed >> 10) % 7 - 3) / 3.)
+        high = max(open_price, close_price) * (1. + (seed >> 13) % 100 / 10000.)
+        low = min(open_price, close_price) * (1. - (seed >> 17) % 100 / 10000.)
+        klines.append((timestamp, open_price, high, low, close_price))
+    return klines
+
+
+def load_fixtures(directory: str) -> Dict[str, List[Tuple[int, float, float, float, float]]]:
+    """ Return the klines of the recorded response of each exchange in the given directory (e.g. binance.json). """
+    fixtures = {}
+    for exchange in MAX_KLINES:
+        path = os.path.join(directory, f"{exchange}.json")
+        if not os.path.exists(path):
+            continue
+        response = Response()
+        response.status_code = 200
+        with open(path, "rb") as f:
+            response._content = f.read()
+        df = _parse_klines(exchange, response)
+        fixtures[exchange] = list(zip(df["timestamp"], df["open"], df["high"], df["low"], df["close"]))
+    return fixtures
+
+
+def replay_klines(
+    recorded: List[Tuple[int, float, float, float, float]],
+    symbol: str,
+    interval: int,
+    end: int,
+    num_klines: int,
+    ) -> List[Tuple[int, float, float, float, float]]:
+    """
+    Return klines like get_klines whose prices replay the recorded klines. The recording is played forward and
+    backward in turns (with swapped open and close), so the prices stay continuous, and the price level depends on
+    the symbol. The klines only depend on the symbol and timestamps.
+    """
+    last = end // interval * interval
+    scale = (1. + zlib.crc32(symbol.upper().encode()) % 100000 / 100.) / recorded[0][1]
+    n = len(recorded)
+
+    klines = []
+    for timestamp in range(last - (num_klines - 1) * interval, last + 1, interval):
+        if timestamp < 0:
+            continue
+        position = (timestamp // interval) % (2 * n)
+        _, open_price, high, low, close_price = recorded[position if position < n else 2 * n - 1 - position]
+        if position >= n:
+            open_price, close_price = close_price, open_price
+        klines.append((timestamp, open_price * scale, high * scale, low * scale, close_price * scale))
+    return klines
+
+
+def format_klines(exchange: str, klines: List[Tuple[int, float, float, float, float]], interval: int) -> object:
+    """ Return the klines in the response format of the given exchange. """
+    if exchange == "binance":
+        return [
+            [t * 1000, f"{o:.8f}", f"{h:.8f}", f"{l:.8f}", f"{c:.8f}", "1000.0", (t + interval) * 1000 - 1,
+             f"{1000. * c:.8f}", 100, "500.0", f"{500. * c:.8f}", "0"]
+            for t, o, h, l, c in klines
+        ]
+    elif exchange == "bybit":
+        return {"retCode": 0, "retMsg": "OK", "result": {"category": "spot", "list": [
+            [str(t * 1000), f"{o:.8f}", f"{h:.8f}", f"{l:.8f}", f"{c:.8f}", "1000.0", f"{1000. * c:.8f}"]
+            for t, o, h, l, c in reversed(klines)
+        ]}}
+    elif exchange == "gateio":
+        return [
+            [str(t), f"{1000. * c:.8f}", f"{c:.8f}", f"{h:.8f}", f"{l:.8f}", f"{o:.8f}", "1000.0", "true"]
+            for t, o, h, l, c in klines
+        ]
+    elif exchange == "huobi":
+        return {"ch": "market.kline", "status": "ok", "ts": int(time.time() * 1000), "data": [
+            {"id": t, "open": o, "close": c, "low": l, "high": h, "amount": 1000., "vol": 1000. * c, "count": 100}
+            for t, o, h, l, c in reversed(klines)
+        ]}
+    elif exchange == "kucoin":
+        return {"code": "200000", "data": [
+            [str(t), f"{o:.8f}", f"{c:.8f}", f"{h:.8f}", f"{l:.8f}", "1000.0", f"{1000. * c:.8f}"]
+            for t, o, h, l, c in reversed(klines)
+        ]}
+    raise ValueError(f"Invalid exchange: {exchange}")
+
+
+def parse_request(path: str, params: Dict[str, str]) -> Tuple[str, str, int, int, int]:
+    """
+    Return the exchange, symbol, interval (in seconds), end timestamp (in seconds) and number of klines
+    of a kline request given its URL path and query parameters.
+    """
+    now = int(time.time())
+    if path in ["/api/v3/klines", "/fapi/v1/markPriceKlines"]:
+        exchange, symbol, interval = "binance", params["symbol"], INTERVAL_SECONDS[params["interval"]]
+        end = int(params["endTime"]) // 1000 if "endTime" in params else now
+        start = int(params["startTime"]) // 1000 if "startTime" in params else None
+        limit = int(params.get("limit", 500))
+    elif path == "/v5/market/kline":
+        exchange, symbol, interval = "bybit", params["symbol"], INTERVAL_SECONDS[params["interval"]]
+        end = int(params["end"]) // 1000 if "end" in params else now
+        start = int(params["start"]) // 1000 if "start" in params else None
+        limit = int(params.get("limit", 200))
+    elif path == "/api/v4/spot/candlesticks":
+        exchange, symbol, interval = "gateio", params["currency_pair"], INTERVAL_SECONDS[params["interval"]]
+        end = int(params["to"]) if "to" in params else now
+        start = int(params["from"]) if "from" in params else None
+        limit = int(params.get("limit", 100 if start is None else MAX_KLINES["gateio"]))
+    elif path == "/market/history/kline":
+        exchange, symbol, interval = "huobi", params["symbol"], INTERVAL_SECONDS[params["period"]]
+        end, start, limit = now, None, int(params.get("size", 150))
+    elif path == "/api/v1/market/candles":
+        exchange, symbol, interval = "kucoin", params["symbol"], INTERVAL_SECONDS[params["type"]]
+        end = int(params["endAt"]) if "endAt" in params and int(params["endAt"]) > 0 else now
+        start = int(params["startAt"]) if "startAt" in params else None
+        limit = MAX_KLINES["kucoin"]
+    else:
+        raise KeyError(path)
+
+    end = min(end, now)
+    limit = min(limit, MAX_KLINES[exchange])
+    if start is not None:
+        limit = min(limit, max(0, (end // interval * interval - start) // interval + 1))
+    return exchange, symbol, interval, end, limit
+
+
+class StubExchangeHandler(BaseHTTPRequestHandler):
+    """ Request handler that answers kline requests of all supported exchanges. """
+
+    # keep connections alive like the real exchange APIs
+    protocol_version = "HTTP/1.1"
+
+    # artificial delay (in seconds) added to each response
+    latency = 0.
+
+    # fraction of requests that are answered with an error
+    error_rate = 0.
+
+    # number of times each request (same URL) is answered with an error before it succeeds
+    num_errors = 0
+
+    # status code and Retry-After header (in seconds, None to omit it) of the error responses
+    error_status = 429
+    retry_after = "1"
+
+    # symbols that are only listed on the Binance perps endpoint
+    perps_only = frozenset()
+
+    # recorded klines that are replayed for each exchange (see replay_klines)
+    fixtures = {}
+
+    # request weight used within the current minute (reported like the Binance API)
+    used_weight = {"minute": 0, "weight": 0}
+
+    # number of errors returned for each request URL (see num_errors)
+    error_counts = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            exchange, symbol, interval, end, limit = parse_request(url.path, params)
+        except (KeyError, ValueError):
+            self._send(404 if url.path not in PATHS else 400, {"msg": "Invalid request"})
+            return
+
+        time.sleep(self.latency)
+        if random.random() < self.error_rate or self._count_error():
+            headers = {} if self.retry_after is None else {"Retry-After": self.retry_after}
+            self._send(self.error_status, {"msg": HTTPStatus(self.error_status).phrase}, headers)
+            return
+        first = end // interval * interval - (limit - 1) * interval
+        if exchange == "gateio" and first < (int(time.time()) // interval - GATEIO_MAX_POINTS) * interval:
+            self._send(400, {
+                "label": "INVALID_PARAM_VALUE",
+                "message": f"Candlestick too long ago. Maximum {GATEIO_MAX_POINTS} points ago are allowed",
+            })
+            return
+        if url.path == "/api/v3/klines" and symbol in self.perps_only:
+            self._send(400, {"code": -1121, "msg": "Invalid symbol."})
+            return
+
+        if exchange in self.fixtures:
+            klines = replay_klines(self.fixtures[exchange], symbol, interval, end, limit)
+        else:
+            klines = get_klines(symbol, interval, end, limit)
+        self._send(200, format_klines(exchange, klines, interval), {"X-MBX-USED-WEIGHT-1M": str(self._add_weight(2))})
+
+    def log_message(self, format, *args):
+        pass
+
+    def _count_error(self) -> bool:
+        """ Return whether the request should be answered with one of its num_errors errors and count it. """
+        with self.lock:
+            count = self.error_counts.get(self.path, 0)
+            if count >= self.num_errors:
+                return False
+            self.error_counts[self.path] = count + 1
+            return True
+
+    def _add_weight(self, weight: int) -> int:
+        """ Add the given request weight to the current minute and return the used weight. """
+        with self.lock:
+            minute = int(time.time()) // 60
+            if self.used_weight["minute"] != minute:
+                self.used_weight.update(minute=minute, weight=0)
+            self.used_weight["weight"] += weight
+            return self.used_weight["weight"]
+
+    def _send(self, status: int, body: object, headers: Dict[str, str] = {}) -> None:
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def create_server(
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    latency: float = 0.,
+    error_rate: float = 0.,
+    perps_only: Iterable[str] = (),
+    fixtures: Dict[str, List[Tuple[int, float, float, float, float]]] = {},
+    num_errors: int = 0,
+    error_status: int = 429,
+    retry_after: Optional[float] = 1.,
+    ) -> ThreadingHTTPServer:
+    """
+    Create and return the stub server. Call serve_forever() on it (e.g. in a thread) to start it. Pass port 0 to
+    listen on a free port (see server.server_address). The errors are answered with the given status code and
+    Retry-After header (in seconds, None to omit it).
+    """
+    handler = type("Handler", (StubExchangeHandler,), {
+        "latency": latency,
+        "error_rate": error_rate,
+        "num_errors": num_errors,
+        "error_status": error_status,
+        "retry_after": None if retry_after is None else f"{retry_after:g}",
+        "perps_only": frozenset(perps_only),
+        "fixtures": fixtures,
+        "used_weight": {"minute": 0, "weight": 0},
+        "error_counts": {},
+        "lock": threading.Lock(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stub server for the exchange kline endpoints.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0., help="artificial delay per response in seconds")
+    parser.add_argument("--error-rate", type=float, default=0., help="fraction of requests answered with an error")
+    parser.add_argument("--num-errors", type=int, default=0, help="errors of each request before it succeeds")
+    parser.add_argument("--error-status", type=int, default=429, help="status code of the error responses")
+    parser.add_argument("--retry-after", type=float, default=1., help="Retry-After of the error responses in seconds")
+    parser.add_argument("--perps-only", nargs="*", default=[], help="symbols without a Binance spot listing")
+    parser.add_argument(
+        "--fixtures", nargs="?", const=os.path.join("benchmarks", "fixtures"), help="replay the recorded responses",
+    )
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else {}
+    server = create_server(
+        args.host, args.port, args.latency, args.error_rate, args.perps_only, fixtures, args.num_errors,
+        args.error_status, args.retry_after,
+    )
+    print(f"Stub exchange server running on http://{args.host}:{args.port}")
+    server.serve_forever()
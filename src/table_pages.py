@@ -0,0 +1,44 @@
+import numpy as np
+from typing import List, Optional, Tuple
+
+from src.snapshot_cache import get_market_data
+from src.snapshot_index import get_snapshot_index
+
+
+"""
+Server-side paging and sorting of the screener data tables.
+
+The data tables only receive the rows of the visible page. The row orders of all numeric columns and of the names are
+precomputed once per snapshot version and timeframe (see src/snapshot_index.py). A page request then only selects the
+coins of the current filter from the precomputed order and converts the rows of the page to records.
+"""
+
+
+def get_page(
+    version: int,
+    timeframe: str,
+    mask: np.ndarray,
+    columns: List[str],
+    sort_by: Optional[List[dict]],
+    page_current: int,
+    page_size: int,
+    ) -> Tuple[List[dict], int, int]:
+    """
+    Return the records (with the names as "id") of the given page of the coins selected by the boolean mask, the
+    number of pages and the index of the returned page (the last page if the given page does not exist). The coins
+    are sorted according to the sort_by property of the data table (only the first sort column is used), otherwise
+    they keep the order of the market data.
+    """
+    df = get_market_data(version, timeframe)
+    if sort_by:
+        order = get_snapshot_index(version, timeframe).orders[(sort_by[0]["column_id"], sort_by[0]["direction"])]
+    else:
+        order = np.arange(len(df))
+
+    selected = order[mask[order]]
+    page_count = max(1, -(-len(selected) // page_size))
+    page_current = min(page_current, page_count - 1)
+    page = selected[page_current * page_size:(page_current + 1) * page_size]
+    page_df = df.iloc[page][[column for column in columns if column != "id"]]
+    page_df.insert(0, "id", page_df.index)
+    return page_df.to_dict("records"), page_count, page_current
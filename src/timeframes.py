@@ -0,0 +1,84 @@
+import numpy as np
+
+
+"""
+Timeframes of the screeners and charts.
+
+Only klines of the base interval are fetched and stored. All timeframes are built locally by resampling the stored
+base klines, so every additional timeframe is free in terms of exchange requests. Timeframes are only available if
+they are a multiple of the base interval, i.e. the 15m timeframe needs 15 minute base klines (set BASE_INTERVAL to 15).
+
+The base history is sized for the largest available timeframe such that every timeframe has at least NUM_KLINES
+klines (enough for the EMA-50 and the pump look-back), e.g. 4800 1h klines for 200 1d klines. Histories longer than
+the maximum number of klines per request of an exchange are fetched in pages (see get_klines in
+src/exchange_data.py).
+"""
+
+BASE_INTERVAL = 60 # in minutes
+NUM_KLINES = 200 # minimum number of klines of each timeframe
+
+ALL_TIMEFRAMES = {"15m": 15, "1h": 60, "4h": 240, "1d": 1440}
+TIMEFRAMES = {name: interval for name, interval in ALL_TIMEFRAMES.items() if interval % BASE_INTERVAL == 0}
+DEFAULT_TIMEFRAME = "4h"
+
+NUM_BASE_KLINES = NUM_KLINES * max(TIMEFRAMES.values()) // BASE_INTERVAL
+
+# look-back periods in minutes
+DAY = 1440
+WEEK = 7 * DAY
+MONTH = 31 * DAY
+
+
+def get_look_back(interval: int, period: int) -> int:
+    """ Return the number of klines with the given interval that cover the given period (both in minutes). """
+    return max(1, period // interval)
+
+
+def resample_klines(klines: np.ndarray, base_interval: int, interval: int) -> np.ndarray:
+    """
+    Resample right-aligned klines of shape (coin, kline) with the base interval into klines with the given interval.
+    The klines are grouped by their (UTC aligned) start times, e.g. a 4h kline consists of the 1h klines starting at
+    00:00, 01:00, 02:00 and 03:00. The first kline of a coin is dropped if its group is incomplete, the last kline
+    remains open until all its base klines are closed. The result is right-aligned and padded in the same way.
+    """
+    if interval == base_interval:
+        return klines
+
+    # flatten all valid klines (sorted by coin and time) and find the first and last kline of each group
+    step = interval * 60
+    coins, positions = np.nonzero(~np.isnan(klines["close"]))
+    if len(coins) == 0:
+        return np.zeros((len(klines), 0), dtype=klines.dtype)
+
+    flat = klines[coins, positions]
+    groups = flat["timestamp"] // step
+    is_start = np.ones(len(flat), dtype=bool)
+    is_start[1:] = (coins[1:] != coins[:-1]) | (groups[1:] != groups[:-1])
+    starts = np.flatnonzero(is_start)
+    ends = np.append(starts[1:], len(flat)) - 1
+
+    resampled = np.empty(len(starts), dtype=klines.dtype)
+    resampled["timestamp"] = groups[starts] * step
+    resampled["open"] = flat["open"][starts]
+    resampled["high"] = np.maximum.reduceat(flat["high"], starts)
+    resampled["low"] = np.minimum.reduceat(flat["low"], starts)
+    resampled["close"] = flat["close"][ends]
+
+    # drop the first kline of a coin if it does not start at the beginning of its group
+    group_coins = coins[starts]
+    is_first = np.ones(len(starts), dtype=bool)
+    is_first[1:] = group_coins[1:] != group_coins[:-1]
+    keep = ~is_first | (flat["timestamp"][starts] == resampled["timestamp"])
+    resampled, group_coins = resampled[keep], group_coins[keep]
+
+    # right-align the resampled klines of each coin
+    counts = np.bincount(group_coins, minlength=len(klines))
+    offsets = np.cumsum(counts) - counts
+    width = counts.max()
+    columns = width - counts[group_coins] + np.arange(len(resampled)) - offsets[group_coins]
+
+    result = np.zeros((len(klines), width), dtype=klines.dtype)
+    for field in ["open", "high", "low", "close"]:
+        result[field] = np.nan
+    result[group_coins, columns] = resampled
+    return result
@@ -2,17 +2,6 @@ import pandas as pd
 from typing import List
 
 
-def filter_df(df: pd.DataFrame, filter: str) -> pd.DataFrame:
-    """ Filter and return data frame according to the current radio item selection. """
-    if filter == "All":
-        return df
-    elif filter == "Watchlist":
-        return df[df["watchlist"] == 1]
-    else:
-        tier_number = int(filter.replace("Tier ", ""))
-        return df[df["tier"] == tier_number]
-
-
 def get_emas(close: pd.Series, ema_lengths: List[int]) -> List[pd.Series]:
     """ Compute and return EMAs given the close values and EMA lengths. """
     return [
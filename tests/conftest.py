@@ -0,0 +1,33 @@
+import threading
+import pytest
+
+from src import fetcher
+from src.stub_exchange import create_server
+
+
+"""
+Fixtures shared by the tests.
+"""
+
+
+@pytest.fixture
+def stub_exchange(monkeypatch):
+    """
+    Return a function that starts a stub server (see src/stub_exchange.py) with the given arguments on a free port
+    and sends all exchange requests to it. The weight budgets of the exchanges start empty in each test.
+    """
+    servers = []
+    monkeypatch.setattr(fetcher, "_budgets", {})
+
+    def start(**kwargs):
+        server = create_server(port=0, **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        host, port = server.server_address
+        monkeypatch.setenv("EXCHANGE_API_URL", f"http://{host}:{port}")
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
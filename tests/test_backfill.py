@@ -0,0 +1,78 @@
+import time
+import numpy as np
+import pandas as pd
+import pytest
+
+import backfill_klines
+from backfill_klines import backfill, load_checkpoint
+from src.kline_store import INDEX_FILE, KLINES_FILE, BTC_KLINES_FILE, KLINE_DTYPE
+from src.stub_exchange import GATEIO_MAX_POINTS
+
+
+"""
+Checks of the resumable backfill (see backfill_klines.py) against the stub exchange (see src/stub_exchange.py).
+
+The backfill reaches further back than Gate.io serves klines, so the history of the Gate.io coin is cut short.
+"""
+
+INTERVAL = 60 # in minutes
+NUM_KLINES = 12000
+
+
+@pytest.fixture
+def info_df() -> pd.DataFrame:
+    return pd.DataFrame(
+        index=pd.Index(["BTC", "ETH", "GT", "HT"], name="name"),
+        data={
+            "exchange": ["binance", "bybit", "gateio", "huobi"],
+            "symbol": ["BTCUSDT", "ETHUSDT", "GT_USDT", "htusdt"],
+        },
+    )
+
+
+@pytest.fixture
+def fixed_time(monkeypatch):
+    """ Freeze the clock (also of the stub exchange) such that all backfills of a test end with the same kline. """
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    return now
+
+
+def read_store(directory) -> tuple:
+    index_df = pd.read_csv(directory / INDEX_FILE, index_col="name")
+    return np.load(directory / KLINES_FILE), np.load(directory / BTC_KLINES_FILE), index_df
+
+
+def test_interrupted_backfill_resumes_from_its_checkpoint(stub_exchange, info_df, fixed_time, tmp_path, monkeypatch):
+    stub_exchange()
+    start = int(fixed_time) // 3600 * 3600 - NUM_KLINES * INTERVAL * 60
+    backfill(info_df, INTERVAL, start, str(tmp_path / "complete"))
+    klines, btc_klines, index_df = read_store(tmp_path / "complete")
+
+    # interrupt the backfill after its third round
+    get_kline_pages = backfill_klines.get_kline_pages
+    calls = []
+    def interrupted_get_kline_pages(*args):
+        calls.append(args)
+        if len(calls) > 3:
+            raise KeyboardInterrupt
+        return get_kline_pages(*args)
+
+    monkeypatch.setattr(backfill_klines, "get_kline_pages", interrupted_get_kline_pages)
+    with pytest.raises(KeyboardInterrupt):
+        backfill(info_df, INTERVAL, start, str(tmp_path / "resumed"))
+    assert load_checkpoint(str(tmp_path / "resumed"))["round"] == 3
+
+    monkeypatch.setattr(backfill_klines, "get_kline_pages", get_kline_pages)
+    backfill(info_df, INTERVAL, start, str(tmp_path / "resumed"))
+    assert load_checkpoint(str(tmp_path / "resumed")) is None
+    resumed_klines, resumed_btc_klines, resumed_index_df = read_store(tmp_path / "resumed")
+    for field in KLINE_DTYPE.names:
+        np.testing.assert_array_equal(resumed_klines[field], klines[field])
+        np.testing.assert_array_equal(resumed_btc_klines[field], btc_klines[field])
+    pd.testing.assert_frame_equal(resumed_index_df, index_df)
+
+    # Huobi only returns its most recent klines (including the open one) and Gate.io rejects klines that are too old
+    num_klines = {"BTC": NUM_KLINES, "ETH": NUM_KLINES, "GT": GATEIO_MAX_POINTS, "HT": 2000 - 1}
+    assert index_df["num_klines"].to_dict() == num_klines
+    assert index_df["complete"].to_dict() == {"BTC": True, "ETH": True, "GT": False, "HT": True}
@@ -0,0 +1,63 @@
+import time
+import pytest
+
+from src import fetcher
+from src.exchange_data import BINANCE_ENDPOINT
+from src.fetcher import BACKOFF_MAX, MAX_RETRIES, KlineRequest, fetch_all
+
+
+"""
+Checks of the retries and rate limit handling of the request engine against the stub exchange (see
+src/stub_exchange.py), which answers each request with the given number of errors before it succeeds.
+"""
+
+
+def get_requests(symbols: list) -> list:
+    return [
+        KlineRequest("binance", BINANCE_ENDPOINT, {"symbol": symbol, "interval": "1h", "limit": 10}, weight=2)
+        for symbol in symbols
+    ]
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(fetcher, "BACKOFF_BASE", 0.01)
+
+
+def test_server_errors_are_retried(stub_exchange):
+    stub_exchange(num_errors=2, error_status=500, retry_after=None)
+    results = fetch_all(get_requests(["BTCUSDT", "ETHUSDT"]))
+    assert [result.attempts for result in results] == [3, 3]
+    assert all(result.response.status_code == 200 for result in results)
+
+
+def test_requests_fail_after_all_retries(stub_exchange):
+    stub_exchange(num_errors=MAX_RETRIES + 1, error_status=503, retry_after=None)
+    result, = fetch_all(get_requests(["BTCUSDT"]))
+    assert result.response is None
+    assert result.attempts == MAX_RETRIES + 1
+
+
+@pytest.mark.parametrize("status", [418, 429])
+def test_rate_limits_pause_for_the_retry_after_period(stub_exchange, status):
+    stub_exchange(num_errors=1, error_status=status, retry_after=1.)
+    start = time.monotonic()
+    results = fetch_all(get_requests(["BTCUSDT", "ETHUSDT"]))
+    assert time.monotonic() - start >= 1.
+    assert [result.attempts for result in results] == [2, 2]
+    assert all(result.response.status_code == 200 for result in results)
+
+
+@pytest.mark.parametrize("status", [418, 429])
+def test_long_retry_after_periods_fail_early(stub_exchange, status):
+    server = stub_exchange(num_errors=1, error_status=status, retry_after=10 * BACKOFF_MAX)
+    start = time.monotonic()
+    result, = fetch_all(get_requests(["BTCUSDT"]))
+    assert time.monotonic() - start < 1.
+    assert result.response is None
+    assert result.attempts == 1
+
+    # the budget of the exchange stays paused, further requests fail without being sent
+    result, = fetch_all(get_requests(["ETHUSDT"]))
+    assert result.response is None
+    assert len(server.RequestHandlerClass.error_counts) == 1
@@ -0,0 +1,83 @@
+import time
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.indicators import EMA_LENGTHS, IndicatorState
+from src.kline_store import KLINE_DTYPE
+
+
+"""
+Checks of the incremental updates of IndicatorState against full rebuilds and the EMAs of pandas.
+
+The state is built from a prefix of the klines, the remaining klines are then added one at a time like in the
+streaming service (see src/streaming.py): every kline is first set as provisional kline with intermediate prices and
+then with its final prices, and it is appended once the next kline started.
+"""
+
+INTERVAL = 4 * 3600 # in seconds
+NUM_KLINES = 300
+NUM_PREFIX_KLINES = 200
+RTOL = 1e-9
+
+# number of klines of each coin, shorter histories are padded with NaN prices at the beginning
+LENGTHS = {"FULL": NUM_KLINES, "PADDED": 250, "SHORT": 120, "NEW": 60, "NEW_TINY": 3}
+
+
+@pytest.fixture
+def klines() -> np.ndarray:
+    rng = np.random.default_rng(7)
+    end = int(time.time()) // INTERVAL * INTERVAL - INTERVAL
+    klines = np.zeros((len(LENGTHS), NUM_KLINES), dtype=KLINE_DTYPE)
+    klines["timestamp"] = end - INTERVAL * np.arange(NUM_KLINES - 1, -1, -1)
+    for row, num_klines in enumerate(LENGTHS.values()):
+        close = 10. * np.exp(np.cumsum(rng.normal(0., 0.02, NUM_KLINES)))
+        open = np.concatenate([[10.], close[:-1]]) * (1. + rng.normal(0., 0.005, NUM_KLINES))
+        close[-num_klines::25] = open[-num_klines::25] * 1.3
+        klines["open"][row], klines["close"][row] = open, close
+        klines["high"][row] = np.maximum(open, close) * 1.01
+        klines["low"][row] = np.minimum(open, close) * 0.99
+        klines[row, :NUM_KLINES - num_klines] = (0, np.nan, np.nan, np.nan, np.nan)
+    return klines
+
+
+def reference_emas(klines: np.ndarray) -> np.ndarray:
+    emas = np.full((len(EMA_LENGTHS), len(klines)), np.nan)
+    for row in range(len(klines)):
+        close = pd.Series(klines["close"][row]).dropna()
+        if len(close) > 0:
+            emas[:, row] = [close.ewm(span=length).mean().iloc[-1] for length in EMA_LENGTHS]
+    return emas
+
+
+def test_incremental_updates_match_full_rebuilds(klines):
+    rows = np.arange(len(klines))
+    state = IndicatorState.from_klines(klines[:, :NUM_PREFIX_KLINES])
+    assert np.all(np.isnan(state.get_emas()[:, list(LENGTHS).index("NEW")]))
+
+    num_pumps = 0
+    for column in range(NUM_PREFIX_KLINES, NUM_KLINES):
+        state.append(rows, klines[:, column - 1])
+        provisional = klines[:, column].copy()
+        provisional["close"] = provisional["open"] * 1.05
+        state.set_provisional(rows, provisional)
+        state.set_provisional(rows, klines[:, column])
+
+        expected = IndicatorState.from_klines(klines[:, :column + 1])
+        np.testing.assert_allclose(state.get_emas(), reference_emas(klines[:, :column + 1]), rtol=RTOL)
+        np.testing.assert_allclose(state.get_emas(), expected.get_emas(), rtol=RTOL)
+        np.testing.assert_allclose(state.get_trend_strengths(), expected.get_trend_strengths(), rtol=RTOL)
+        np.testing.assert_allclose(state.get_pump_strengths(), expected.get_pump_strengths(), rtol=RTOL, atol=RTOL)
+        num_pumps += np.count_nonzero(state.get_pump_strengths() > 0)
+
+    assert num_pumps > 0
+
+
+def test_replaced_rows_match_full_rebuilds(klines):
+    rows = np.array([1, 3])
+    state = IndicatorState.from_klines(klines[:, :NUM_PREFIX_KLINES])
+    state.replace(rows, IndicatorState.from_klines(klines[rows]))
+
+    expected = IndicatorState.from_klines(klines[rows])
+    np.testing.assert_allclose(state.get_emas(rows), expected.get_emas(), rtol=RTOL)
+    np.testing.assert_allclose(state.get_pump_strengths(rows), expected.get_pump_strengths(), rtol=RTOL, atol=RTOL)
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from src.kline_store import KLINE_DTYPE, get_btc_denominated_klines
+from src.market_data import BTC_GAIN_PERIODS, add_btc_pair_metrics
+from src.timeframes import get_look_back
+
+
+"""
+Checks of the klines denominated in BTC against the klines of the actual BTC pair prices.
+
+The prices of an altcoin and of Bitcoin are simulated per minute and aggregated into 1h klines. The klines of the BTC
+pair computed from the aggregated klines are compared with the klines aggregated from the per minute BTC pair prices,
+which are unknown in practice.
+"""
+
+INTERVAL = 60 # in minutes
+NUM_KLINES = 800
+
+
+def aggregate(prices: np.ndarray, start: int) -> np.ndarray:
+    """ Return the klines of shape (1, kline) of the given per minute prices. """
+    minutes = prices.reshape(-1, INTERVAL)
+    klines = np.zeros((1, len(minutes)), dtype=KLINE_DTYPE)
+    klines["timestamp"] = start + INTERVAL * 60 * np.arange(len(minutes))
+    klines["open"], klines["close"] = minutes[:, 0], minutes[:, -1]
+    klines["high"], klines["low"] = minutes.max(axis=1), minutes.min(axis=1)
+    return klines
+
+
+def simulate(seed: int):
+    rng = np.random.default_rng(seed)
+    num_minutes = NUM_KLINES * INTERVAL
+    btc_prices = 30000. * np.exp(np.cumsum(rng.normal(0., 0.001, num_minutes)))
+    alt_prices = btc_prices * 1e-4 * np.exp(np.cumsum(rng.normal(0., 0.0015, num_minutes)))
+    start = 1_600_000_000 // 3600 * 3600
+    return aggregate(alt_prices, start), aggregate(btc_prices, start), aggregate(alt_prices / btc_prices, start)
+
+
+def test_btc_pair_klines_bound_the_actual_prices():
+    for seed in range(5):
+        alt_klines, btc_klines, pair_klines = simulate(seed)
+        klines = get_btc_denominated_klines(alt_klines, btc_klines[0])
+
+        np.testing.assert_allclose(klines["open"], pair_klines["open"], rtol=1e-12)
+        np.testing.assert_allclose(klines["close"], pair_klines["close"], rtol=1e-12)
+        assert np.all(klines["high"] >= pair_klines["high"] * (1. - 1e-12))
+        assert np.all(klines["low"] <= pair_klines["low"] * (1. + 1e-12))
+        assert np.all(klines["high"] >= np.maximum(klines["open"], klines["close"]))
+        assert np.all(klines["low"] <= np.minimum(klines["open"], klines["close"]))
+
+
+def test_btc_pair_gains_are_upper_bounds_of_the_actual_gains():
+    look_back = [get_look_back(INTERVAL, period) for period in BTC_GAIN_PERIODS.values()]
+    for seed in range(5):
+        alt_klines, btc_klines, pair_klines = simulate(seed)
+        klines = get_btc_denominated_klines(alt_klines, btc_klines[0])
+        df = add_btc_pair_metrics(pd.DataFrame(index=["ALT"]), klines, INTERVAL)
+
+        for column, offset in zip(BTC_GAIN_PERIODS, look_back):
+            expected = klines["close"][0, -1] / np.min(klines["low"][0, -offset:]) - 1.
+            actual = pair_klines["close"][0, -1] / np.min(pair_klines["low"][0, -offset:]) - 1.
+            np.testing.assert_allclose(df.loc["ALT", column], expected, rtol=1e-12)
+            assert actual <= df.loc["ALT", column] + 1e-12
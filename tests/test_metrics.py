@@ -0,0 +1,102 @@
+import time
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.kline_store import stack_klines
+from src.metrics import get_gains, get_pump_strengths, get_trend_strengths
+
+
+"""
+Comparison of the vectorized metrics in src/metrics.py with the original pandas implementation.
+
+The reference functions below are the per coin computations of _add_gains, _add_trend_strengths and
+_add_pump_strengths as they were implemented in src/market_data.py before the metrics were vectorized.
+"""
+
+INTERVAL = 4 * 3600 # in seconds
+LOOK_BACK = [6, 42, 180] # in klines
+RTOL = 1e-9
+
+
+def reference_gains(kline_dict: dict, look_back: list) -> pd.DataFrame:
+    gains = {}
+    for name, klines in kline_dict.items():
+        lows = [klines["low"].iloc[-offset:].min() for offset in look_back]
+        gains[name] = [klines["close"].iloc[-1] / low - 1 for low in lows]
+    return pd.DataFrame.from_dict(gains, orient="index")
+
+
+def reference_trend_strengths(kline_dict: dict) -> pd.Series:
+    strengths = {}
+    for name, klines in kline_dict.items():
+        if time.time() - klines["timestamp"].iloc[-1] < 3600:
+            klines = klines.iloc[:-1]
+        ema_12, ema_21, ema_50 = [klines["close"].ewm(span=length).mean().iloc[-1] for length in [12, 21, 50]]
+        strengths[name] = np.mean([ema_12 / ema_21, ema_21 / ema_50]) - 1
+    return pd.Series(strengths)
+
+
+def reference_pump_strengths(kline_dict: dict, look_back: int = 42) -> pd.Series:
+    strengths = {}
+    for name, klines in kline_dict.items():
+        klines = klines.iloc[-look_back:]
+        ranges = klines["close"] - klines["open"]
+        max_range = ranges.iloc[-3:].max()
+        mean = ranges.iloc[:-3].abs().mean()
+        std = ranges.iloc[:-3].abs().std()
+        strengths[name] = max_range / mean - 1 if max_range > mean + 2 * std else 0
+    return pd.Series(strengths)
+
+
+def create_klines(rng: np.random.Generator, num_klines: int, end: int, pump: bool = False) -> pd.DataFrame:
+    """ Return a random walk of num_klines klines, the last one starting at the given timestamp (in seconds). """
+    close = 10. * np.exp(np.cumsum(rng.normal(0., 0.02, num_klines)))
+    open = np.concatenate([[10.], close[:-1]])
+    if pump:
+        close[-2] = open[-2] * 1.3
+        open[-1], close[-1] = close[-2], close[-2] * 1.1
+    high = np.maximum(open, close) * (1. + rng.uniform(0., 0.01, num_klines))
+    low = np.minimum(open, close) * (1. - rng.uniform(0., 0.01, num_klines))
+    timestamp = end - INTERVAL * np.arange(num_klines - 1, -1, -1)
+    return pd.DataFrame({"timestamp": timestamp, "open": open, "high": high, "low": low, "close": close})
+
+
+@pytest.fixture
+def kline_dict() -> dict:
+    rng = np.random.default_rng(42)
+    closed = int(time.time()) // INTERVAL * INTERVAL - INTERVAL
+    return {
+        "FULL": create_klines(rng, 500, closed),
+        "PUMP": create_klines(rng, 500, closed, pump=True),
+        "FRESH": create_klines(rng, 500, int(time.time()) - 600),
+        "FRESH_SHORT": create_klines(rng, 30, int(time.time()) - 600),
+        "MEDIUM": create_klines(rng, 100, closed),
+        "SHORT": create_klines(rng, 20, closed, pump=True),
+        "TINY": create_klines(rng, 4, closed),
+        "SINGLE": create_klines(rng, 1, closed),
+    }
+
+
+def test_gains(kline_dict):
+    names = list(kline_dict)
+    expected = reference_gains(kline_dict, LOOK_BACK)
+    gains = get_gains(stack_klines(kline_dict, names, max(LOOK_BACK)), LOOK_BACK)
+    for i, values in enumerate(gains):
+        np.testing.assert_allclose(values, expected[i].loc[names].values, rtol=RTOL)
+
+
+def test_trend_strengths(kline_dict):
+    names = list(kline_dict)
+    expected = reference_trend_strengths(kline_dict).loc[names].values
+    num_klines = max(len(klines) for klines in kline_dict.values())
+    strengths = get_trend_strengths(stack_klines(kline_dict, names, num_klines))
+    np.testing.assert_allclose(strengths, expected, rtol=RTOL)
+
+
+def test_pump_strengths(kline_dict):
+    names = list(kline_dict)
+    expected = reference_pump_strengths(kline_dict).loc[names].values
+    assert expected[names.index("PUMP")] > 0
+    strengths = get_pump_strengths(stack_klines(kline_dict, names, 42))
+    np.testing.assert_allclose(strengths, expected, rtol=RTOL)